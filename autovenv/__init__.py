@@ -8,12 +8,17 @@ Autovenv helps you manage your virtual environments.
 
 from __future__ import absolute_import, division, print_function, unicode_literals
 
-from .virtualenvs import VirtualEnvs, get_likely_projfolder, DEFAULT_CONFIG
+# first, so that with AUTOVENV_TRACE set, the trace covers the imports
+from . import tracing  # noqa
+
 from .util import create_symlink, mkdir_p, file_exists, resolve_path  # noqa
 
 from .command import do_command
 
 __all__ = [
+    "Resolver",
+    "Result",
+    "AutovenvError",
     "VirtualEnvs",
     "DEFAULT_CONFIG",
     "do_command",
@@ -21,3 +26,27 @@ __all__ = [
     "create_symlink",
     "mkdir_p",
 ]
+
+# Loaded on first access rather than at import, so that the shell hook
+# entry point (which imports this package) stays cheap to start.
+LAZY = {
+    "Resolver": "api",
+    "Result": "api",
+    "AutovenvError": "api",
+    "VirtualEnvs": "virtualenvs",
+    "get_likely_projfolder": "virtualenvs",
+    "DEFAULT_CONFIG": "virtualenvs",
+}
+
+
+def __getattr__(name):
+    if name in LAZY:
+        import importlib
+
+        module = importlib.import_module("." + LAZY[name], __name__)
+        return getattr(module, name)
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
+
+def __dir__():
+    return sorted(list(globals()) + list(LAZY))
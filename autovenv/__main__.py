@@ -0,0 +1,3 @@
+from .command import do_command
+
+do_command()
@@ -0,0 +1,161 @@
+"""
+Activating and deactivating venvs by setting the environment directly,
+rather than by sourcing the venv's activate script.
+
+The commands here do what bin/activate and deactivate do (VIRTUAL_ENV,
+the venv's bin/ at the front of PATH, PYTHONHOME unset, the prompt),
+and keep the same _OLD_VIRTUAL_* variables, so a venv activated either
+way can be deactivated either way. Switching from one venv to another
+is done in one step, without deactivating in between: PATH just has the
+old venv's bin/ swapped for the new one's.
+
+They're built to survive the bash hook, which runs the output of
+"autovenv bash" unquoted (so it's split into words and rejoined by
+eval), so nothing here depends on runs of spaces.
+"""
+
+import os
+
+from .util import shquote
+
+# Kept in _OLD_FISH_PROMPT_OVERRIDE, to tell our prompt from one set up
+# by a venv's own activate.fish (which keeps the venv's path there).
+FISH_PROMPT_MARKER = "autovenv"
+
+
+def prompt_name(venv_path):
+    return os.path.basename(venv_path.rstrip(os.sep))
+
+
+def bash_deactivate():
+    return [
+        'PATH=${_OLD_VIRTUAL_PATH-${PATH#"$VIRTUAL_ENV/bin:"}}',
+        "unset _OLD_VIRTUAL_PATH",
+        'test -z "${_OLD_VIRTUAL_PYTHONHOME-}"'
+        " || export PYTHONHOME=$_OLD_VIRTUAL_PYTHONHOME",
+        "unset _OLD_VIRTUAL_PYTHONHOME",
+        'test -z "${_OLD_VIRTUAL_PS1+x}" || PS1=$_OLD_VIRTUAL_PS1',
+        "unset _OLD_VIRTUAL_PS1 VIRTUAL_ENV VIRTUAL_ENV_PROMPT",
+        "unset -f deactivate",
+        "hash -r",
+    ]
+
+
+def bash_activate(venv_path, switching):
+    """Commands to activate the venv at venv_path; switching says whether
+    another venv is active already.
+    """
+    venv = shquote(venv_path)
+    bin_path = shquote(os.path.join(venv_path, "bin"))
+    name = prompt_name(venv_path)
+
+    if switching:
+        commands = [
+            'PATH={}:${{PATH#"$VIRTUAL_ENV/bin:"}}'.format(bin_path),
+            "unset PYTHONHOME",
+            "_OLD_VIRTUAL_PS1=${_OLD_VIRTUAL_PS1-${PS1-}}",
+        ]
+    else:
+        commands = [
+            "_OLD_VIRTUAL_PATH=$PATH",
+            "PATH={}:$PATH".format(bin_path),
+            "_OLD_VIRTUAL_PYTHONHOME=${PYTHONHOME-}",
+            "unset PYTHONHOME",
+            "_OLD_VIRTUAL_PS1=${PS1-}",
+            "deactivate () {{ {}; }}".format("; ".join(bash_deactivate())),
+        ]
+
+    commands += [
+        "export VIRTUAL_ENV={} VIRTUAL_ENV_PROMPT={}".format(venv, shquote(name)),
+        'test -n "${{VIRTUAL_ENV_DISABLE_PROMPT-}}"'
+        ' || PS1={}"$_OLD_VIRTUAL_PS1"'.format(shquote("({}) ".format(name))),
+        "hash -r",
+    ]
+    return commands
+
+
+def fish_restore_prompt():
+    return (
+        "functions -e fish_prompt; functions -c _old_fish_prompt fish_prompt;"
+        " functions -e _old_fish_prompt"
+    )
+
+
+def fish_install_prompt():
+    return (
+        'if test -z "$VIRTUAL_ENV_DISABLE_PROMPT"; functions -c fish_prompt'
+        " _old_fish_prompt; function fish_prompt; set -l old_status $status;"
+        " printf '(%s) ' $VIRTUAL_ENV_PROMPT; echo \"exit $old_status\" | .;"
+        " _old_fish_prompt; end; set -gx _OLD_FISH_PROMPT_OVERRIDE {}; end".format(
+            FISH_PROMPT_MARKER
+        )
+    )
+
+
+def fish_deactivate():
+    return [
+        "if set -q _OLD_VIRTUAL_PATH; set -gx PATH $_OLD_VIRTUAL_PATH; else;"
+        ' set -gx PATH (string match -v -- "$VIRTUAL_ENV/bin" $PATH); end',
+        "set -e _OLD_VIRTUAL_PATH",
+        "if set -q _OLD_VIRTUAL_PYTHONHOME;"
+        " set -gx PYTHONHOME $_OLD_VIRTUAL_PYTHONHOME; end",
+        "set -e _OLD_VIRTUAL_PYTHONHOME",
+        "if set -q _OLD_FISH_PROMPT_OVERRIDE; {}; end".format(fish_restore_prompt()),
+        "set -e _OLD_FISH_PROMPT_OVERRIDE",
+        "set -e VIRTUAL_ENV",
+        "set -e VIRTUAL_ENV_PROMPT",
+        "functions -e deactivate",
+    ]
+
+
+def fish_activate(venv_path, switching):
+    """Commands to activate the venv at venv_path; switching says whether
+    another venv is active already.
+
+    Our prompt shows whatever's in VIRTUAL_ENV_PROMPT, so switching only
+    has to replace a prompt that was set up by a venv's activate.fish.
+    """
+    venv = shquote(venv_path)
+    bin_path = shquote(os.path.join(venv_path, "bin"))
+
+    if switching:
+        commands = [
+            'set -gx PATH {} (string match -v -- "$VIRTUAL_ENV/bin" $PATH)'.format(
+                bin_path
+            ),
+            "set -e PYTHONHOME",
+            "set -gx VIRTUAL_ENV {}".format(venv),
+            "set -gx VIRTUAL_ENV_PROMPT {}".format(shquote(prompt_name(venv_path))),
+            "if set -q _OLD_FISH_PROMPT_OVERRIDE;"
+            ' and test "$_OLD_FISH_PROMPT_OVERRIDE" != {}; {}; {}; end'.format(
+                FISH_PROMPT_MARKER, fish_restore_prompt(), fish_install_prompt()
+            ),
+        ]
+    else:
+        commands = [
+            "set -gx _OLD_VIRTUAL_PATH $PATH",
+            "set -gx PATH {} $PATH".format(bin_path),
+            "if set -q PYTHONHOME; set -gx _OLD_VIRTUAL_PYTHONHOME $PYTHONHOME;"
+            " set -e PYTHONHOME; end",
+            "set -gx VIRTUAL_ENV {}".format(venv),
+            "set -gx VIRTUAL_ENV_PROMPT {}".format(shquote(prompt_name(venv_path))),
+            fish_install_prompt(),
+            "function deactivate; {}; end".format("; ".join(fish_deactivate())),
+        ]
+    return commands
+
+
+def activate_command(shell, venv_path, switching):
+    if shell == "fish":
+        commands = fish_activate(venv_path, switching)
+    else:
+        commands = bash_activate(venv_path, switching)
+    return "; ".join(commands)
+
+
+def deactivate_command(shell):
+    if shell == "fish":
+        commands = fish_deactivate()
+    else:
+        commands = bash_deactivate()
+    return "; ".join(commands)
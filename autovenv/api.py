@@ -0,0 +1,179 @@
+"""
+A library API, for tools that want to know (or make sure of) the venv
+for a path without shelling out to the autovenv command:
+
+    from autovenv import Resolver
+
+    resolver = Resolver()
+    result = resolver.resolve("~/src/project/app")
+    if result.venv_path is not None and not result.exists:
+        result = resolver.ensure(result.path)
+
+A Resolver can be kept around and used for any number of paths (from
+any number of threads). It looks at the filesystem afresh on each call,
+apart from what the resolution cache (see resolution.py) can vouch for,
+and picks up changes to the config file.
+
+Creating a venv takes a while, so ensure() does it in a worker process,
+with the output going to a log under <data_dir>/logs/create rather than
+to this process's stdout. aresolve() and aensure() are coroutines that
+do the same work in an executor, without blocking the event loop.
+"""
+
+import os
+import threading
+import collections
+
+# The answer for a path. Everything but path and exists is None if the
+# path isn't within a python project.
+Result = collections.namedtuple(
+    "Result", "path project venv_name venv_path python_build exists"
+)
+
+
+class AutovenvError(Exception):
+    pass
+
+
+def result_for(path, r):
+    """The Result for path, from its Resolution r."""
+    in_project = r.in_project
+    return Result(
+        path=path,
+        project=r.projfolder or None,
+        venv_name=r.venv_name or None,
+        venv_path=r.venv_path if in_project else None,
+        python_build=r.pythonbuild if in_project else None,
+        exists=r.venv_exists,
+    )
+
+
+class Resolver(object):
+    """
+    Works out which venv goes with a path, and creates it on request.
+
+    home and data_dir default to the current user's, as for the autovenv
+    command. executor is what the async methods run their work in (by
+    default, the event loop's default executor).
+    """
+
+    def __init__(self, data_dir=None, home=None, executor=None):
+        from .virtualenvs import VirtualEnvs
+
+        home = home or os.path.expanduser("~")
+        self._v = VirtualEnvs(data_dir=data_dir, home=home, cwd=home, virtual_env="")
+        self._lock = threading.Lock()
+        self._creating = collections.defaultdict(threading.Lock)
+        self.executor = executor
+
+    @property
+    def data_dir(self):
+        return self._v.data_dir
+
+    @property
+    def home(self):
+        return self._v.home
+
+    def _resolve(self, path):
+        path = os.path.expanduser(path)
+        with self._lock:
+            self._v.forget()
+            return self._v.resolve(path)
+
+    def resolve(self, path):
+        """Returns the Result for path (a file or folder)."""
+        return result_for(path, self._resolve(path))
+
+    def resolve_many(self, paths):
+        """Returns a list of the Results for paths. Quicker than resolving
+        them one at a time, since each folder is looked at only once.
+        """
+        with self._lock:
+            self._v.forget()
+            return [
+                result_for(path, self._v.resolve(os.path.expanduser(path), cache=False))
+                for path in paths
+            ]
+
+    def ensure(self, path):
+        """Creates the venv for path if it doesn't exist yet, returning the
+        Result. Raises AutovenvError if path isn't within a python project,
+        or if creating the venv fails.
+        """
+        from .bulk import Venv, create_one
+
+        r = self._resolve(path)
+        if not r.in_project:
+            raise AutovenvError("not within a python project: {}".format(path))
+
+        with self._creating[r.venv_path]:
+            if os.path.exists(r.venv_path):
+                return result_for(path, r.replace(venv_exists=True))
+
+            venv = Venv(
+                path=r.venv_path,
+                name=r.venv_name,
+                build=r.pythonbuild,
+                framework=r.use_framework_build,
+                project=r.projfolder,
+            )
+            # spawned rather than forked, which isn't safe in a process
+            # that may have other threads going (eg. an executor's)
+            outcome = create_one(self._v, venv, context=spawn_context())
+
+        if not outcome.ok:
+            reason = " ({})".format(outcome.error) if outcome.error else ""
+            raise AutovenvError(
+                "creating {} failed{}, see {}".format(
+                    r.venv_path, reason, outcome.task.log_path
+                )
+            )
+        return result_for(path, r.replace(venv_exists=True))
+
+    async def _run(self, f, *args):
+        import asyncio
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, f, *args)
+
+    async def aresolve(self, path):
+        """Like resolve, without blocking the event loop."""
+        return await self._run(self.resolve, path)
+
+    async def aresolve_many(self, paths):
+        """Like resolve_many, without blocking the event loop."""
+        return await self._run(self.resolve_many, list(paths))
+
+    async def aensure(self, path):
+        """Like ensure, without blocking the event loop."""
+        return await self._run(self.ensure, path)
+
+
+def spawn_context():
+    import multiprocessing
+
+    return multiprocessing.get_context("spawn")
+
+
+def resolve_paths(v, paths=None):
+    """Prints the resolution of each path (read from stdin, one per
+    line, if none are given) as a line of JSON, for "autovenv resolve".
+    Folders are listed at most once across all the paths, so this is
+    much quicker than resolving each path separately.
+    """
+    import sys
+    import json
+
+    interactive = paths is None
+    if interactive:
+        paths = (line.rstrip("\n") for line in sys.stdin)
+
+    for path in paths:
+        if not path:
+            continue
+        # the shared memo makes the on-disk cache a waste of opens here
+        r = v.resolve(path, cache=False)
+        print(json.dumps(result_for(path, r)._asdict(), sort_keys=True))
+        if interactive:
+            # so a client can send a path and wait for its answer
+            sys.stdout.flush()
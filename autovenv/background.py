@@ -0,0 +1,198 @@
+"""
+Creating venvs in a detached background job, so the shell hook can
+return straight away instead of freezing the shell until the venv is
+built.
+
+Each job has three files under <data_dir>/builds, named after the venv:
+
+  - <key>.json, the status: written as "running" when the job is started,
+    updated to "failed" if it fails, and removed once the venv is ready
+  - <key>.lock, flock'd by the job for as long as it runs
+  - <key>.log, the job's output
+"""
+
+import os
+import io
+import sys
+import json
+import time
+import errno
+
+RUNNING = "running"
+FAILED = "failed"
+INTERRUPTED = "interrupted"
+
+
+def builds_path(data_dir):
+    return os.path.join(data_dir, "builds")
+
+
+def build_key(venvspath, venv_path):
+    return os.path.relpath(venv_path, venvspath).replace(os.sep, "__")
+
+
+class Job(object):
+    def __init__(self, data_dir, key):
+        base = os.path.join(builds_path(data_dir), key)
+        self.key = key
+        self.status_path = base + ".json"
+        self.lock_path = base + ".lock"
+        self.log_path = base + ".log"
+
+    @classmethod
+    def for_venv(cls, v, venv_path):
+        return cls(v.data_dir, build_key(v.venvspath, venv_path))
+
+    def read_status(self):
+        try:
+            with io.open(self.status_path) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return None
+
+    def write_status(self, **status):
+        tmp = "{}.{}.tmp".format(self.status_path, os.getpid())
+        with io.open(tmp, "w") as f:
+            json.dump(status, f)
+        os.replace(tmp, self.status_path)
+
+    def clear_status(self):
+        try:
+            os.remove(self.status_path)
+        except OSError:
+            pass
+
+    def locked(self):
+        """Whether a job currently holds this job's lock."""
+        import fcntl
+
+        try:
+            fd = os.open(self.lock_path, os.O_RDONLY)
+        except OSError:
+            return False
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except (IOError, OSError) as e:
+            if e.errno in (errno.EAGAIN, errno.EACCES, errno.EWOULDBLOCK):
+                return True
+            raise
+        finally:
+            os.close(fd)
+        return False
+
+    def state(self):
+        """Returns None if there's no job on record, otherwise RUNNING,
+        FAILED or INTERRUPTED (the job died without saying how it went).
+        """
+        status = self.read_status()
+        if status is None:
+            return None
+        if status.get("state") != RUNNING:
+            return status.get("state")
+        if self.locked() or pid_alive(status.get("pid")):
+            return RUNNING
+        return INTERRUPTED
+
+
+def pid_alive(pid):
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+    return True
+
+
+def start(v, r):
+    """Launches a detached "autovenv create --job" for the resolution r,
+    returning the Job.
+    """
+    import subprocess
+
+    from .util import mkdir_p
+
+    job = Job.for_venv(v, r.venv_path)
+    mkdir_p(builds_path(v.data_dir))
+
+    env = dict(os.environ)
+    env.pop("VIRTUAL_ENV", None)
+
+    with io.open(job.log_path, "wb") as log:
+        p = subprocess.Popen(
+            [sys.executable, "-m", "autovenv", "create", "--job"],
+            cwd=r.cwd,
+            env=env,
+            stdin=subprocess.DEVNULL,
+            stdout=log,
+            stderr=subprocess.STDOUT,
+            start_new_session=True,
+            close_fds=True,
+        )
+
+    job.write_status(
+        state=RUNNING,
+        venv=r.venv_path,
+        project=r.projfolder,
+        pid=p.pid,
+        started=time.time(),
+    )
+    return job
+
+
+def run(v):
+    """The body of a background job: creates the current project's venv
+    while holding the job's lock, recording how it went. A venv that
+    exists by the time the lock is ours (eg. made by a job started from
+    another shell at the same time) counts as success.
+    """
+    import fcntl
+
+    r = v.resolution
+    job = Job.for_venv(v, r.venv_path)
+
+    with io.open(job.lock_path, "w") as lock:
+        fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+
+        if os.path.exists(r.venv_path):
+            job.clear_status()
+            return 0
+
+        status = dict(
+            state=RUNNING,
+            venv=r.venv_path,
+            project=r.projfolder,
+            pid=os.getpid(),
+            started=time.time(),
+        )
+        job.write_status(**status)
+
+        try:
+            ok = v.make_virtualenv(r.venv_name)
+        except Exception as e:
+            print("AUTOVENV: ERROR ({})".format(e))
+            ok = False
+        sys.stdout.flush()
+
+        if ok:
+            job.clear_status()
+            return 0
+
+        status.update(state=FAILED, finished=time.time())
+        job.write_status(**status)
+        return 1
+
+
+def jobs(data_dir):
+    """Yields (job, status, state) for every job on record."""
+    try:
+        filenames = sorted(os.listdir(builds_path(data_dir)))
+    except OSError:
+        return
+
+    for filename in filenames:
+        if filename.endswith(".json"):
+            job = Job(data_dir, filename[: -len(".json")])
+            status = job.read_status()
+            if status is not None:
+                yield job, status, job.state()
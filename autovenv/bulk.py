@@ -0,0 +1,415 @@
+"""
+Operations on many venvs at once, run concurrently in a pool of worker
+processes.
+
+Each venv is built by a worker with its output (including that of any
+subprocesses) going to a log file of its own under <data_dir>/logs, so
+that one failure among dozens can be looked into afterwards without the
+rest of the output getting in the way.
+"""
+
+import os
+import io
+import sys
+import time
+import collections
+
+from .clone import TEMPLATE_NAME
+from .util import mkdir_p, read_pyvenv_cfg, resolve_path, unresolve
+
+# project is the folder the venv was created for (recorded in its
+# pyvenv.cfg at creation), or None for venvs that predate that.
+Venv = collections.namedtuple("Venv", "path name build framework project")
+
+# What a worker needs to do one piece of work: action is one of
+# ACTIONS, applied to venv by a VirtualEnvs built from data_dir and home.
+# clone says whether the venv may be cloned from its build's template.
+Task = collections.namedtuple("Task", "action data_dir home venv log_path clone")
+
+# (task, whether it worked, seconds taken, error message or None)
+Outcome = collections.namedtuple("Outcome", "task ok seconds error")
+
+# Folders never looked inside when scanning for projects (as well as
+# venvs, and anything in the data dir).
+SCAN_PRUNED = frozenset(
+    [".git", ".hg", ".svn", ".bzr", "node_modules", "__pycache__", ".tox", ".nox"]
+)
+
+
+def logs_path(data_dir, operation):
+    return os.path.join(data_dir, "logs", operation)
+
+
+def log_name(v, venv):
+    return os.path.relpath(venv.path, v.venvspath).replace(os.sep, "__") + ".log"
+
+
+def is_venv(path):
+    return os.path.isfile(os.path.join(path, "pyvenv.cfg"))
+
+
+def skipped(name):
+    # templates, and clones still being assembled (see clone.py)
+    return name.startswith(".") or ".cloning-" in name
+
+
+def subdirs(path):
+    try:
+        names = sorted(os.listdir(path))
+    except OSError:
+        return
+    for name in names:
+        if not skipped(name) and os.path.isdir(os.path.join(path, name)):
+            yield name, os.path.join(path, name)
+
+
+def find_venvs(v):
+    """Yields a Venv for every venv under v.venvspath: those for the
+    system python directly inside it, and those for the python builds
+    one level down, in a directory named after the build.
+    """
+    for name, path in subdirs(v.venvspath):
+        if is_venv(path):
+            yield describe(v, path, name, None)
+            continue
+        for venv_name, venv_path in subdirs(path):
+            if is_venv(venv_path):
+                yield describe(v, venv_path, venv_name, name)
+
+
+def find_templates(v):
+    """Yields the path of every template venv (see clone.py)."""
+    from .clone import template_ready
+
+    dirs = [v.venvspath] + [path for _, path in subdirs(v.venvspath)]
+    for path in dirs:
+        template = os.path.join(path, TEMPLATE_NAME)
+        if template_ready(template):
+            yield template
+
+
+def describe(v, path, name, build):
+    cfg = read_pyvenv_cfg(path)
+    home = cfg.get("home", "")
+    framework = home.startswith(v.pyversionspath_for(True) + os.sep)
+    return Venv(
+        path=path,
+        name=name,
+        build=build,
+        framework=framework,
+        project=cfg.get("autovenv_project") or None,
+    )
+
+
+def venvs_for(data_dir, home, venv):
+    """A VirtualEnvs set up to work on the given venv."""
+    from .virtualenvs import VirtualEnvs
+
+    cwd = venv.project if venv.project and os.path.isdir(venv.project) else home
+    v = VirtualEnvs(data_dir=data_dir, home=home, cwd=cwd, virtual_env="")
+    v.use_resolution(v.venv_resolution(venv))
+    return v
+
+
+def build_template(v):
+    return v.ensure_template()
+
+
+def rebuild_template(v):
+    return v.ensure_template(rebuild=True)
+
+
+def recreate_venv(v):
+    r = v.resolution
+    python = v.python_path
+    if not os.path.exists(python):
+        # leave the old venv alone, broken or not, rather than delete it
+        # and then have nothing to build a new one with
+        raise ValueError("no python at {}".format(python))
+    v.delete_virtualenv(r.venv_name)
+    return v.make_virtualenv(r.venv_name)
+
+
+def create_venv(v):
+    r = v.resolution
+    if os.path.exists(r.venv_path):
+        print("AUTOVENV: {} already exists".format(r.venv_path))
+        return True
+    return v.make_virtualenv(r.venv_name)
+
+
+ACTIONS = {
+    "template": build_template,
+    "retemplate": rebuild_template,
+    "recreate": recreate_venv,
+    "create": create_venv,
+}
+
+
+def run_task(task):
+    """Runs one Task in a worker process, with stdout and stderr (both
+    python's and, at the file descriptor level, any subprocesses') going
+    to the task's log file. Returns an Outcome.
+    """
+    start = time.time()
+    mkdir_p(os.path.dirname(task.log_path))
+
+    sys.stdout.flush()
+    sys.stderr.flush()
+    saved = os.dup(1), os.dup(2), sys.stdout, sys.stderr
+    log = io.open(task.log_path, "w", buffering=1)
+    os.dup2(log.fileno(), 1)
+    os.dup2(log.fileno(), 2)
+    sys.stdout = sys.stderr = log
+
+    error = None
+    try:
+        v = venvs_for(task.data_dir, task.home, task.venv)
+        if not task.clone:
+            v.config = dict(v.config, clone_template=False)
+        ok = bool(ACTIONS[task.action](v))
+    except Exception as e:
+        print("AUTOVENV: ERROR ({})".format(e))
+        ok, error = False, str(e)
+    finally:
+        log.close()
+        os.dup2(saved[0], 1)
+        os.dup2(saved[1], 2)
+        os.close(saved[0])
+        os.close(saved[1])
+        sys.stdout, sys.stderr = saved[2], saved[3]
+
+    return Outcome(task, ok, time.time() - start, error)
+
+
+def run_tasks(tasks, jobs=None, context=None):
+    """Runs the tasks in a pool of at most jobs worker processes (by
+    default, one per CPU), yielding each Outcome as it completes.
+    context is the multiprocessing context to start them with (by
+    default, the platform's).
+    """
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+
+    if not tasks:
+        return
+
+    jobs = max(1, min(jobs or os.cpu_count() or 1, len(tasks)))
+
+    with ProcessPoolExecutor(max_workers=jobs, mp_context=context) as pool:
+        futures = {pool.submit(run_task, task): task for task in tasks}
+        for future in as_completed(futures):
+            try:
+                yield future.result()
+            except Exception as e:
+                # the worker process itself died
+                yield Outcome(futures[future], False, 0.0, str(e))
+
+
+def template_tasks(v, venvs, action):
+    """Tasks to build the template for each python build among the
+    venvs, up front, so that workers never race to build the same one.
+    When recreating, existing templates are rebuilt too, so that clones
+    pick up any change to the build.
+    """
+    tasks = []
+    seen = set()
+    for venv in venvs:
+        key = (venv.build, venv.framework)
+        if key in seen:
+            continue
+        seen.add(key)
+        template = Venv(
+            path=os.path.join(v.venvspath, venv.build or "", TEMPLATE_NAME),
+            name=TEMPLATE_NAME,
+            build=venv.build,
+            framework=venv.framework,
+            project=None,
+        )
+        log_path = os.path.join(logs_path(v.data_dir, action), log_name(v, template))
+        template_action = "retemplate" if action == "recreate" else "template"
+        tasks.append(
+            Task(template_action, v.data_dir, v.home, template, log_path, False)
+        )
+    return tasks
+
+
+def run_all(v, action, venvs, jobs=None):
+    """Applies action to every one of venvs concurrently, building the
+    templates they'll be cloned from first (if cloning is on). Prints
+    progress and a summary, and returns the exit status.
+    """
+    venvs = list(venvs)
+    if not venvs:
+        print("AUTOVENV: no venvs to {}".format(action))
+        return 0
+
+    logdir = logs_path(v.data_dir, action)
+    print(
+        "AUTOVENV: {} {} venvs, {} at a time (logs in {})".format(
+            action, len(venvs), jobs or os.cpu_count() or 1, logdir
+        )
+    )
+    sys.stdout.flush()
+
+    start = time.time()
+    failures = []
+
+    # (build, framework) of the python builds whose templates are ready
+    cloneable = set()
+
+    if v.setting("clone_template"):
+        # a template that fails to build just means its venvs get built
+        # from scratch, so these failures are reported but not counted
+        for outcome in run_tasks(template_tasks(v, venvs, action), jobs):
+            template = outcome.task.venv
+            if outcome.ok:
+                cloneable.add((template.build, template.framework))
+            else:
+                print(
+                    "  template for {} failed (see {})".format(
+                        template.build or "system python",
+                        outcome.task.log_path,
+                    )
+                )
+
+    tasks = [
+        Task(
+            action,
+            v.data_dir,
+            v.home,
+            venv,
+            os.path.join(logdir, log_name(v, venv)),
+            (venv.build, venv.framework) in cloneable,
+        )
+        for venv in venvs
+    ]
+    for outcome in run_tasks(tasks, jobs):
+        venv = outcome.task.venv
+        label = os.path.relpath(venv.path, v.venvspath)
+        if outcome.ok:
+            print("  ok      {} ({:.1f}s)".format(label, outcome.seconds))
+        else:
+            failures.append(outcome)
+            print("  FAILED  {} (see {})".format(label, outcome.task.log_path))
+        sys.stdout.flush()
+
+    print(
+        "AUTOVENV: {} of {} venvs done in {:.1f}s".format(
+            len(venvs) - len(failures), len(venvs), time.time() - start
+        )
+    )
+    if failures:
+        print("{} failed:".format(len(failures)))
+        for outcome in failures:
+            venv = outcome.task.venv
+            print(
+                "  {} (project: {}, log: {})".format(
+                    venv.path, venv.project or "unknown", outcome.task.log_path
+                )
+            )
+        return 1
+    return 0
+
+
+def find_projects(v, root):
+    """Yields a Venv (existing or not) for every project under root: each
+    folder with one of the config's file_names in it is resolved as the
+    shell hook would resolve it, so a marker file deeper inside a project
+    doesn't make a project of its own (unless the config says it should).
+
+    Venvs are named after their project folders, so two projects with the
+    same folder name (eg. services/api and tools/api) would share a venv:
+    only the first is yielded, with a warning about the other.
+    """
+    markers = set(v.config.get("file_names") or ())
+    data_dir = v.data_dir + os.sep
+    seen = {}
+    clashes = set()
+
+    for dirpath, dirnames, filenames in os.walk(resolve_path(root)):
+        if "pyvenv.cfg" in filenames:
+            # a venv (eg. a project's own .venv): nothing to see inside
+            dirnames[:] = []
+            continue
+        dirnames[:] = sorted(
+            name
+            for name in dirnames
+            if name not in SCAN_PRUNED
+            and not (os.path.join(dirpath, name) + os.sep).startswith(data_dir)
+        )
+        if markers.isdisjoint(filenames):
+            continue
+
+        # the probe memo is shared, so each folder is listed at most once
+        r = v.resolve(dirpath, cache=False)
+        if not r.in_project:
+            continue
+        if r.venv_path in seen:
+            other = seen[r.venv_path]
+            if other != r.projfolder and r.projfolder not in clashes:
+                clashes.add(r.projfolder)
+                print(
+                    "AUTOVENV: WARNING {} would share {} with {}, skipping it"
+                    " (give one of them a venvname override)".format(
+                        unresolve(r.projfolder, v.home),
+                        os.path.relpath(r.venv_path, v.venvspath),
+                        unresolve(other, v.home),
+                    )
+                )
+            continue
+        seen[r.venv_path] = r.projfolder
+
+        yield Venv(
+            path=r.venv_path,
+            name=r.venv_name,
+            build=r.pythonbuild,
+            framework=r.use_framework_build,
+            project=r.projfolder,
+        )
+
+
+def scan(v, root, jobs=None, dry_run=False):
+    """Creates the venv for every project under root that doesn't have
+    one yet, so they're ready before anyone cds into them.
+    """
+    projects = list(find_projects(v, root))
+    missing = [venv for venv in projects if not os.path.exists(venv.path)]
+    print(
+        "AUTOVENV: found {} projects under {}, {} without a venv".format(
+            len(projects), root, len(missing)
+        )
+    )
+
+    if dry_run:
+        for venv in missing:
+            print(
+                "  would create {} (for {})".format(
+                    os.path.relpath(venv.path, v.venvspath),
+                    unresolve(venv.project, v.home),
+                )
+            )
+        return 0
+    if not missing:
+        return 0
+    return run_all(v, "create", missing, jobs=jobs)
+
+
+def create_one(v, venv, context=None):
+    """Creates one venv in a worker process, building its template first
+    (if cloning is on), without printing anything. Returns the Outcome.
+    """
+    logdir = logs_path(v.data_dir, "create")
+    clone = False
+    if v.setting("clone_template"):
+        (outcome,) = run_tasks(template_tasks(v, [venv], "create"), 1, context)
+        clone = outcome.ok
+
+    log_path = os.path.join(logdir, log_name(v, venv))
+    task = Task("create", v.data_dir, v.home, venv, log_path, clone)
+    (outcome,) = run_tasks([task], 1, context)
+    return outcome
+
+
+def recreate_all(v, jobs=None):
+    """Deletes and recreates every venv under v.venvspath."""
+    return run_all(v, "recreate", find_venvs(v), jobs=jobs)
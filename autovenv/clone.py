@@ -0,0 +1,175 @@
+"""
+Creating venvs by cloning a pristine template venv, rather than running
+venv and pip from scratch each time.
+
+Files are reflinked where the filesystem supports it, hardlinked where
+it doesn't, and copied as a last resort. The few files that mention the
+venv's own location (pyvenv.cfg, and the activate scripts and script
+shebangs in bin/) are rewritten for the new location instead.
+"""
+
+import os
+import io
+import errno
+import shutil
+
+TEMPLATE_NAME = ".template"
+
+# Written into a template once it's completely built, so a half-built one
+# (eg. from an interrupted creation) is never cloned. Not copied to clones.
+READY_MARKER = ".autovenv-template-ready"
+
+FICLONE = 0x40049409
+
+NO_REFLINK = (errno.EOPNOTSUPP, errno.EXDEV, errno.EINVAL, errno.ENOTTY, errno.EBADF)
+NO_HARDLINK = (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.EACCES)
+
+
+class CloneError(Exception):
+    pass
+
+
+def template_ready(template):
+    return os.path.exists(os.path.join(template, READY_MARKER))
+
+
+def mark_template_ready(template):
+    io.open(os.path.join(template, READY_MARKER), "w").close()
+
+
+class TemplateLock(object):
+    """Holds an flock on <template>.lock, so that only one process at a
+    time (re)builds a template.
+    """
+
+    def __init__(self, template):
+        self.path = template.rstrip(os.sep) + ".lock"
+
+    def __enter__(self):
+        import fcntl
+
+        parent = os.path.dirname(self.path)
+        if not os.path.isdir(parent):
+            os.makedirs(parent)
+        self.f = io.open(self.path, "w")
+        fcntl.flock(self.f.fileno(), fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        self.f.close()
+
+
+def needs_rewrite(relpath):
+    return relpath == "pyvenv.cfg" or os.path.dirname(relpath) == "bin"
+
+
+class Cloner(object):
+    """Remembers, for one clone, which ways of sharing file contents
+    the filesystem has already refused, so each is only tried once.
+    """
+
+    def __init__(self):
+        self.reflink = True
+        self.hardlink = True
+
+    def try_reflink(self, src, dst):
+        import fcntl
+
+        with io.open(src, "rb") as fsrc:
+            with io.open(dst, "wb") as fdst:
+                fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        shutil.copystat(src, dst)
+
+    def share(self, src, dst):
+        if self.reflink:
+            try:
+                return self.try_reflink(src, dst)
+            except ImportError:
+                self.reflink = False
+            except (OSError, IOError) as e:
+                if e.errno not in NO_REFLINK:
+                    raise
+                self.reflink = False
+            if os.path.lexists(dst):
+                os.remove(dst)
+
+        if self.hardlink:
+            try:
+                return os.link(src, dst)
+            except OSError as e:
+                if e.errno not in NO_HARDLINK:
+                    raise
+                self.hardlink = False
+
+        shutil.copy2(src, dst)
+
+
+def rewrite(src, dst, replacements):
+    with io.open(src, "rb") as f:
+        content = f.read()
+    for old, new in replacements:
+        content = content.replace(old, new)
+    with io.open(dst, "wb") as f:
+        f.write(content)
+    shutil.copymode(src, dst)
+
+
+def clone_venv(template, target):
+    """Clones the template venv to target. The clone is assembled next to
+    target and renamed into place, so target either doesn't exist or is
+    complete.
+    """
+    if not template_ready(template):
+        raise CloneError("no usable template at {}".format(template))
+    if os.path.lexists(target):
+        raise CloneError("something already exists at {}".format(target))
+
+    template = template.rstrip(os.sep)
+    target = target.rstrip(os.sep)
+
+    replacements = [
+        (template.encode("utf-8"), target.encode("utf-8")),
+        (
+            "({}) ".format(os.path.basename(template)).encode("utf-8"),
+            "({}) ".format(os.path.basename(target)).encode("utf-8"),
+        ),
+    ]
+
+    staging = "{}.cloning-{}".format(target, os.getpid())
+    cloner = Cloner()
+
+    try:
+        for dirpath, dirnames, filenames in os.walk(template):
+            reldir = os.path.relpath(dirpath, template)
+            destdir = os.path.normpath(os.path.join(staging, reldir))
+            os.mkdir(destdir)
+            shutil.copymode(dirpath, destdir)
+
+            for name in list(dirnames) + filenames:
+                src = os.path.join(dirpath, name)
+                dst = os.path.join(destdir, name)
+                relpath = os.path.normpath(os.path.join(reldir, name))
+
+                if os.path.islink(src):
+                    link = os.readlink(src)
+                    if link.startswith(template + os.sep):
+                        link = target + link[len(template) :]
+                    os.symlink(link, dst)
+                    if name in dirnames:
+                        # don't descend into symlinked dirs (eg. lib64)
+                        dirnames.remove(name)
+                elif name in dirnames:
+                    continue
+                elif relpath == READY_MARKER:
+                    continue
+                elif needs_rewrite(relpath):
+                    rewrite(src, dst, replacements)
+                else:
+                    cloner.share(src, dst)
+
+        os.rename(staging, target)
+    except Exception as e:
+        shutil.rmtree(staging, ignore_errors=True)
+        if isinstance(e, CloneError):
+            raise
+        raise CloneError("couldn't clone {} to {}: {}".format(template, target, e))
@@ -1,10 +1,13 @@
 import sys
-import argparse
 
-from .virtualenvs import VirtualEnvs
+# The shell hooks run one of these on every cd, so they skip argparse
+# (and everything else not needed to produce a suggestion).
+HOOK_COMMANDS = ("bash", "fish")
 
 
 def parse_args(args):
+    import argparse
+
     parser = argparse.ArgumentParser(description="Work with venvs and python versions.")
     parser.set_defaults(
         info=False,
@@ -13,8 +16,19 @@ def parse_args(args):
         python_version=False,
         recreate=False,
         builddefspath=False,
+        buildcachepath=False,
         pyversionspath=False,
         pyversionspath_framework=False,
+        serve=False,
+        seed=False,
+        create=False,
+        sync=False,
+        dedupe=False,
+        list=False,
+        gc=False,
+        resolve=False,
+        scan=False,
+        check=False,
     )
     subparsers = parser.add_subparsers()
 
@@ -32,11 +46,138 @@ def parse_args(args):
     )
     fish.set_defaults(fish=True)
 
+    create = subparsers.add_parser(
+        "create",
+        help="create the virtualenv for this project, if it doesn't exist yet"
+        " (by cloning a template venv, unless clone_template is off)",
+    )
+    create.add_argument("--job", action="store_true", help=argparse.SUPPRESS)
+    create.set_defaults(create=True)
+
+    sync = subparsers.add_parser(
+        "sync",
+        help="install and uninstall packages to match this project's"
+        " requirements.txt/pyproject.toml, changing only what changed",
+    )
+    sync.set_defaults(sync=True)
+
+    dedupe = subparsers.add_parser(
+        "dedupe",
+        help="replace identical files across venvs with hardlinks to a"
+        " single copy in a shared store, and report the space reclaimed",
+    )
+    dedupe.add_argument(
+        "venvs", nargs="*", help="the venvs to deduplicate (default: all of them)"
+    )
+    dedupe.set_defaults(dedupe=True)
+
     recreate = subparsers.add_parser(
         "recreate", help="wipe the current virtualenv" " and reinstall it from scratch"
     )
+    recreate.add_argument(
+        "--all",
+        action="store_true",
+        help="recreate every venv autovenv manages, eg. after a python upgrade",
+    )
+    recreate.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=None,
+        help="with --all, how many venvs to build at once"
+        " (default: the number of CPUs)",
+    )
     recreate.set_defaults(recreate=True)
 
+    check = subparsers.add_parser(
+        "check",
+        help="check every venv for a python build that's gone or changed"
+        " since it was created (without running anything)",
+    )
+    check.add_argument("--fix", action="store_true", help="recreate the broken venvs")
+    check.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=None,
+        help="with --fix, how many venvs to recreate at once"
+        " (default: the number of CPUs)",
+    )
+    check.set_defaults(check=True)
+
+    scan = subparsers.add_parser(
+        "scan",
+        help="find every project under a folder (eg. a monorepo checkout)"
+        " and create the venvs they don't have yet, several at a time",
+    )
+    scan.add_argument("root", help="the folder to look under")
+    scan.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=None,
+        help="how many venvs to create at once (default: the number of CPUs)",
+    )
+    scan.add_argument(
+        "-n", "--dry-run", action="store_true", help="just list what would be created"
+    )
+    scan.set_defaults(scan=True)
+
+    seed = subparsers.add_parser(
+        "seed",
+        help="download pip, setuptools and wheel into the local wheelhouse,"
+        " which new venvs are then seeded from without any index access",
+    )
+    seed.set_defaults(seed=True)
+
+    list_ = subparsers.add_parser(
+        "list",
+        help="list the venvs autovenv manages, with their projects, sizes"
+        " and when they were last used",
+    )
+    list_.add_argument("--json", action="store_true", help="one JSON object per venv")
+    list_.add_argument(
+        "--rescan",
+        action="store_true",
+        help="first look for venvs that aren't listed (or have gone)",
+    )
+    list_.set_defaults(list=True)
+
+    gc = subparsers.add_parser(
+        "gc",
+        help="delete venvs whose projects have gone, or that haven't been"
+        " used in a while, or that don't fit in the disk budget",
+    )
+    gc.add_argument(
+        "-n", "--dry-run", action="store_true", help="just say what would go"
+    )
+    gc.add_argument(
+        "--max-age-days",
+        type=float,
+        default=None,
+        help="remove venvs not activated in this many days"
+        " (default: the gc_max_age_days setting)",
+    )
+    gc.add_argument(
+        "--budget",
+        default=None,
+        help="remove least recently activated venvs until the rest take up"
+        " no more than this, eg. 20G (default: the gc_disk_budget setting)",
+    )
+    gc.set_defaults(gc=True)
+
+    resolve = subparsers.add_parser(
+        "resolve",
+        help="print the project folder, venv and python build for each path,"
+        " one JSON object per line",
+    )
+    resolve.add_argument(
+        "paths",
+        nargs="*",
+        help="the paths to resolve (default: read them from stdin, one per line)",
+    )
+    resolve.set_defaults(resolve=True)
+
     info = subparsers.add_parser(
         "info", help="show the current virtual" " environment and python version in use"
     )
@@ -48,6 +189,13 @@ def parse_args(args):
     )
     builddefspath.set_defaults(builddefspath=True)
 
+    buildcachepath = subparsers.add_parser(
+        "buildcachepath",
+        help="returns the path where autovenv-build keeps downloaded sources"
+        " and build logs",
+    )
+    buildcachepath.set_defaults(buildcachepath=True)
+
     pyversionspath = subparsers.add_parser(
         "pyversionspath", help="returns the path where built python versions are stored"
     )
@@ -59,6 +207,13 @@ def parse_args(args):
     )
     pyversionspath_framework.set_defaults(pyversionspath_framework=True)
 
+    serve = subparsers.add_parser(
+        "serve",
+        help="keep a resolver running on a unix socket, so the shell hooks"
+        " can skip starting python on every cd",
+    )
+    serve.set_defaults(serve=True)
+
     choose = subparsers.add_parser("choose", help="set your preferred python version")
     choose.add_argument(
         "python_version",
@@ -76,8 +231,27 @@ def parse_args(args):
 
 
 def run(args):
+    if args is None:
+        return
+
+    if args.serve:
+        from .daemon import serve
+
+        return serve()
+
+    from .virtualenvs import VirtualEnvs
+
     v = VirtualEnvs()
-    v.do_command(args)
+    return v.do_command(args)
+
+
+def run_hook(shell):
+    from .virtualenvs import VirtualEnvs
+    from . import tracing
+
+    v = VirtualEnvs()
+    print(v.suggested_command(shell=shell, hook=True))
+    tracing.finish(command=shell, cwd=v.cwd)
 
 
 def do_command():  # pragma: no cover
@@ -86,6 +260,11 @@ def do_command():  # pragma: no cover
     Simply creates a VirtualEnvs object with default parameters,
     and runs the command via that.
     """
-    args = parse_args(sys.argv[1:])
-    status = run(args)
+    argv = sys.argv[1:]
+
+    if len(argv) == 1 and argv[0] in HOOK_COMMANDS:
+        status = run_hook(argv[0])
+    else:
+        args = parse_args(argv)
+        status = run(args)
     sys.exit(status)
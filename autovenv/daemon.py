@@ -0,0 +1,177 @@
+"""
+A long-lived resolver that answers shell-hook queries over a Unix socket,
+so that a ``cd`` doesn't have to pay for a fresh interpreter every time.
+
+The protocol is one request line per connection::
+
+    <shell>\\t<cwd>\\t<VIRTUAL_ENV>\\n
+
+answered by a single line, either ``ok:<command>`` or ``error:<message>``.
+Clients should fall back to running ``autovenv bash``/``autovenv fish``
+themselves on anything other than an ``ok:`` reply.
+
+Requests are answered one at a time, from a single VirtualEnvs kept for
+the life of the daemon, so its config stays loaded between them; a
+client that connects and then says nothing is dropped after
+REQUEST_TIMEOUT seconds rather than holding up everyone else.
+"""
+
+import os
+import sys
+import errno
+import signal
+import socket
+import socketserver
+
+from . import tracing
+from .util import resolve_path
+from .virtualenvs import VirtualEnvs, DATA_DIR_NAME
+
+SHELLS = ("bash", "fish")
+
+REQUEST_TIMEOUT = 1.0
+
+
+def socket_path():
+    """Returns the per-user socket path. The shell hooks compute the
+    same path, so keep the two in step.
+
+    It has to be somewhere only this user can create files: the hooks
+    run whatever the socket answers. Without XDG_RUNTIME_DIR, that's the
+    data dir in the user's home folder, rather than /tmp.
+    """
+    explicit = os.environ.get("AUTOVENV_SOCKET")
+    if explicit:
+        return explicit
+    rundir = os.environ.get("XDG_RUNTIME_DIR")
+    if rundir:
+        return os.path.join(rundir, "autovenv-{}.sock".format(os.getuid()))
+    return os.path.join(os.path.expanduser("~"), DATA_DIR_NAME, "autovenv.sock")
+
+
+def parse_request(line):
+    try:
+        shell, cwd, virtual_env = line.rstrip("\r\n").split("\t")
+    except ValueError:
+        raise ValueError("malformed request")
+    if shell not in SHELLS:
+        raise ValueError("unknown shell: {}".format(shell))
+    if not os.path.isabs(cwd):
+        raise ValueError("cwd must be absolute: {}".format(cwd))
+    return shell, cwd, virtual_env
+
+
+class HookHandler(socketserver.StreamRequestHandler):
+    timeout = REQUEST_TIMEOUT
+
+    def handle(self):
+        try:
+            line = self.rfile.readline().decode("utf-8")
+        except OSError:
+            # timed out, or the client went away
+            return
+        tracing.begin()
+
+        try:
+            shell, cwd, virtual_env = parse_request(line)
+            v = self.server.venvs
+            v.cwd = resolve_path(cwd)
+            v.virtual_env = virtual_env
+            v.forget()
+            reply = "ok:" + v.suggested_command(shell=shell, hook=True)
+        except Exception as e:
+            reply = "error:{}".format(str(e).replace("\n", " "))
+
+        self.wfile.write((reply + "\n").encode("utf-8"))
+        tracing.finish(command="serve", request=line.rstrip("\n"))
+
+
+class HookServer(socketserver.UnixStreamServer):
+    def __init__(self, path, venv_kwargs=None):
+        self.venvs = VirtualEnvs(**(venv_kwargs or {}))
+        self.path = path
+
+        old_umask = os.umask(0o077)
+        try:
+            socketserver.UnixStreamServer.__init__(self, path, HookHandler)
+        finally:
+            os.umask(old_umask)
+
+    def server_close(self):
+        socketserver.UnixStreamServer.server_close(self)
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+def is_listening(path):
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        s.connect(path)
+        return True
+    except (OSError, socket.error):
+        return False
+    finally:
+        s.close()
+
+
+def make_server(path=None, **venv_kwargs):
+    """Binds a HookServer at the given path, clearing away a stale socket
+    left behind by a daemon that died without cleaning up.
+    """
+    path = path or socket_path()
+
+    folder = os.path.dirname(path)
+    if folder and not os.path.isdir(folder):
+        os.makedirs(folder, mode=0o700)
+
+    if os.path.exists(path):
+        if is_listening(path):
+            raise OSError(errno.EADDRINUSE, "autovenv is already serving", path)
+        os.remove(path)
+
+    return HookServer(path, venv_kwargs=venv_kwargs)
+
+
+def query(path, shell, cwd, virtual_env="", timeout=1.0):
+    """Python-side client, mostly useful for testing. Returns the
+    suggested command, or raises if the daemon can't answer.
+    """
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    s.settimeout(timeout)
+    try:
+        s.connect(path)
+        request = "{}\t{}\t{}\n".format(shell, cwd, virtual_env or "")
+        s.sendall(request.encode("utf-8"))
+        reply = s.makefile("rb").readline().decode("utf-8").rstrip("\n")
+    finally:
+        s.close()
+
+    if not reply.startswith("ok:"):
+        raise RuntimeError(reply or "no reply")
+    return reply[len("ok:") :]
+
+
+def serve(path=None):  # pragma: no cover
+    try:
+        server = make_server(path)
+    except OSError as e:
+        print("AUTOVENV: {}".format(e), file=sys.stderr)
+        return 1
+
+    def stop(signum, frame):
+        sys.exit(0)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGHUP, stop)
+
+    print("AUTOVENV: serving on {}".format(server.path))
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
@@ -0,0 +1,199 @@
+"""
+Garbage collection of venvs that are no longer wanted, going by the
+inventory (see inventory.py):
+
+  - venvs whose project folder has gone
+  - venvs not activated for more than max_age_days
+  - then, if what's left is still over the disk budget, the least
+    recently activated venvs until it isn't
+
+The active venv and the venv for the current directory are never
+collected, and nor is a venv still being built in the background.
+"""
+
+import os
+import time
+
+SIZE_UNITS = {"K": 1024, "M": 1024**2, "G": 1024**3, "T": 1024**4}
+
+DAY = 24 * 60 * 60
+
+# automatic collection (the gc_auto setting) runs at most this often
+AUTO_INTERVAL = DAY
+
+STAMP_NAME = "gc.stamp"
+
+
+def parse_size(size):
+    """Parses a disk budget like 20G, 500M or a plain number of bytes."""
+    if size is None or isinstance(size, int):
+        return size
+    size = str(size).strip().upper().rstrip("B")
+    if size and size[-1] in SIZE_UNITS:
+        return int(float(size[:-1]) * SIZE_UNITS[size[-1]])
+    return int(size)
+
+
+def last_used(entry):
+    return entry["last_activated"] or entry["created"] or 0
+
+
+class Eviction(object):
+    def __init__(self, entry, reason):
+        self.entry = entry
+        self.reason = reason
+
+    @property
+    def venv(self):
+        return self.entry["venv"]
+
+    @property
+    def size(self):
+        return self.entry["size"] or 0
+
+
+def plan(venvs, protected, max_age_days=None, budget=None, now=None):
+    """Works out which of the venvs (inventory entries) to evict, and
+    why. Returns a list of Evictions.
+    """
+    now = time.time() if now is None else now
+    evictions = []
+    kept = []
+
+    for entry in sorted(venvs, key=last_used):
+        project = entry["project"]
+        age_days = (now - last_used(entry)) / DAY
+
+        if entry["venv"] in protected:
+            kept.append(entry)
+        elif project and not os.path.isdir(project):
+            evictions.append(Eviction(entry, "project gone"))
+        elif max_age_days is not None and age_days > max_age_days:
+            evictions.append(
+                Eviction(entry, "not activated for {:.0f} days".format(age_days))
+            )
+        else:
+            kept.append(entry)
+
+    if budget is not None:
+        total = sum(entry["size"] or 0 for entry in kept)
+        # kept is in least recently used order
+        for entry in kept:
+            if total <= budget:
+                break
+            if entry["venv"] in protected:
+                continue
+            evictions.append(Eviction(entry, "over the disk budget"))
+            total -= entry["size"] or 0
+
+    return evictions
+
+
+def protected_venvs(v):
+    """The venvs that mustn't be collected right now."""
+    from .background import jobs, RUNNING
+
+    protected = {v.resolution.venv_path, v.current_venv_path}
+    for _, status, state in jobs(v.data_dir):
+        if state == RUNNING:
+            protected.add(status.get("venv"))
+    return protected
+
+
+def is_collectable(v, path):
+    """Whether path is safe to delete: a venv inside v.venvspath. The
+    inventory is only a log, so whatever it names is checked first.
+    """
+    from .bulk import is_venv
+
+    venvspath = os.path.realpath(v.venvspath) + os.sep
+    real = os.path.realpath(path)
+    return real.startswith(venvspath) and not os.path.islink(path) and is_venv(real)
+
+
+def collect(v, dry_run=False, max_age_days=None, budget=None, quiet=False):
+    """Evicts whatever plan() says to, printing what it did (or with
+    dry_run, what it would do). Returns the exit status.
+    """
+    from .inventory import rescan
+    from .util import format_size
+
+    # with sizes measured now, not as they were when the venvs were made
+    venvs = rescan(v, dry_run=dry_run).values()
+    evictions = []
+    for eviction in plan(venvs, protected_venvs(v), max_age_days, budget):
+        if is_collectable(v, eviction.venv):
+            evictions.append(eviction)
+        else:
+            print(
+                "AUTOVENV: not removing {} (not a venv under {})".format(
+                    eviction.venv, v.venvspath
+                )
+            )
+
+    if not evictions:
+        if not quiet:
+            print("AUTOVENV: nothing to collect")
+        return 0
+
+    verb = "would remove" if dry_run else "removing"
+    for eviction in evictions:
+        when = last_used(eviction.entry)
+        print(
+            "AUTOVENV: {} {} ({}, {}, last used {})".format(
+                verb,
+                eviction.venv,
+                eviction.reason,
+                format_size(eviction.size),
+                time.strftime("%Y-%m-%d", time.localtime(when)) if when else "never",
+            )
+        )
+        if not dry_run:
+            v.delete_venv_at(eviction.venv)
+
+    print(
+        "AUTOVENV: {} {} venvs, freeing {}".format(
+            "would remove" if dry_run else "removed",
+            len(evictions),
+            format_size(sum(eviction.size for eviction in evictions)),
+        )
+    )
+    return 0
+
+
+def auto_collect(v):
+    """Runs collect() from the config settings, if it hasn't been run in
+    the last AUTO_INTERVAL.
+    """
+    import io
+
+    stamp = os.path.join(v.data_dir, STAMP_NAME)
+    try:
+        if time.time() - os.stat(stamp).st_mtime < AUTO_INTERVAL:
+            return
+    except OSError:
+        pass
+    io.open(stamp, "w").close()
+
+    collect(
+        v,
+        max_age_days=v.setting("gc_max_age_days"),
+        budget=parse_size(v.setting("gc_disk_budget")),
+        quiet=True,
+    )
+
+
+def gc(v, dry_run=False, max_age_days=None, budget=None):
+    """Runs "autovenv gc": collect(), going by the config for anything
+    not given.
+    """
+    if max_age_days is None:
+        max_age_days = v.setting("gc_max_age_days")
+    if budget is None:
+        budget = v.setting("gc_disk_budget")
+
+    if max_age_days is None and budget is None:
+        print("AUTOVENV: no max age or disk budget, only collecting orphans")
+    return collect(
+        v, dry_run=dry_run, max_age_days=max_age_days, budget=parse_size(budget)
+    )
@@ -0,0 +1,88 @@
+"""
+Checking that venvs still work, without running anything in them.
+
+A venv is only as good as the python build it was created from: if the
+build is removed, or rebuilt in place (eg. upgraded to a new patch
+release), the venv's python breaks or quietly runs against a different
+standard library. So when a venv is created, the real path of its base
+interpreter and a fingerprint of it (from a stat) go into its pyvenv.cfg,
+and checking the venv is a read of that file and a few stats.
+
+Venvs from before fingerprints were recorded are checked as far as
+pyvenv.cfg allows: that its home folder and interpreter still exist.
+"""
+
+import os
+
+from .util import file_stamp, read_pyvenv_cfg, unresolve
+
+BASE_KEY = "autovenv_base_python"
+FINGERPRINT_KEY = "autovenv_base_fingerprint"
+
+
+def fingerprint(path):
+    stamp = file_stamp(path)
+    if stamp is None:
+        return None
+    return "{}-{}-{}".format(*stamp)
+
+
+def base_fields(python):
+    """The pyvenv.cfg entries that record python as a venv's base
+    interpreter.
+    """
+    real = os.path.realpath(python)
+    return {BASE_KEY: real, FINGERPRINT_KEY: fingerprint(real) or ""}
+
+
+def problem(venv_path):
+    """Returns what's wrong with the venv, or None if it looks fine."""
+    cfg = read_pyvenv_cfg(venv_path)
+    if not cfg:
+        return "no pyvenv.cfg"
+
+    home = cfg.get("home")
+    if home and not os.path.isdir(home):
+        return "its python build is gone ({})".format(home)
+
+    base = cfg.get(BASE_KEY) or cfg.get("executable")
+    if base:
+        current = fingerprint(base)
+        if current is None:
+            return "its python is gone ({})".format(base)
+        recorded = cfg.get(FINGERPRINT_KEY)
+        if recorded and current != recorded:
+            return "its python has changed since it was created ({})".format(base)
+
+    if file_stamp(os.path.join(venv_path, "bin", "python")) is None:
+        return "bin/python is missing or leads nowhere"
+    return None
+
+
+def check(v, fix=False, jobs=None):
+    """Checks every venv under v.venvspath, listing the broken ones, and
+    with fix, recreates them. Returns the exit status.
+    """
+    from .bulk import find_venvs, run_all
+
+    venvs = list(find_venvs(v))
+    broken = []
+    for venv in venvs:
+        reason = problem(venv.path)
+        if reason:
+            broken.append(venv)
+            print(
+                "  BROKEN  {} ({}): {}".format(
+                    os.path.relpath(venv.path, v.venvspath),
+                    unresolve(venv.project or "project unknown", v.home),
+                    reason,
+                )
+            )
+
+    print("AUTOVENV: checked {} venvs, {} broken".format(len(venvs), len(broken)))
+    if not broken:
+        return 0
+    if not fix:
+        print("AUTOVENV: run autovenv check --fix to recreate them")
+        return 1
+    return run_all(v, "recreate", broken, jobs=jobs)
@@ -0,0 +1,253 @@
+"""
+An index of the venvs autovenv manages, kept as an append-only log of
+events in <data_dir>/inventory.jsonl, one JSON object per line:
+
+    {"event": "create", "venv": ..., "project": ..., "build": ..., "size": ..., "time": ...}
+
+Events are "create", "activate", "update" (a new size, eg. after a sync)
+and "delete". Replaying them gives the current state of every venv, so
+"autovenv list" never has to look at the venvs themselves.
+
+Activations are recorded by the shell hook, so writing an event must not
+import json: events are encoded by hand, and appended with a single
+write so that concurrent shells can't interleave them.
+"""
+
+import os
+import io
+import time
+
+INVENTORY_NAME = "inventory.jsonl"
+
+# Once the log has this many more lines than there are venvs, it's
+# rewritten with just one line per venv.
+COMPACT_SLACK = 1000
+
+ESCAPES = {'"': '\\"', "\\": "\\\\", "\n": "\\n", "\r": "\\r", "\t": "\\t"}
+
+
+def inventory_path(data_dir):
+    return os.path.join(data_dir, INVENTORY_NAME)
+
+
+def encode_string(s):
+    chars = []
+    for c in s:
+        if c in ESCAPES:
+            chars.append(ESCAPES[c])
+        elif c < " ":
+            chars.append("\\u{:04x}".format(ord(c)))
+        else:
+            chars.append(c)
+    return '"' + "".join(chars) + '"'
+
+
+def encode_value(value):
+    if value is None:
+        return "null"
+    if value is True or value is False:
+        return "true" if value else "false"
+    if isinstance(value, (int, float)):
+        return repr(value)
+    return encode_string(str(value))
+
+
+def encode(event):
+    """Encodes a flat dict as a line of JSON."""
+    items = sorted(event.items())
+    fields = ", ".join(
+        "{}: {}".format(encode_string(k), encode_value(v)) for k, v in items
+    )
+    return "{" + fields + "}\n"
+
+
+def record(data_dir, event, venv, **fields):
+    """Appends an event to the inventory. Best-effort: failing to record
+    something is never worth failing whatever it was over.
+    """
+    fields.update(event=event, venv=venv)
+    fields.setdefault("time", round(time.time(), 3))
+    line = encode(fields).encode("utf-8")
+
+    try:
+        fd = os.open(
+            inventory_path(data_dir), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644
+        )
+    except OSError:
+        return
+    try:
+        os.write(fd, line)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def read_events(data_dir):
+    import json
+
+    try:
+        with io.open(inventory_path(data_dir), encoding="utf-8") as f:
+            lines = f.read().splitlines()
+    except IOError:
+        return []
+
+    events = []
+    for line in lines:
+        try:
+            events.append(json.loads(line))
+        except ValueError:
+            # eg. a line cut short by a full disk
+            continue
+    return events
+
+
+def replay(events, venvs=None):
+    """Returns {venv path: entry} from the events, where an entry has
+    venv, project, build, size, created and last_activated. With venvs
+    (as returned by an earlier replay), the events are applied to those.
+    """
+    venvs = {} if venvs is None else venvs
+
+    for event in events:
+        kind = event.get("event")
+        path = event.get("venv")
+        if not path:
+            continue
+
+        if kind == "delete":
+            venvs.pop(path, None)
+            continue
+
+        entry = venvs.setdefault(
+            path,
+            dict(
+                venv=path,
+                project=None,
+                build=None,
+                size=None,
+                created=None,
+                last_activated=None,
+            ),
+        )
+        for name in ("project", "build", "size", "created", "last_activated"):
+            if event.get(name) is not None:
+                entry[name] = event[name]
+
+        if kind == "create":
+            entry["created"] = event.get("time")
+        elif kind == "activate":
+            entry["last_activated"] = event.get("time")
+
+    return venvs
+
+
+def load(data_dir, compact_log=True):
+    """Returns the current state of every venv on record, compacting the
+    log first if it has grown long (and compact_log is true).
+    """
+    events = read_events(data_dir)
+    venvs = replay(events)
+    if compact_log and len(events) > len(venvs) + COMPACT_SLACK:
+        compact(data_dir, venvs)
+    return venvs
+
+
+def compact(data_dir, venvs):
+    """Rewrites the log as one "update" event per venv. An event appended
+    while this is going on can be lost, which costs at most an out of
+    date activation time.
+    """
+    path = inventory_path(data_dir)
+    tmp = "{}.{}.tmp".format(path, os.getpid())
+    try:
+        with io.open(tmp, "w", encoding="utf-8") as f:
+            for entry in sorted(venvs.values(), key=lambda e: e["venv"]):
+                f.write(encode(dict(entry, event="update")))
+        os.replace(tmp, path)
+    except (IOError, OSError):
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+
+
+def rescan(v, dry_run=False):
+    """Brings the inventory up to date with what's on disk: records venvs
+    that aren't in it (eg. ones created before there was one), forgets
+    ones that have gone, and measures every venv afresh, since sizes are
+    otherwise only recorded on create and sync (and pip installs happen
+    behind our back). With dry_run, records nothing.
+
+    Returns the up to date {venv path: entry}.
+    """
+    from .bulk import find_venvs
+    from .util import disk_usage
+
+    known = load(v.data_dir, compact_log=not dry_run)
+    events = []
+    found = set()
+
+    for venv in find_venvs(v):
+        found.add(venv.path)
+        size = disk_usage(venv.path)
+        if venv.path not in known:
+            events.append(
+                dict(
+                    event="create",
+                    venv=venv.path,
+                    project=venv.project,
+                    build=venv.build,
+                    size=size,
+                    time=os.stat(os.path.join(venv.path, "pyvenv.cfg")).st_mtime,
+                )
+            )
+        elif size != known[venv.path]["size"]:
+            events.append(dict(event="update", venv=venv.path, size=size))
+
+    for path in sorted(set(known) - found):
+        events.append(dict(event="delete", venv=path))
+
+    if not dry_run:
+        for event in events:
+            fields = dict(event)
+            record(v.data_dir, fields.pop("event"), fields.pop("venv"), **fields)
+    return replay(events, known)
+
+
+def list_venvs(v, as_json=False, rescan_first=False):
+    """Prints the venvs on record, for "autovenv list". With
+    rescan_first, first brings the inventory up to date with what's
+    actually on disk.
+    """
+    from .util import format_size, unresolve
+
+    if rescan_first:
+        rescan(v)
+
+    venvs = sorted(load(v.data_dir).values(), key=lambda e: e["venv"])
+
+    if as_json:
+        import json
+
+        for entry in venvs:
+            print(json.dumps(entry, sort_keys=True))
+        return
+
+    def when(t):
+        return time.strftime("%Y-%m-%d %H:%M", time.localtime(t)) if t else "-"
+
+    row = "{:30} {:10} {:>10} {:16} {:16} {}"
+    print(row.format("VENV", "BUILD", "SIZE", "CREATED", "LAST ACTIVATED", "PROJECT"))
+    for entry in venvs:
+        size = entry["size"]
+        print(
+            row.format(
+                os.path.relpath(entry["venv"], v.venvspath),
+                entry["build"] or "system",
+                "-" if size is None else format_size(size),
+                when(entry["created"]),
+                when(entry["last_activated"]),
+                unresolve(entry["project"] or "-", v.home),
+            )
+        )
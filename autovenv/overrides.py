@@ -0,0 +1,106 @@
+import os
+
+# Key under which a trie node stores its own override. Never a valid
+# path component, so it can't clash with a child.
+VALUE = ""
+
+
+def parse_override(v):
+    if not v:
+        pyversion = None
+        venvname = None
+    else:
+        try:
+            pyversion, venvname = v.split("/", 1)
+            pyversion = pyversion or None
+            venvname = venvname or None
+        except ValueError:
+            pyversion = v
+            venvname = None
+    return dict(pyversion=pyversion, venvname=venvname)
+
+
+def unparse_override(v):
+    pyversion = v["pyversion"]
+    venvname = v["venvname"]
+    s = pyversion or ""
+    if venvname:
+        s += "/{}".format(venvname)
+    return s or None
+
+
+def path_components(path):
+    return [part for part in path.split(os.sep) if part]
+
+
+class OverrideIndex(object):
+    """
+    The config's overrides, compiled into a trie of path components so
+    that finding the deepest override for a path costs one dict lookup
+    per directory level, however many overrides there are. Matching is
+    by whole components, so /src/foo applies to /src/foo/bar but not
+    to /src/foobar.
+
+    The trie is plain nested dicts, so it can go in the config cache
+    as-is.
+    """
+
+    def __init__(self, root=None):
+        self.root = root if root is not None else {}
+
+    @classmethod
+    def build(cls, overrides):
+        """Builds an index from a compiled config's "override" section,
+        ie. a dict of resolved path -> parsed override.
+        """
+        root = {}
+        for path, value in (overrides or {}).items():
+            node = root
+            for part in path_components(path):
+                node = node.setdefault(part, {})
+            node[VALUE] = value
+        return cls(root)
+
+    def __bool__(self):
+        return bool(self.root)
+
+    __nonzero__ = __bool__
+
+    def longest_match(self, path, field):
+        """Returns (override path, value of field) for the deepest
+        override at or above path that sets that field, or (None, None).
+        """
+        found = None, None
+
+        node = self.root
+        walked = []
+
+        value = node.get(VALUE)
+        if value and value.get(field):
+            found = os.sep, value[field]
+
+        for part in path_components(path):
+            node = node.get(part)
+            if node is None:
+                break
+            walked.append(part)
+
+            value = node.get(VALUE)
+            if value and value.get(field):
+                found = os.sep + os.sep.join(walked), value[field]
+        return found
+
+    def has_descendants(self, path):
+        """Whether any override applies to a path strictly below path."""
+        node = self.root
+        for part in path_components(path):
+            node = node.get(part)
+            if node is None:
+                return False
+        return any(key != VALUE for key in node)
+
+    def venvname(self, path):
+        return self.longest_match(path, "venvname")[1]
+
+    def pyversion(self, path):
+        return self.longest_match(path, "pyversion")[1]
@@ -0,0 +1,145 @@
+"""
+Resolving partial python versions (as in a .python-version file) to the
+best matching installed build: "3.11" or "3" to the latest such release,
+or a specifier like ">=3.10" or ">=3.10,<3.13" to the latest release
+satisfying it. Only plain releases (eg. 3.11.9) are considered, and an
+installed build named exactly like the spec always wins.
+
+The names of the installed builds are cached in the data dir, keyed by
+the builds folder's mtime (which changes whenever a build is added or
+removed), so resolving costs a stat and a small read, not a listing.
+"""
+
+import os
+import io
+
+# Bump whenever the index changes shape.
+INDEX_VERSION = 1
+
+OPERATORS = ("~=", "==", "!=", ">=", "<=", ">", "<")
+
+
+def parse_version(text):
+    """Returns the version as a tuple of ints, or None if it isn't one."""
+    parts = text.strip().split(".")
+    if not all(part.isdigit() for part in parts):
+        return None
+    return tuple(int(part) for part in parts)
+
+
+def is_partial(spec):
+    """Whether spec needs matching against the builds, rather than naming
+    one: a version with fewer than three parts, or a specifier.
+    """
+    if spec.startswith(OPERATORS):
+        return True
+    version = parse_version(spec)
+    return version is not None and len(version) < 3
+
+
+def parse_clause(clause):
+    clause = clause.strip()
+    for op in OPERATORS:
+        if clause.startswith(op):
+            return op, clause[len(op) :].strip()
+    return "==", clause + ".*"
+
+
+def satisfies(release, op, target):
+    """Whether the release (a tuple of three ints) satisfies "op target"."""
+    if target.endswith(".*"):
+        prefix = parse_version(target[:-2])
+        if prefix is None:
+            raise ValueError("bad version: {}".format(target))
+        matched = release[: len(prefix)] == prefix
+        if op == "==":
+            return matched
+        if op == "!=":
+            return not matched
+        raise ValueError("can't use {} with a wildcard".format(op))
+
+    version = parse_version(target)
+    if version is None:
+        raise ValueError("bad version: {}".format(target))
+    padded = version + (0,) * (3 - len(version))
+
+    if op == "~=":
+        if len(version) < 2:
+            raise ValueError("~= needs at least two parts: {}".format(target))
+        return release >= padded and release[: len(version) - 1] == version[:-1]
+    return {
+        "==": release == padded,
+        "!=": release != padded,
+        ">=": release >= padded,
+        "<=": release <= padded,
+        ">": release > padded,
+        "<": release < padded,
+    }[op]
+
+
+def best_build(names, spec):
+    """Returns the name of the latest release among names that matches
+    spec, or None.
+    """
+    if spec in names:
+        return spec
+
+    clauses = [parse_clause(c) for c in spec.split(",") if c.strip()]
+    releases = []
+    for name in names:
+        release = parse_version(name)
+        if release is not None and len(release) == 3:
+            releases.append((release, name))
+
+    for release, name in sorted(releases, reverse=True):
+        if all(satisfies(release, op, target) for op, target in clauses):
+            return name
+
+
+def list_builds(pyversionspath):
+    try:
+        names = os.listdir(pyversionspath)
+    except OSError:
+        return []
+    return sorted(
+        name
+        for name in names
+        if name != "current" and os.path.isdir(os.path.join(pyversionspath, name))
+    )
+
+
+def index_path(data_dir, pyversionspath):
+    # one per builds folder (there's one for framework builds too)
+    name = os.path.basename(pyversionspath).lstrip(".")
+    return os.path.join(data_dir, name + ".cache")
+
+
+def installed_builds(pyversionspath, index_path):
+    """Returns the names of the builds in pyversionspath, from the index
+    at index_path if it's up to date, and otherwise by listing it (and
+    updating the index).
+    """
+    import marshal
+
+    try:
+        stamp = os.stat(pyversionspath).st_mtime_ns
+    except OSError:
+        return []
+
+    try:
+        with io.open(index_path, "rb") as f:
+            version, path, cached_stamp, names = marshal.loads(f.read())
+        if (version, path, cached_stamp) == (INDEX_VERSION, pyversionspath, stamp):
+            return names
+    except (OSError, EOFError, ValueError, TypeError):
+        pass
+
+    names = list_builds(pyversionspath)
+    tmp = "{}.{}.tmp".format(index_path, os.getpid())
+    try:
+        with io.open(tmp, "wb") as f:
+            marshal.dump((INDEX_VERSION, pyversionspath, stamp, names), f)
+        os.replace(tmp, index_path)
+    except (OSError, ValueError):
+        pass
+    return names
@@ -0,0 +1,209 @@
+import os
+import io
+import time
+
+from .util import file_stamp
+
+CACHE_NAME = "resolutions"
+
+# Stamp files for the shell hooks' boundary check, one per project
+# boundary and venv.
+STAMPS_NAME = "boundaries"
+
+# Bump whenever what's cached (or how it's worked out) changes.
+CACHE_VERSION = 1
+
+# Cached resolutions are spread over this many files, by a hash of the
+# directory, so the cache can't grow without bound; a collision just
+# costs a miss.
+CACHE_SLOTS = 4096
+
+# Inputs changed this recently aren't cached, since a filesystem with
+# coarse timestamps could change them again without changing the stamp.
+RACY_NS = 2 * 10**9
+
+# Boundary stamps are dated this much before their resolution started:
+# file times come from the kernel's coarse clock, which lags time.time()
+# by up to a tick, so a file changed just after could otherwise look older.
+STAMP_SLACK_NS = 50 * 10**6
+
+# Resolution fields that are cached; the rest are checked afresh.
+CACHED_FIELDS = (
+    "projfolder",
+    "boundary",
+    "venv_name",
+    "venv_path",
+    "pythonbuild",
+    "pyversionspath",
+    "use_framework_build",
+)
+
+
+class Resolution(object):
+    """
+    Which venv and python build belong to a directory, worked out once.
+
+    Built by VirtualEnvs.resolve, and immutable after that: anything that
+    changes the answer (eg. saving the config) makes a new one.
+
+    boundary is the directory under which every path is known to resolve
+    the same way (usually the project folder), or "" if there isn't one.
+    The shell hooks use it to skip asking again until you cd out of it,
+    or until something the answer came from changes (see stamp_path).
+    """
+
+    __slots__ = (
+        "cwd",
+        "projfolder",
+        "boundary",
+        "venv_name",
+        "venv_path",
+        "venv_exists",
+        "pythonbuild",
+        "pyversionspath",
+        "use_framework_build",
+        "current_venv_path",
+    )
+
+    def __init__(self, **kwargs):
+        for name in self.__slots__:
+            object.__setattr__(self, name, kwargs.pop(name))
+        if kwargs:
+            raise TypeError("unexpected fields: {}".format(", ".join(sorted(kwargs))))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Resolution is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError("Resolution is immutable")
+
+    def __eq__(self, other):
+        if not isinstance(other, Resolution):
+            return NotImplemented
+        return self.as_dict() == other.as_dict()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(tuple(getattr(self, name) for name in self.__slots__))
+
+    def __repr__(self):
+        fields = ", ".join("{}={!r}".format(k, v) for k, v in self.as_dict().items())
+        return "Resolution({})".format(fields)
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def replace(self, **changes):
+        fields = self.as_dict()
+        fields.update(changes)
+        return Resolution(**fields)
+
+    @property
+    def in_project(self):
+        return bool(self.venv_name)
+
+    @property
+    def pythonversion_file_path(self):
+        if self.projfolder:
+            return os.path.join(self.projfolder, ".python-version")
+        return ""
+
+    @property
+    def venv_active(self):
+        return bool(self.current_venv_path)
+
+    @property
+    def correct_venv_active(self):
+        return self.current_venv_path == self.venv_path
+
+
+def cache_path(data_dir, cwd):
+    import zlib
+
+    slot = zlib.crc32(cwd.encode("utf-8", "surrogateescape")) % CACHE_SLOTS
+    return os.path.join(data_dir, CACHE_NAME, "{:03x}".format(slot))
+
+
+def stamp_path(data_dir, boundary, venv_path):
+    import zlib
+
+    key = "{}\0{}".format(boundary, venv_path).encode("utf-8", "surrogateescape")
+    name = "{:08x}{:08x}".format(zlib.crc32(key), zlib.adler32(key))
+    return os.path.join(data_dir, STAMPS_NAME, name)
+
+
+def write_stamp(path, ns):
+    """Creates the stamp file if need be and sets its mtime to just before
+    ns (the time its resolution was started), so that anything changed
+    after that is newer than it. Returns whether that worked.
+    """
+    ns -= STAMP_SLACK_NS
+    try:
+        try:
+            os.utime(path, ns=(ns, ns))
+            return True
+        except FileNotFoundError:
+            pass
+        # only the first time for this boundary
+        try:
+            io.open(path, "ab").close()
+        except FileNotFoundError:
+            os.mkdir(os.path.dirname(path))
+            io.open(path, "ab").close()
+        os.utime(path, ns=(ns, ns))
+    except OSError:
+        return False
+    return True
+
+
+def read_cached(data_dir, cwd, key):
+    """Returns the cached fields for cwd, if they were cached under the
+    same key and none of the inputs they were worked out from (files and
+    folders) have changed since.
+    """
+    import marshal
+
+    try:
+        with io.open(cache_path(data_dir, cwd), "rb") as f:
+            version, cached_cwd, cached_key, stamps, fields = marshal.loads(f.read())
+    except (OSError, EOFError, ValueError, TypeError):
+        return None
+
+    if (version, cached_cwd, cached_key) != (CACHE_VERSION, cwd, key):
+        return None
+    for path, cached_stamp in stamps:
+        if file_stamp(path) != cached_stamp:
+            return None
+    return fields
+
+
+def write_cached(data_dir, cwd, key, inputs, resolution):
+    """Caches the resolution for cwd, along with the stamps of its inputs.
+    Best-effort, like the config cache.
+    """
+    import marshal
+
+    stamps = tuple((path, file_stamp(path)) for path in inputs)
+    racy = time.time() * 10**9 - RACY_NS
+    if any(s is not None and s[0] > racy for _, s in stamps):
+        return
+
+    fields = {name: getattr(resolution, name) for name in CACHED_FIELDS}
+    path = cache_path(data_dir, cwd)
+    tmp = "{}.{}.tmp".format(path, os.getpid())
+    try:
+        try:
+            f = io.open(tmp, "wb")
+        except OSError:
+            os.mkdir(os.path.dirname(path))
+            f = io.open(tmp, "wb")
+        with f:
+            marshal.dump((CACHE_VERSION, cwd, key, stamps, fields), f)
+        os.replace(tmp, path)
+    except (OSError, ValueError):
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
@@ -0,0 +1,176 @@
+"""
+A content-addressed store of the files installed in venvs, so that the
+many copies of the same packages across venvs take up space only once.
+
+Files are stored under <data_dir>/store/<hh>/<sha256>-<mode>, and each
+venv's copy is replaced with a hardlink to the stored one. That's safe
+with pip, which always replaces installed files (or removes them) rather
+than writing into them. The venv's bin/ and pyvenv.cfg are left alone,
+since they mention the venv's own path and so never match anything.
+
+A stored file that no venv links to any more (its link count is back
+to 1) is pruned by the next "autovenv dedupe".
+"""
+
+import os
+import io
+import stat
+import errno
+
+from .util import mkdir_p, format_size
+
+STORE_NAME = "store"
+
+# left alone at the top of a venv
+SKIPPED = ("bin", "pyvenv.cfg")
+
+CHUNK = 1024 * 1024
+
+
+class StoreError(Exception):
+    pass
+
+
+class Stats(object):
+    def __init__(self):
+        self.files = 0
+        self.stored = 0
+        self.linked = 0
+        self.reclaimed = 0
+        self.pruned = 0
+
+    def summary(self):
+        s = "{} files checked, {} added to the store, {} replaced with links".format(
+            self.files, self.stored, self.linked
+        )
+        if self.pruned:
+            s += ", {} unused files pruned".format(self.pruned)
+        return s + ", {} reclaimed".format(format_size(self.reclaimed))
+
+
+def store_path(data_dir):
+    return os.path.join(data_dir, STORE_NAME)
+
+
+def file_digest(path):
+    import hashlib
+
+    h = hashlib.sha256()
+    with io.open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def entry_path(store, digest, mode):
+    # the mode is part of the key, since all links to a file share one
+    return os.path.join(store, digest[:2], "{}-{:o}".format(digest, mode))
+
+
+def dedupe_file(store, path, st, stats):
+    entry = entry_path(store, file_digest(path), stat.S_IMODE(st.st_mode))
+
+    try:
+        est = os.stat(entry)
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+        mkdir_p(os.path.dirname(entry))
+        try:
+            # this venv's copy becomes the stored one
+            os.link(path, entry)
+            stats.stored += 1
+            return
+        except OSError as e:
+            if e.errno == errno.EXDEV:
+                raise StoreError(
+                    "the store ({}) has to be on the same filesystem as"
+                    " the venvs".format(store)
+                )
+            if e.errno != errno.EEXIST:
+                raise
+            est = os.stat(entry)
+
+    if (est.st_dev, est.st_ino) == (st.st_dev, st.st_ino):
+        return
+
+    tmp = "{}.autovenv-dedupe-{}".format(path, os.getpid())
+    os.link(entry, tmp)
+    os.replace(tmp, path)
+    stats.linked += 1
+    if st.st_nlink == 1:
+        stats.reclaimed += st.st_size
+
+
+def dedupe_venv(store, venv_path, stats=None):
+    """Moves the venv's files into the store (or links them to identical
+    files already there). Returns the Stats.
+    """
+    stats = stats or Stats()
+    venv_path = venv_path.rstrip(os.sep)
+
+    for dirpath, dirnames, filenames in os.walk(venv_path):
+        if dirpath == venv_path:
+            dirnames[:] = [d for d in dirnames if d not in SKIPPED]
+            filenames = [
+                f for f in filenames if f not in SKIPPED and not f.startswith(".")
+            ]
+
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            st = os.lstat(path)
+            if not stat.S_ISREG(st.st_mode) or not st.st_size:
+                continue
+            stats.files += 1
+            dedupe_file(store, path, st, stats)
+
+    return stats
+
+
+def prune(store, stats=None):
+    """Removes stored files that no venv uses any more."""
+    stats = stats or Stats()
+
+    for dirpath, _, filenames in os.walk(store):
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            st = os.lstat(path)
+            if st.st_nlink == 1:
+                os.remove(path)
+                stats.pruned += 1
+                stats.reclaimed += st.st_size
+    return stats
+
+
+def dedupe(v, paths=None):
+    """Moves the files of the given venvs (by default, every venv and
+    template) into the shared store, and prunes whatever in the store
+    is no longer used. Returns the exit status.
+    """
+    from .bulk import find_templates, find_venvs, is_venv
+    from .util import resolve_path
+
+    if paths:
+        venvs = [resolve_path(p) for p in paths]
+    else:
+        # templates first, since clones often share their files already
+        venvs = list(find_templates(v))
+        venvs += [venv.path for venv in find_venvs(v)]
+
+    store = store_path(v.data_dir)
+    stats = Stats()
+
+    for path in venvs:
+        if not is_venv(path):
+            print("AUTOVENV: ERROR (not a venv: {})".format(path))
+            return 1
+        print("AUTOVENV: deduplicating {}".format(path))
+        try:
+            dedupe_venv(store, path, stats)
+        except StoreError as e:
+            print("AUTOVENV: ERROR ({})".format(e))
+            return 1
+
+    prune(store, stats)
+    print("AUTOVENV: {}".format(stats.summary()))
+    return 0
@@ -0,0 +1,296 @@
+"""
+Keeping a venv's installed packages in step with its project's
+requirement files (requirements*.txt and pyproject.toml, among the
+config's file_names).
+
+What was last synced is recorded in the venv itself, in a marshal file
+holding, per requirement file, its stat and sha256, and the pins that
+were installed. That makes the staleness check cheap enough for the cd
+hot path: a stat per file, and a hash only for files whose stat changed.
+
+Syncing installs only what was added or changed and uninstalls what was
+removed. Files with anything other than plain "name[extras] spec; marker"
+lines (options, hashes, includes, paths, URLs) are installed whole with -r
+whenever they change, since there's no telling what they pin.
+"""
+
+import os
+import io
+import re
+
+from .util import file_stamp
+
+RECORD_NAME = ".autovenv-sync"
+
+RECORD_VERSION = 1
+
+OPTION = re.compile(r"\s--?[A-Za-z]")
+
+PIN = re.compile(r"^([A-Za-z0-9][A-Za-z0-9._-]*)\s*(\[[^\]]*\])?\s*([^@]*)$")
+
+
+def is_requirements_file(name):
+    return name == "pyproject.toml" or (
+        name.startswith("requirements") and name.endswith(".txt")
+    )
+
+
+def current_files(projfolder, file_names):
+    """Returns {path: stamp} for the requirement files the project has."""
+    files = {}
+    for name in file_names or []:
+        if is_requirements_file(name):
+            path = os.path.join(projfolder, name)
+            stamp = file_stamp(path)
+            if stamp is not None:
+                files[path] = stamp
+    return files
+
+
+def file_digest(path):
+    import hashlib
+
+    with io.open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def record_path(venv_path):
+    return os.path.join(venv_path, RECORD_NAME)
+
+
+def read_record(venv_path):
+    """Returns the record of the last sync, or None if there isn't one."""
+    import marshal
+
+    try:
+        with io.open(record_path(venv_path), "rb") as f:
+            record = marshal.loads(f.read())
+    except (OSError, EOFError, ValueError, TypeError):
+        return None
+
+    if isinstance(record, dict) and record.get("version") == RECORD_VERSION:
+        return record
+
+
+def write_record(venv_path, record):
+    import marshal
+
+    path = record_path(venv_path)
+    tmp = "{}.{}.tmp".format(path, os.getpid())
+    with io.open(tmp, "wb") as f:
+        marshal.dump(dict(record, version=RECORD_VERSION), f)
+    os.replace(tmp, path)
+
+
+def is_stale(venv_path, files):
+    """Whether the requirement files (as returned by current_files) have
+    changed since the venv was last synced. Files whose stat changed but
+    whose content didn't are restamped, so they're only hashed once.
+    """
+    record = read_record(venv_path)
+    if record is None:
+        return True
+
+    recorded = record["files"]
+    if set(recorded) != set(files):
+        return True
+
+    restamped = False
+    for path, stamp in files.items():
+        old_stamp, digest = recorded[path]
+        if stamp == old_stamp:
+            continue
+        try:
+            if file_digest(path) != digest:
+                return True
+        except IOError:
+            return True
+        recorded[path] = (stamp, digest)
+        restamped = True
+
+    if restamped:
+        try:
+            write_record(venv_path, record)
+        except OSError:
+            pass
+    return False
+
+
+def canonical_name(name):
+    return re.sub(r"[-_.]+", "-", name).lower()
+
+
+def parse_requirement(line):
+    """Returns (canonical name, normalized line) for a plain pin, or None
+    for anything else. Spaces are dropped from the extras and the version
+    spec, but the marker is kept as written, since spaces matter there
+    (as in 'python_version >= "3.8" and sys_platform == "linux"').
+    """
+    m = PIN.match(line)
+    # per-requirement options (eg. --hash) and continued lines are for pip
+    # to make sense of, with the whole file
+    if not m or "://" in line or OPTION.search(line) or line.endswith("\\"):
+        return None
+    name, extras, rest = m.groups()
+    spec, semicolon, marker = rest.partition(";")
+    normalized = name + (extras or "").replace(" ", "") + spec.replace(" ", "")
+    if semicolon:
+        normalized += "; " + marker.strip()
+    return canonical_name(name), normalized
+
+
+def requirement_name(line):
+    """The canonical name a line pins, ignoring any options after it (as
+    in "foo==1.0 --hash=..."), or None.
+    """
+    parsed = parse_requirement(OPTION.split(line, 1)[0].strip())
+    return parsed and parsed[0]
+
+
+def requirements_txt_lines(path):
+    lines = []
+    with io.open(path) as f:
+        # a line ending in a backslash continues on the next, as for pip
+        text = f.read().replace("\\\n", " ")
+        for line in text.splitlines():
+            line = line.split(" #", 1)[0].strip()
+            if line and not line.startswith("#"):
+                lines.append(line)
+    return lines
+
+
+def load_toml(path):
+    try:
+        import tomllib
+    except ImportError:
+        try:
+            import tomli as tomllib
+        except ImportError:
+            return None
+
+    with io.open(path, "rb") as f:
+        return tomllib.load(f)
+
+
+def pyproject_lines(path):
+    """The project's dependencies, or None if they can't be read (no
+    toml parser, or dependencies that are dynamic).
+    """
+    data = load_toml(path)
+    if data is None:
+        return None
+    project = data.get("project") or {}
+    if "dependencies" in project.get("dynamic", []):
+        return None
+    return list(project.get("dependencies", []))
+
+
+def wanted(files):
+    """Returns ({name: pin} for every plain pin across the files, [the
+    files that have to be installed whole], {names pinned in those}).
+    """
+    pins = {}
+    whole = []
+    whole_names = set()
+
+    for path in sorted(files):
+        if os.path.basename(path) == "pyproject.toml":
+            lines = pyproject_lines(path)
+            if lines is None:
+                print("AUTOVENV: can't read the dependencies in {}".format(path))
+                continue
+        else:
+            lines = requirements_txt_lines(path)
+
+        parsed = [parse_requirement(line) for line in lines]
+        if None in parsed:
+            whole.append(path)
+            whole_names.update(requirement_name(line) for line in lines)
+            whole_names.discard(None)
+        else:
+            pins.update(parsed)
+
+    return pins, whole, whole_names
+
+
+def pip(python, projfolder, *args):
+    import subprocess
+
+    cmd = [python, "-m", "pip", "--disable-pip-version-check"] + list(args)
+    print("AUTOVENV: {}".format(" ".join(cmd)))
+    # from the project folder, for relative paths in requirement files
+    return subprocess.call(cmd, cwd=projfolder) == 0
+
+
+def sync(venv_path, projfolder, file_names):
+    """Brings the venv in line with the project's requirement files,
+    returning the exit status.
+    """
+    files = current_files(projfolder, file_names)
+    digests = {path: file_digest(path) for path in files}
+
+    record = read_record(venv_path) or dict(files={}, pins={}, failed=False)
+    old_pins = record["pins"]
+    new_pins, whole, whole_names = wanted(files)
+
+    install = sorted(pin for name, pin in new_pins.items() if old_pins.get(name) != pin)
+    remove = sorted(
+        name for name in old_pins if name not in new_pins and name not in whole_names
+    )
+
+    if not record["failed"]:
+        # files installed whole last time only need doing again if changed
+        whole = [
+            path
+            for path in whole
+            if record["files"].get(path, (None, None))[1] != digests[path]
+        ]
+
+    python = os.path.join(venv_path, "bin", "python")
+    ok = True
+
+    if remove:
+        ok = pip(python, projfolder, "uninstall", "--yes", *remove) and ok
+    if install:
+        ok = pip(python, projfolder, "install", *install) and ok
+    for path in whole:
+        ok = pip(python, projfolder, "install", "-r", path) and ok
+
+    if not (remove or install or whole):
+        print("AUTOVENV: {} is up to date".format(venv_path))
+
+    # the files are recorded either way, so the hook doesn't try again on
+    # every cd; an explicit "autovenv sync" retries whatever failed
+    write_record(
+        venv_path,
+        dict(
+            files={path: (files[path], digests[path]) for path in files},
+            pins=new_pins if ok else old_pins,
+            failed=not ok,
+        ),
+    )
+
+    if not ok:
+        print("AUTOVENV: ERROR (sync failed, run autovenv sync to try again)")
+        return 1
+    return 0
+
+
+def sync_current(v):
+    """Runs "autovenv sync" for the project v resolves to. Returns the
+    exit status.
+    """
+    from .util import disk_usage
+    from .virtualenvs import RECREATE_ERROR
+
+    r = v.resolution
+    if not r.venv_name:
+        print(RECREATE_ERROR)
+        return 1
+    if not r.venv_exists:
+        print("AUTOVENV: ERROR (no venv at {} yet)".format(r.venv_path))
+        return 1
+    status = sync(r.venv_path, r.projfolder, v.config.get("file_names"))
+    v.store_venv(r.venv_path)
+    v.record_event("update", r.venv_path, size=disk_usage(r.venv_path))
+    return status
@@ -0,0 +1,194 @@
+"""
+Opt-in tracing of where the time goes when working out a suggestion.
+
+Set AUTOVENV_TRACE to a file path, and each invocation appends one JSON
+line to it, with the time spent in each phase (importing, loading the
+config, walking up to the project folder, ...) and counts of the
+filesystem calls made (stats, opens, reads, ...):
+
+    AUTOVENV_TRACE=/tmp/autovenv.trace autovenv bash
+
+With AUTOVENV_TRACE unset, traced() hands back functions unchanged and
+phase() a shared do-nothing context manager, and nothing is patched, so
+tracing costs next to nothing. It's decided once, at import.
+"""
+
+import os
+import time
+
+TRACE_PATH = os.environ.get("AUTOVENV_TRACE") or None
+
+enabled = TRACE_PATH is not None
+
+STARTED = time.perf_counter()
+
+COUNTED_OS = ("stat", "lstat", "scandir", "listdir")
+
+# phase name -> [seconds, calls]
+timings = {}
+counts = {}
+begun = STARTED
+
+
+class NoPhase(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NO_PHASE = NoPhase()
+
+
+class Phase(object):
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        timing = timings.setdefault(self.name, [0.0, 0])
+        timing[0] += time.perf_counter() - self.start
+        timing[1] += 1
+        return False
+
+
+def phase(name):
+    """A context manager that times its body as the named phase."""
+    if not enabled:
+        return NO_PHASE
+    return Phase(name)
+
+
+def traced(name):
+    """A decorator that times calls to the function as the named phase."""
+
+    def decorate(f):
+        if not enabled:
+            return f
+
+        def wrapper(*args, **kwargs):
+            with Phase(name):
+                return f(*args, **kwargs)
+
+        wrapper.__name__ = f.__name__
+        wrapper.__doc__ = f.__doc__
+        return wrapper
+
+    return decorate
+
+
+def mark(name):
+    """Records the time from the start of this invocation up to now as
+    the named phase, unless it's been recorded already.
+    """
+    if enabled and name not in timings:
+        timings[name] = [time.perf_counter() - begun, 1]
+
+
+def count(name, n=1):
+    counts[name] = counts.get(name, 0) + n
+
+
+class CountingFile(object):
+    """Wraps a file object, counting reads and bytes read."""
+
+    def __init__(self, f):
+        self._f = f
+
+    def read(self, *args):
+        data = self._f.read(*args)
+        count("read")
+        count("read_bytes", len(data))
+        return data
+
+    def readline(self, *args):
+        data = self._f.readline(*args)
+        count("read")
+        count("read_bytes", len(data))
+        return data
+
+    def __iter__(self):
+        for line in self._f:
+            count("read")
+            count("read_bytes", len(line))
+            yield line
+
+    def __enter__(self):
+        self._f.__enter__()
+        return self
+
+    def __exit__(self, *exc):
+        return self._f.__exit__(*exc)
+
+    def __getattr__(self, name):
+        return getattr(self._f, name)
+
+
+def install():
+    """Patches os and io so that filesystem calls are counted."""
+    import io
+
+    def counting(name, original):
+        def wrapper(*args, **kwargs):
+            count(name)
+            return original(*args, **kwargs)
+
+        return wrapper
+
+    for name in COUNTED_OS:
+        setattr(os, name, counting(name, getattr(os, name)))
+
+    original_open = io.open
+
+    def counting_open(*args, **kwargs):
+        count("open")
+        return CountingFile(original_open(*args, **kwargs))
+
+    io.open = counting_open
+
+
+def begin():
+    """Starts tracing a new invocation (for long-lived processes)."""
+    global begun
+
+    timings.clear()
+    counts.clear()
+    begun = time.perf_counter()
+
+
+def finish(**fields):
+    """Appends this invocation's trace to the trace file, along with any
+    extra fields given, and starts afresh.
+    """
+    if not enabled:
+        return
+
+    import json
+
+    record = dict(fields)
+    record.update(
+        time=round(time.time(), 3),
+        pid=os.getpid(),
+        total_ms=round((time.perf_counter() - begun) * 1000, 3),
+        phases={
+            name: dict(ms=round(seconds * 1000, 3), calls=calls)
+            for name, (seconds, calls) in timings.items()
+        },
+        counts=dict(counts),
+    )
+    line = json.dumps(record, sort_keys=True) + "\n"
+
+    try:
+        with open(TRACE_PATH, "a") as f:
+            f.write(line)
+    except (IOError, OSError):
+        pass
+    begin()
+
+
+if enabled:
+    install()
@@ -1,14 +1,21 @@
 import os
 import errno
 
-import json
-import shlex
-
-from pathlib import Path
+# Characters shlex.quote leaves unquoted.
+SAFE_CHARS = frozenset(
+    "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789@%+=:,./-_"
+)
 
 
 def shquote(string):
-    return shlex.quote(string)
+    """shlex.quote, without importing shlex (and with it re), which the
+    hook can't afford.
+    """
+    if not string:
+        return "''"
+    if SAFE_CHARS.issuperset(string):
+        return string
+    return "'" + string.replace("'", "'\"'\"'") + "'"
 
 
 def to_string(x):
@@ -18,6 +25,8 @@ def to_string(x):
 
 
 def jsondump(x):
+    import json
+
     j = json.dumps(x, sort_keys=True, indent=4, separators=(",", ": "))
     return to_string(j) + "\n"
 
@@ -26,16 +35,25 @@ def file_exists(fpath):
     return os.path.exists(fpath)
 
 
+def file_stamp(path):
+    """Returns something that changes whenever the file (or folder) at
+    path does, or None if there's no such file.
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+
 def resolve_path_pathlib(p):
-    p = Path(p).expanduser().resolve()
-    real = os.path.realpath(str(p))
-    real = Path(real)
-    return real
+    from pathlib import Path
+
+    return Path(resolve_path(p))
 
 
 def resolve_path(p):
-    p = resolve_path_pathlib(p)
-    return str(p)
+    return os.path.realpath(os.path.expanduser(p))
 
 
 def unresolve(path, homepath):
@@ -44,6 +62,13 @@ def unresolve(path, homepath):
     return path
 
 
+def expand(path, homepath):
+    """The inverse of unresolve."""
+    if path == "~" or path.startswith("~/"):
+        path = path.replace("~", homepath, 1)
+    return path
+
+
 def create_symlink(
     target, link_name, fail_if_exists=False, temporary_suffix="_temporary_symlink"
 ):
@@ -69,3 +94,68 @@ def mkdir_p(path):
             pass
         else:
             raise
+
+
+def read_pyvenv_cfg(venv_path):
+    """Returns the key = value pairs in a venv's pyvenv.cfg as a dict
+    (empty if there's no such file).
+    """
+    import io
+
+    values = {}
+    try:
+        with io.open(os.path.join(venv_path, "pyvenv.cfg")) as f:
+            lines = f.read().splitlines()
+    except IOError:
+        return values
+
+    for line in lines:
+        key, sep, value = line.partition("=")
+        if sep:
+            values[key.strip()] = value.strip()
+    return values
+
+
+def update_pyvenv_cfg(venv_path, **items):
+    """Sets extra keys in a venv's pyvenv.cfg, replacing any previous
+    values for them. Python ignores keys it doesn't know about.
+    """
+    import io
+
+    path = os.path.join(venv_path, "pyvenv.cfg")
+    with io.open(path) as f:
+        lines = f.read().splitlines()
+
+    lines = [line for line in lines if line.partition("=")[0].strip() not in items]
+    lines += ["{} = {}".format(k, v) for k, v in sorted(items.items())]
+
+    with io.open(path, "w") as f:
+        f.write("\n".join(lines) + "\n")
+
+
+def format_size(size):
+    for unit in ("bytes", "KB", "MB", "GB"):
+        if size < 1024 or unit == "GB":
+            break
+        size /= 1024.0
+    if unit == "bytes":
+        return "{} bytes".format(int(size))
+    return "{:.1f} {}".format(size, unit)
+
+
+def disk_usage(path):
+    """The total size of the files under path, counting each file that's
+    hardlinked more than once there only once.
+    """
+    seen = set()
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            try:
+                st = os.lstat(os.path.join(dirpath, name))
+            except OSError:
+                continue
+            if (st.st_dev, st.st_ino) not in seen:
+                seen.add((st.st_dev, st.st_ino))
+                total += st.st_size
+    return total
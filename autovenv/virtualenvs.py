@@ -1,42 +1,57 @@
-from pathlib import Path
-
 import os
 import sys
 import io
+import time
 import errno
 
-import subprocess
-import shutil
-import shlex
-
-from pkg_resources import resource_filename
-
-import appdirs
-
-import yaml
-
+from .overrides import OverrideIndex, parse_override, unparse_override  # noqa
+from .resolution import (
+    Resolution,
+    read_cached,
+    write_cached,
+    stamp_path,
+    write_stamp,
+)
+from .tracing import mark, phase, traced
+from .wheelhouse import wheelhouse_path, creation_command
 from .util import (
     mkdir_p,
     create_symlink,
     resolve_path,
     resolve_path_pathlib,
-    jsondump,
     to_string,
     unresolve,
+    expand,
     shquote,
+    disk_usage,
+    file_stamp,
 )
 
+# Anything heavier than the above (yaml, subprocess, shutil, shlex) is
+# imported where it's used, since "autovenv bash" runs on every cd and
+# mostly needs none of it.
 
-HOME = os.path.expanduser("~")
-CWD = os.getcwd()
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
 
-dirs = appdirs.AppDirs("autovenv", "djrobstep")
-
-DATA_DIR = HOME + '/' + '.autovenv'
+# under the home folder, unless a data_dir is given
+DATA_DIR_NAME = ".autovenv"
 
 RECREATE_ERROR = "AUTOVENV: ERROR (not within a python project)"
 
 
+def read_lines(path):
+    """Returns the stripped lines of a file, or an empty list if
+    it doesn't exist.
+    """
+    try:
+        with io.open(path) as f:
+            return [line.strip() for line in f.read().splitlines()]
+    except IOError as exc:
+        if exc.errno in (errno.ENOENT, errno.ENOTDIR, errno.EISDIR):
+            return []
+        raise
+
+
 def is_project_root(path, file_names=None):
     """Tests if a given folder path is likely to be the
     root of a python project.
@@ -49,26 +64,93 @@ def is_project_root(path, file_names=None):
     return any(file_is_present(each) for each in file_names)
 
 
-def get_likely_projfolder(fpath, home, config=None):
+# Project root strategies: the outermost folder with a marker file in it
+# (up to home), the nearest one, or the outermost one not above the
+# nearest version control root.
+STRATEGIES = ("outermost", "nearest", "vcs")
+
+VCS_MARKERS = frozenset([".git", ".hg", ".svn", ".bzr"])
+
+
+def probe_dir(path, markers):
+    """Lists the directory once, returning (whether it has any of the
+    marker files, whether it's a version control root).
+    """
+    has_marker = is_vcs_root = False
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.name in markers and not has_marker:
+                    try:
+                        has_marker = entry.is_file()
+                    except OSError:
+                        pass
+                elif entry.name in VCS_MARKERS:
+                    is_vcs_root = True
+    except OSError:
+        pass
+    return has_marker, is_vcs_root
+
+
+@traced("projfolder")
+def get_likely_projfolder(
+    fpath, home, config=None, overrides=None, memo=None, visited=None
+):
+    """Finds the project folder for fpath: an override's folder, or else a
+    folder (fpath or one of its ancestors, up to home) containing one of
+    the config's file_names, chosen per the project_root_strategy setting.
+
+    Each folder is listed at most once, and not at all if it's in memo,
+    a dict of earlier probe_dir results kept across calls. If visited is
+    given, each folder looked at is appended to it.
+    """
     config = config or {}
 
-    if config:
-        overrides = config.get("overrides", {})
-        for k, v in overrides:
-            if not v["venvname"]:
-                continue
-            if fpath.startswith(k):
-                return k
+    if overrides is None:
+        overrides = OverrideIndex.build(config.get("override"))
+
+    override_path, _ = overrides.longest_match(fpath, "venvname")
+    if override_path:
+        return override_path
+
+    markers = frozenset(config.get("file_names") or ())
+    if not markers:
+        return None
+
+    strategy = config.get("project_root_strategy") or "outermost"
+    if strategy not in STRATEGIES:
+        raise ValueError("unknown project_root_strategy: {}".format(strategy))
+    max_depth = config.get("project_root_max_depth")
 
     f = fpath
     likely_projfolder = None
+    depth = 0
 
     while True:
         if not f.startswith(home):
             break
 
-        if is_project_root(f, config.get("file_names")):
+        if max_depth is not None and depth >= max_depth:
+            break
+        depth += 1
+
+        if visited is not None:
+            visited.append(f)
+
+        probed = memo.get(f) if memo is not None else None
+        if probed is None:
+            probed = probe_dir(f, markers)
+            if memo is not None:
+                memo[f] = probed
+        has_marker, is_vcs_root = probed
+
+        if has_marker:
             likely_projfolder = f
+            if strategy == "nearest":
+                break
+
+        if is_vcs_root and strategy == "vcs":
+            break
 
         parent = os.path.dirname(f)
         if parent == f:
@@ -82,29 +164,103 @@ def get_likely_projfolder(fpath, home, config=None):
 
 DEFAULT_CONFIG = {"file_names": ["requirements.txt", "pyproject.toml"]}
 
+# Settings that can be added to the config file, and their defaults when
+# they're not there.
+CONFIG_DEFAULTS = {
+    # create venvs by cloning a template venv per python build
+    "clone_template": True,
+    # have the shell hook create missing venvs in a background job
+    "background_create": False,
+    # keep each venv's packages in step with its project's requirement files
+    "sync_requirements": False,
+    # hardlink identical files in venvs to one copy in a shared store
+    "package_store": False,
+    # for "autovenv gc": evict venvs not activated in this many days, and
+    # then least recently activated ones to get under this size (eg. 20G)
+    "gc_max_age_days": None,
+    "gc_disk_budget": None,
+    # run "autovenv gc" (at most daily) after creating a venv
+    "gc_auto": False,
+    # how to pick the project folder (see STRATEGIES), and how many
+    # folders up from the current one to look
+    "project_root_strategy": "outermost",
+    "project_root_max_depth": None,
+    # remember each folder's resolution (see resolution.py), so that
+    # going back to a folder costs a few stats
+    "resolution_cache": True,
+    # "direct" sets the venv's environment variables straight from the
+    # hook, "source" runs the venv's activate script (and deactivate)
+    "activation": "direct",
+    # check a venv (a few stats, see health.py) before activating it, and
+    # warn if it looks broken
+    "check_on_activate": False,
+}
+
+CONFIG_CACHE_NAME = "config.cache"
+
+# Bump whenever the compiled form of the config changes shape.
+CONFIG_CACHE_VERSION = 2
+
+
+def default_config():
+    return {k: list(v) for k, v in DEFAULT_CONFIG.items()}
+
+
+def read_config_cache(path, stamp):
+    """Returns the cached (config, override trie), if the cache is for
+    the config file as it is now.
+    """
+    import marshal
+
+    try:
+        with io.open(path, "rb") as f:
+            # loads(read()) rather than load(f): the latter reads the file a
+            # few bytes at a time, which is very slow for a large config
+            version, cached_stamp, config, trie = marshal.loads(f.read())
+    except (OSError, EOFError, ValueError, TypeError):
+        return None
 
-def parse_override(v):
-    if not v:
-        pyversion = None
-        venvname = None
-    else:
+    if version == CONFIG_CACHE_VERSION and cached_stamp == stamp:
+        return config, trie
+
+
+def write_config_cache(path, stamp, config, trie):
+    """Best-effort: a config that marshal can't handle (or a read-only
+    data dir) just means we parse the YAML each time.
+    """
+    import marshal
+
+    tmp = "{}.{}.tmp".format(path, os.getpid())
+    try:
+        with io.open(tmp, "wb") as f:
+            marshal.dump((CONFIG_CACHE_VERSION, stamp, config, trie), f)
+        os.replace(tmp, path)
+    except (OSError, ValueError):
         try:
-            pyversion, venvname = v.split("/", 1)
-            pyversion = pyversion or None
-            venvname = venvname or None
-        except ValueError:
-            pyversion = v
-            venvname = None
-    return dict(pyversion=pyversion, venvname=venvname)
+            os.remove(tmp)
+        except OSError:
+            pass
+
+
+_config_dumper = None
+
+
+def config_dumper():
+    """A yaml dumper that writes None as an empty value, created once."""
+    global _config_dumper
+
+    if _config_dumper is None:
+        import yaml
 
+        class ConfigDumper(yaml.SafeDumper):
+            pass
 
-def unparse_override(v):
-    pyversion = v["pyversion"]
-    venvname = v["venvname"]
-    s = pyversion or ""
-    if venvname:
-        s += "/{}".format(venvname)
-    return s or None
+        ConfigDumper.add_representer(
+            type(None),
+            lambda dumper, value: dumper.represent_scalar("tag:yaml.org,2002:null", ""),
+        )
+        _config_dumper = ConfigDumper
+    return _config_dumper
 
 
 class VirtualEnvs(object):
@@ -112,74 +268,285 @@ class VirtualEnvs(object):
     This is where the action happens.
     """
 
-    def __init__(self, data_dir=None, home=None, cwd=None):
-        self.data_dir = resolve_path(data_dir or DATA_DIR)
-        self.home = resolve_path(home or HOME)
-        self.cwd_pathlib = resolve_path_pathlib(cwd or CWD)
-        self.cwd = str(self.cwd_pathlib)
+    def __init__(self, data_dir=None, home=None, cwd=None, virtual_env=None):
+        mark("import")
+        # the defaults are looked up now rather than at import, so that a
+        # long-lived process gets the current ones
+        home = home or os.path.expanduser("~")
+        self.data_dir = resolve_path(data_dir or os.path.join(home, DATA_DIR_NAME))
+        self.home = resolve_path(home)
+        self.cwd = resolve_path(cwd or os.getcwd())
+        self.virtual_env = virtual_env
 
         self.configpath = os.path.join(self.data_dir, "config")
+        self.configcachepath = os.path.join(self.data_dir, CONFIG_CACHE_NAME)
+
+        if sys.platform == "darwin":
+            self.venvspath = os.path.join(self.home, ".autovenv")
+        else:
+            self.venvspath = os.path.join(self.data_dir, "venvs")
+        mkdir_p(self.venvspath)
+
+        self.pyversionspath_framework = self.pyversionspath_for(True)
+
+        self.config, self.overrides = self.get_compiled_config()
+        self._resolution = None
+        self._resolved_ns = None
+        self._probes = {}
+
+    def forget(self):
+        """Drops everything remembered about the filesystem (the probe
+        memo and the current resolution), and reloads the config if it
+        has changed, for callers that keep this around a while.
+        """
+        if file_stamp(self.configpath) != self.config_stamp:
+            self.config, self.overrides = self.get_compiled_config()
+        self._resolution = None
+        self._probes = {}
 
-        if self.should_use_framework_build:
+    def pyversionspath_for(self, framework):
+        if framework:
             pvname = "pyversions-framework"
         else:
             pvname = "pyversions"
 
         if sys.platform == "darwin":
-            pvname = "." + pvname
+            return os.path.join(self.home, "." + pvname)
+        else:
+            return os.path.join(self.data_dir, pvname)
 
-            self.pyversionspath = os.path.join(self.home, pvname)
-            self.venvspath = os.path.join(self.home, ".autovenv")
+    @property
+    def resolution(self):
+        """The Resolution for the current directory, computed on
+        first use.
+        """
+        if self._resolution is None:
+            self._resolved_ns = int(time.time() * 10**9)
+            self._resolution = self.resolve()
+        return self._resolution
+
+    @traced("resolve")
+    def resolve(self, cwd=None, cache=True):
+        """Works out which venv and python build belong to the given
+        directory (by default, the current one), touching each file
+        involved at most once.
+
+        With the resolution_cache setting on (and cache true), the answer
+        is remembered in the data dir along with the stamps of the files
+        and folders it came from, and reused for as long as none of them
+        change.
+        """
+        cwd = self.cwd if cwd is None else resolve_path(cwd)
+
+        use_cache = cache and self.setting("resolution_cache")
+        if use_cache:
+            cache_key = (self.home, self.config_stamp)
+            with phase("resolution_cache"):
+                cached = read_cached(self.data_dir, cwd, cache_key)
+            if cached is not None:
+                return Resolution(
+                    cwd=cwd,
+                    venv_exists=bool(cached["venv_name"])
+                    and os.path.exists(cached["venv_path"]),
+                    current_venv_path=self.current_venv_path,
+                    **cached,
+                )
 
-        else:
-            self.pyversionspath = os.path.join(self.data_dir, pvname)
-            self.venvspath = os.path.join(self.data_dir, "venvs")
-        mkdir_p(self.venvspath)
+        # the folders and files the answer depends on
+        inputs = []
+
+        projfolder = get_likely_projfolder(
+            cwd,
+            self.home,
+            config=self.config,
+            overrides=self.overrides,
+            memo=self._probes,
+            visited=inputs,
+        )
+
+        pythonversion_lines = []
+        if projfolder:
+            pythonversion_file = os.path.join(projfolder, ".python-version")
+            inputs.append(pythonversion_file)
+            with phase("python_version"):
+                pythonversion_lines = read_lines(pythonversion_file)
+
+        use_framework_build = "use_framework_build" in pythonversion_lines
+        pyversionspath = self.pyversionspath_for(use_framework_build)
+
+        pythonbuild = None
+        if pythonversion_lines and pythonversion_lines[0]:
+            pythonbuild = pythonversion_lines[0]
+
+        if not pythonbuild:
+            pythonbuild = self.overrides.pyversion(cwd)
+
+        if pythonbuild:
+            from .pyversions import is_partial
+
+            if is_partial(pythonbuild):
+                inputs.append(pyversionspath)
+                with phase("match_build"):
+                    pythonbuild = self.match_build(pythonbuild, pyversionspath)
+
+        if not pythonbuild:
+            with phase("current_build"):
+                current = os.path.join(pyversionspath, "current")
+                inputs.append(current)
+                if os.path.exists(current):
+                    pythonbuild = os.path.split(os.path.realpath(current))[1]
+
+        venv_name = self.overrides.venvname(cwd)
+        if not venv_name:
+            venv_name = os.path.split(projfolder or "")[1]
+
+        venv_path = os.path.join(self.venvspath, pythonbuild or "", venv_name)
+
+        boundary = ""
+        if (
+            projfolder
+            and self.boundary_is_safe
+            and not self.overrides.has_descendants(projfolder)
+        ):
+            boundary = projfolder
+
+        r = Resolution(
+            cwd=cwd,
+            projfolder=projfolder,
+            boundary=boundary,
+            venv_name=venv_name,
+            venv_path=venv_path,
+            venv_exists=bool(venv_name) and os.path.exists(venv_path),
+            pythonbuild=pythonbuild,
+            pyversionspath=pyversionspath,
+            use_framework_build=use_framework_build,
+            current_venv_path=self.current_venv_path,
+        )
+        if use_cache:
+            write_cached(self.data_dir, cwd, cache_key, inputs, r)
+        return r
 
-        self.pyversionspath_framework = self.pyversionspath.replace(
-            "pyversions", "pyversions-framework"
+    def match_build(self, spec, pyversionspath):
+        """Resolves a partial version or specifier (eg. 3.11, >=3.10) to
+        the best installed build, or leaves it as it is if none match.
+        """
+        from .pyversions import best_build, index_path, installed_builds
+
+        names = installed_builds(
+            pyversionspath, index_path(self.data_dir, pyversionspath)
+        )
+        try:
+            return best_build(names, spec) or spec
+        except ValueError:
+            return spec
+
+    @property
+    def boundary_is_safe(self):
+        """Whether everything under a project folder belongs to that
+        project. Not so if a nested folder with a marker (or a nested
+        repo) can be a project of its own, or if a folder deep enough
+        down doesn't look far enough up to find the project.
+        """
+        return (
+            self.setting("project_root_strategy") == "outermost"
+            and self.setting("project_root_max_depth") is None
         )
 
-        self.config = self.get_config()
-        self.save_config(self.config)
+    @property
+    def pyversionspath(self):
+        return self.resolution.pyversionspath
+
+    @property
+    def cwd_pathlib(self):
+        return resolve_path_pathlib(self.cwd)
 
+    @traced("yaml")
     def load_config(self):
         try:
-            text = Path(self.configpath).read_text()
-            return yaml.safe_load(text)
+            with io.open(self.configpath) as f:
+                text = f.read()
         except IOError as exc:
             if exc.errno == errno.ENOENT:
                 return None
             else:
                 raise
 
-    def get_config(self):
-        config_yaml = self.load_config()
+        import yaml
+
+        return yaml.safe_load(text)
+
+    def compile_config(self, config_yaml):
         if config_yaml is None:
-            return DEFAULT_CONFIG
+            return default_config()
 
-        overrides = config_yaml.get("override", {})
-        config_yaml["override"] = {
-            resolve_path(k): parse_override(v) for k, v in overrides.items()
-        }
+        if "override" in config_yaml:
+            overrides = config_yaml["override"] or {}
+            config_yaml["override"] = {
+                resolve_path(expand(k, self.home)): parse_override(v)
+                for k, v in overrides.items()
+            }
 
         return config_yaml
 
-    def save_config(self, config):
-        yaml.SafeDumper.add_representer(
-            type(None),
-            lambda dumper, value: dumper.represent_scalar("tag:yaml.org,2002:null", ""),
-        )
-        config["override"] = {
-            unresolve(k, self.home): unparse_override(v)
-            for k, v in config.get("override", {}).items()
-        }
+    def get_config(self):
+        """Returns the config, compiled (override paths resolved and parsed)."""
+        return self.get_compiled_config()[0]
+
+    @traced("config")
+    def get_compiled_config(self):
+        """Returns the compiled config and its OverrideIndex.
 
-        text = jsondump(config)
-        text = yaml.safe_dump(config, default_flow_style=False)
+        Both are cached next to the config file, keyed by the config
+        file's stat, so that the usual case costs a stat and a marshal
+        load rather than a YAML parse.
+        """
+        stamp = self.config_stamp = file_stamp(self.configpath)
+        if stamp is None:
+            return default_config(), OverrideIndex()
+
+        cached = read_config_cache(self.configcachepath, stamp)
+        if cached is None:
+            config = self.compile_config(self.load_config())
+            overrides = OverrideIndex.build(config.get("override"))
+            write_config_cache(self.configcachepath, stamp, config, overrides.root)
+        else:
+            config, trie = cached
+            overrides = OverrideIndex(trie)
+        return config, overrides
 
-        Path(self.configpath).write_text(to_string(text))
-        self.config = self.get_config()
+    def save_config(self, config):
+        """Writes the given (compiled) config to the config file, if it
+        differs from what's there already.
+        """
+        if config == self.config and os.path.exists(self.configpath):
+            return
+
+        import yaml
+
+        to_save = dict(config)
+        if "override" in to_save:
+            to_save["override"] = {
+                unresolve(k, self.home): unparse_override(v)
+                for k, v in to_save["override"].items()
+            }
+
+        text = yaml.dump(to_save, Dumper=config_dumper(), default_flow_style=False)
+
+        mkdir_p(self.data_dir)
+        with io.open(self.configpath, "w") as f:
+            f.write(to_string(text))
+
+        self.config = self.compile_config(to_save)
+        self.overrides = OverrideIndex.build(self.config.get("override"))
+        self._resolution = None
+        self._probes = {}
+        self.config_stamp = file_stamp(self.configpath)
+        write_config_cache(
+            self.configcachepath,
+            self.config_stamp,
+            self.config,
+            self.overrides.root,
+        )
 
     def venv_path(self, name):
         return os.path.join(self.venvspath, self.current_pythonbuild_name or "", name)
@@ -189,6 +556,8 @@ class VirtualEnvs(object):
         """Returns the path of the currently active
         virtual environment.
         """
+        if self.virtual_env is not None:
+            return self.virtual_env
         return os.environ.get("VIRTUAL_ENV") or ""
 
     @property
@@ -213,9 +582,7 @@ class VirtualEnvs(object):
         """If we're within a python project, return the
         path to the root of that project. Otherwise, return None.
         """
-
-        config = self.get_config()
-        return get_likely_projfolder(self.cwd, self.home, config=config)
+        return self.resolution.projfolder
 
     @property
     def correct_venv_name(self):
@@ -223,19 +590,11 @@ class VirtualEnvs(object):
         should be active for this project. If we're not within
         a project, return an empty string.
         """
-
-        for k, v in self.config["override"].items():
-            if self.cwd.startswith(k):
-                venvname = v["venvname"]
-                if venvname:
-                    return venvname
-
-        likely = self.likely_projfolder
-        return os.path.split(likely or "")[1]
+        return self.resolution.venv_name
 
     @property
     def correct_venv_path(self):
-        return self.venv_path(self.correct_venv_name)
+        return self.resolution.venv_path
 
     def venv_exists(self, name):
         return os.path.exists(self.venv_path(name))
@@ -246,38 +605,276 @@ class VirtualEnvs(object):
     def pip_path(self, name):
         return os.path.join(self.venv_path(name), "bin/pip")
 
+    @property
+    def wheelhouse(self):
+        """Where the seed wheels for the current python build live."""
+        return wheelhouse_path(self.data_dir, self.resolution.pythonbuild)
+
+    def venv_creation_command(self, path):
+        """The shell command that creates a venv at the given path, seeded
+        from the wheelhouse if there is one.
+        """
+        python = self.python_path
+
+        if not os.path.exists(python):
+            raise ValueError("something went wrong finding a python")
+        return creation_command(python, path, self.wheelhouse)
+
+    def seed(self):
+        from .wheelhouse import refresh
+
+        status = refresh(self.python_path, self.wheelhouse)
+        if status == 0:
+            # so the next clone picks up the new seed packages
+            self.delete_template()
+        return status
+
+    def setting(self, name):
+        return self.config.get(name, CONFIG_DEFAULTS[name])
+
+    @property
+    def template_path(self):
+        """The pristine venv that new venvs for the current python
+        build are cloned from.
+        """
+        from .clone import TEMPLATE_NAME
+
+        return self.venv_path(TEMPLATE_NAME)
+
+    def delete_template(self):
+        """Moves the template out of the way (so nothing can start cloning
+        it half-deleted) and deletes it.
+        """
+        import shutil
+
+        template = self.template_path
+        doomed = "{}.deleting-{}".format(template, os.getpid())
+        try:
+            os.rename(template, doomed)
+        except OSError:
+            return
+        shutil.rmtree(doomed, ignore_errors=True)
+
+    def run_venv_creation(self, path):
+        import subprocess
+
+        pth = os.path.dirname(self.python_path)
+        cmd = self.venv_creation_command(path)
+        print(f"CREATING VENV, using command: {cmd}")
+        return subprocess.run(cmd, env={"PATH": pth}, shell=True).returncode
+
+    def ensure_template(self, rebuild=False):
+        """Builds the template if it isn't ready (or with rebuild, even if
+        it is). Returns whether there's a ready template.
+
+        The building is done under a lock, so concurrent creates build it
+        once between them, and in a staging folder that's then cloned into
+        place, so the template is only ever missing or complete.
+        """
+        import shutil
+
+        from .clone import (
+            TemplateLock,
+            clone_venv,
+            template_ready,
+            mark_template_ready,
+        )
+
+        template = self.template_path
+
+        if template_ready(template) and not rebuild:
+            return True
+
+        with TemplateLock(template):
+            # someone else may have built it while we waited
+            if template_ready(template) and not rebuild:
+                return True
+
+            staging = "{}.building-{}".format(template, os.getpid())
+            shutil.rmtree(staging, ignore_errors=True)
+            print("AUTOVENV: building template venv: {}".format(template))
+            try:
+                if self.run_venv_creation(staging) != 0:
+                    return False
+                mark_template_ready(staging)
+                self.delete_template()
+                # rewrites the paths the venv has to its own location
+                clone_venv(staging, template)
+            finally:
+                shutil.rmtree(staging, ignore_errors=True)
+
+            self.store_venv(template)
+            mark_template_ready(template)
+        return True
+
+    def clone_virtualenv(self, name):
+        """Creates the named venv by cloning the template, building the
+        template first if need be. Returns whether it worked.
+        """
+        from .clone import CloneError, clone_venv
+
+        new_path = self.venv_path(name)
+
+        try:
+            if not self.ensure_template():
+                return False
+            clone_venv(self.template_path, new_path)
+            return True
+        except (CloneError, OSError) as e:
+            print("AUTOVENV: couldn't clone template ({})".format(e))
+            return False
+
     def make_virtualenv(self, name):
         """Make a new virtual environment with the given name."""
         new_path = self.venv_path(name)
 
-        tokens = shlex.split(self.virtualenv_creation_prefix)
-
-        tokens.append('--upgrade-deps')
-        tokens.append(new_path)
-        
         if not os.path.isdir(new_path):
-            pth = tokens[0][:-len('/python')]
-            cmd = ' '.join(tokens)
-            print(f'CREATING VENV, using command: {cmd}')
-            subprocess.run(cmd, env={'PATH': pth}, shell=True)
+            created = False
+            if self.setting("clone_template"):
+                created = self.clone_virtualenv(name)
+                if created:
+                    print("AUTOVENV: created {} from template".format(new_path))
+                else:
+                    print("AUTOVENV: falling back to creating from scratch")
+            if not created:
+                created = self.run_venv_creation(new_path) == 0
+            if created:
+                self.record_venv(new_path)
+                self.store_venv(new_path)
+                self.record_event("create", new_path, size=disk_usage(new_path))
+            return created
         else:
             print("PROBLEM: A virtualenv already exists at", new_path)
+            return False
+
+    def record_venv(self, path):
+        """Notes in the venv's pyvenv.cfg which project it belongs to, so
+        that bulk operations can find their way back to it, and which
+        python it was made from, so that "autovenv check" can tell when
+        that's changed.
+        """
+        from .health import base_fields
+        from .util import update_pyvenv_cfg
+
+        try:
+            update_pyvenv_cfg(
+                path,
+                autovenv_project=self.resolution.projfolder or "",
+                **base_fields(self.python_path),
+            )
+        except IOError as e:
+            print("AUTOVENV: couldn't record project in {} ({})".format(path, e))
+
+    def record_event(self, event, venv_path, **fields):
+        """Records something that happened to a venv in the inventory
+        (see inventory.py).
+        """
+        from .inventory import record
+
+        r = self.resolution
+        if venv_path == r.venv_path:
+            fields.setdefault("project", r.projfolder)
+            fields.setdefault("build", r.pythonbuild)
+        record(self.data_dir, event, venv_path, **fields)
+
+    def venv_resolution(self, venv):
+        """A Resolution for an existing venv (a bulk.Venv), as though
+        resolved from its project.
+        """
+        pyversionspath = self.pyversionspath_for(venv.framework)
+        return Resolution(
+            cwd=venv.project or self.home,
+            projfolder=venv.project,
+            boundary="",
+            venv_name=venv.name,
+            venv_path=venv.path,
+            venv_exists=os.path.exists(venv.path),
+            pythonbuild=venv.build,
+            pyversionspath=pyversionspath,
+            use_framework_build=venv.framework,
+            current_venv_path="",
+        )
+
+    def use_resolution(self, r):
+        """Makes everything that works from the current resolution
+        (venv_path, python_path, template_path, ...) work from r instead.
+        """
+        self._resolution = r
+        self._resolved_ns = None
+
+    def create(self, job=False):
+        """Creates the venv for the current project, if it's missing.
+        With job=True, does so as a background job (see background.py).
+        """
+        r = self.resolution
+        if not r.venv_name:
+            print(RECREATE_ERROR)
+            return 1
+
+        if job:
+            from .background import run
+
+            status = run(self)
+        elif not r.venv_exists:
+            status = 0 if self.make_virtualenv(r.venv_name) else 1
+            if status == 0:
+                self.clear_failed_job(r)
+        else:
+            return
+
+        if status == 0 and self.setting("gc_auto"):
+            from .garbage import auto_collect
+
+            auto_collect(self)
+        return status
+
+    def clear_failed_job(self, r):
+        """Forgets a background job for r's venv that failed (or died), now
+        that the venv has been made some other way; otherwise the hook and
+        info would go on reporting it.
+        """
+        from .background import Job, RUNNING
+
+        job = Job.for_venv(self, r.venv_path)
+        if job.state() not in (None, RUNNING):
+            job.clear_status()
+
+    def store_venv(self, path):
+        """If package_store is on, moves the venv's files into the shared
+        store (see store.py).
+        """
+        if not self.setting("package_store"):
+            return
+
+        from .store import StoreError, dedupe_venv, store_path
+
+        try:
+            stats = dedupe_venv(store_path(self.data_dir), path)
+        except (StoreError, OSError) as e:
+            print("AUTOVENV: couldn't use the package store ({})".format(e))
+            return
+        print("AUTOVENV: package store: {}".format(stats.summary()))
 
     def delete_virtualenv(self, name):
-        path = self.venv_path(name)
+        self.delete_venv_at(self.venv_path(name))
+
+    def delete_venv_at(self, path):
+        import shutil
+
         print("DELETING VIRTUALENV:", path)
         try:
             shutil.rmtree(path)
         except FileNotFoundError:
             pass
+        self.record_event("delete", path)
 
     @property
     def venv_active(self):
-        return not not self.current_venv_path
+        return self.resolution.venv_active
 
     @property
     def correct_venv_active(self):
-        return self.current_venv_path == self.correct_venv_path
+        return self.resolution.correct_venv_active
 
     @property
     def pythonbuilds_current(self):
@@ -316,11 +913,7 @@ class VirtualEnvs(object):
 
     @property
     def pythonversion_file_path(self):
-        projfolder = self.likely_projfolder
-        if projfolder:
-            return os.path.join(projfolder, ".python-version")
-        else:
-            return ""
+        return self.resolution.pythonversion_file_path
 
     @property
     def current_pythonbuild_name(self):
@@ -332,32 +925,11 @@ class VirtualEnvs(object):
         If neither of these two conditions apply, this will
         return None, and so the system python will be used.
         """
-        
-        if os.path.exists(self.pythonversion_file_path):
-            with io.open(self.pythonversion_file_path) as f:
-                version_string = f.read().splitlines()[0].strip()
-                if version_string:
-                    return version_string
-
-        for k, v in self.config["override"].items():
-            if self.cwd_pathlib.name.startswith(k):
-                pyversion = v["pyversion"]
-                if pyversion:
-                    return pyversion
-
-        if os.path.exists(self.pythonbuilds_current):
-            realpath = os.path.realpath(self.pythonbuilds_current)
-            return os.path.split(realpath)[1]
+        return self.resolution.pythonbuild
 
     @property
     def should_use_framework_build(self):
-        if os.path.exists(self.pythonversion_file_path):
-            with io.open(self.pythonversion_file_path) as f:
-                contents = f.read().strip().splitlines()
-                if "use_framework_build" in contents:
-                    return True
-
-        return False
+        return self.resolution.use_framework_build
 
     @property
     def suggested_bash_command(self):
@@ -367,45 +939,60 @@ class VirtualEnvs(object):
     def suggested_fish_command(self):
         return self.suggested_command(shell="fish")
 
-    def suggested_command(self, shell="bash"):
+    @traced("suggest")
+    def suggested_command(self, shell="bash", hook=False):
         """Generates the correct bash command to make sure that the
         appropriate virtualenv is activated for the project folder
         you're in (or to deactivate if you're not in a project folder).
+
+        hook says the shell is going to run the command (as from the shell
+        hooks), so the activation goes in the inventory, and in
+        background_create mode a job is started for a missing venv.
+        Otherwise (eg. for "autovenv info") nothing is recorded or started.
         """
-        wanted = self.correct_venv_name
+        r = self.resolution
+        wanted = r.venv_name
 
         if wanted:
             command = ""
 
-            if not os.path.exists(self.correct_venv_path):
+            if self.setting("background_create"):
+                building = self.background_command(r, launch=hook)
+                if building is not None:
+                    if r.boundary:
+                        building = self.boundary_command(r, shell) + building
+                    return "eval " + building if shell == "bash" else building
+
+            if not r.venv_exists:
                 s = "echo 'AUTOVENV: creating virtual environment: {}{}'; "
 
-                if self.current_pythonbuild_name:
+                if r.pythonbuild:
                     version_info = " (using non-system python version {})".format(
-                        self.current_pythonbuild_name
+                        r.pythonbuild
                     )
                 else:
                     version_info = ""
 
                 command += s.format(wanted, version_info)
 
-                s = "{} --upgrade-deps {}; "
-                
-                command += s.format(
-                    self.virtualenv_creation_prefix, shquote(self.correct_venv_path)
-                )
-
-            if not self.correct_venv_active:
-                if shell == "fish":
-                    extension = ".fish"
+                if self.setting("clone_template"):
+                    command += "autovenv create; "
                 else:
-                    extension = ""
+                    command += "{}; ".format(self.venv_creation_command(r.venv_path))
 
-                path = "{0}{1}".format(
-                    self.activate_path(self.correct_venv_name), extension
-                )
+            if self.setting("sync_requirements"):
+                command += self.sync_command(r)
+
+            if not r.correct_venv_active:
+                if r.venv_exists and self.setting("check_on_activate"):
+                    command += self.check_command(r)
+                command += self.activate_command(r, shell)
+                if hook:
+                    self.record_event("activate", r.venv_path)
 
-                command += "source {0}".format(shquote(path))
+            if r.boundary:
+                command = self.boundary_command(r, shell) + command
+            command = command.rstrip("; ")
 
             if command:
                 if shell == "bash":
@@ -414,58 +1001,252 @@ class VirtualEnvs(object):
             return command
 
         elif self.current_venv_name:
-            command = "echo 'AUTOVENV: deactivating...' ; deactivate"
+            command = "echo 'AUTOVENV: deactivating...' ; "
+            if self.setting("activation") == "source":
+                command += "deactivate"
+            else:
+                from .activation import deactivate_command
+
+                command += deactivate_command(shell)
 
-            command = "eval " + command
+            if shell == "bash":
+                command = "eval " + command
             return command
         return ""
 
+    def check_command(self, r):
+        """Returns a command warning that the venv looks broken, if it
+        does, otherwise "".
+        """
+        from .health import problem
+
+        with phase("check"):
+            reason = problem(r.venv_path)
+        if reason is None:
+            return ""
+        message = "AUTOVENV: {} looks broken, {} (autovenv check --fix recreates it)"
+        return "echo {}; ".format(shquote(message.format(r.venv_name, reason)))
+
+    def activate_command(self, r, shell="bash"):
+        """Returns a command to activate the resolved venv, switching to
+        it directly from any venv that's active already.
+        """
+        if self.setting("activation") == "source":
+            if shell == "fish":
+                extension = ".fish"
+            else:
+                extension = ""
+
+            path = "{0}{1}".format(os.path.join(r.venv_path, "bin/activate"), extension)
+            return "source {0}".format(shquote(path))
+
+        from .activation import activate_command
+
+        return activate_command(shell, r.venv_path, switching=r.venv_active)
+
+    def background_command(self, r, launch=True):
+        """In background_create mode: starts a job to create the venv if
+        it's missing (unless launch is false), and returns a command that
+        just reports progress while a job is under way. Returns None once
+        the venv is ready.
+        """
+        from .background import Job, start, RUNNING, FAILED
+
+        job = Job.for_venv(self, r.venv_path)
+        state = job.state()
+
+        if r.venv_exists and state != RUNNING:
+            return None
+
+        if state == RUNNING:
+            s = "echo 'AUTOVENV: still creating {} in the background (see {})'"
+        elif state == FAILED:
+            s = (
+                "echo 'AUTOVENV: creating {} in the background failed (see {}),"
+                " run autovenv create to try again'"
+            )
+        else:
+            if launch:
+                job = start(self, r)
+            s = "echo 'AUTOVENV: creating {} in the background (see {})'"
+
+        return s.format(r.venv_name, job.log_path)
+
+    def sync_command(self, r):
+        """Returns a command to sync the venv with the project's
+        requirement files if they've changed since it was last synced
+        (or it's about to be created), otherwise "".
+        """
+        from .sync import current_files, is_stale
+
+        files = current_files(r.projfolder, self.config.get("file_names"))
+        if r.venv_exists and not is_stale(r.venv_path, files):
+            return ""
+        return "echo 'AUTOVENV: syncing requirements'; autovenv sync; "
+
+    def boundary_command(self, r, shell="bash"):
+        """Records the project boundary and the venv that goes with it in
+        shell variables, for the hooks' short-circuit check.
+
+        Along with them goes a stamp file, dated from when r was worked
+        out, and the inputs that could change the answer within the
+        boundary (the .python-version file, the config file, and the
+        builds folder, where "autovenv choose" moves the current link).
+        The hooks only skip asking while the stamp is newer than all of
+        them. Returns "" (so the hooks always ask) if there's no stamp.
+        """
+        if self._resolved_ns is None or r is not self._resolution:
+            return ""
+        stamp = stamp_path(self.data_dir, r.boundary, r.venv_path)
+        if not write_stamp(stamp, self._resolved_ns):
+            return ""
+
+        values = (
+            ("AUTOVENV_ROOT", r.boundary),
+            ("AUTOVENV_VENV", r.venv_path),
+            ("AUTOVENV_STAMP", stamp),
+            ("AUTOVENV_CONFIG", self.configpath),
+            ("AUTOVENV_PYVERSIONS", r.pyversionspath),
+        )
+        if shell == "fish":
+            s = "set -g {} {}; "
+        else:
+            s = "{}={}; "
+        return "".join(s.format(name, shquote(value)) for name, value in values)
+
     def recreate(self):
-        if self.venv_active:
-            self.delete_virtualenv(self.correct_venv_name)
-            self.make_virtualenv(self.correct_venv_name)
+        r = self.resolution
+        if r.venv_active:
+            self.delete_virtualenv(r.venv_name)
+            self.make_virtualenv(r.venv_name)
         else:
             print(RECREATE_ERROR)
 
+    def recreate_all(self, jobs=None):
+        from .bulk import recreate_all
+
+        return recreate_all(self, jobs=jobs)
+
+    def gc(self, dry_run=False, max_age_days=None, budget=None):
+        from .garbage import gc
+
+        return gc(self, dry_run=dry_run, max_age_days=max_age_days, budget=budget)
+
+    def sync(self):
+        from .sync import sync_current
+
+        return sync_current(self)
+
+    def dedupe(self, paths=None):
+        from .store import dedupe
+
+        return dedupe(self, paths)
+
+    def list_venvs(self, as_json=False, rescan=False):
+        from .inventory import list_venvs
+
+        list_venvs(self, as_json=as_json, rescan_first=rescan)
+
+    def rescan_inventory(self):
+        from .inventory import rescan
+
+        rescan(self)
+
+    def resolve_paths(self, paths=None):
+        from .api import resolve_paths
+
+        resolve_paths(self, paths)
+
+    def check(self, fix=False, jobs=None):
+        from .health import check
+
+        return check(self, fix=fix, jobs=jobs)
+
+    def scan(self, root, jobs=None, dry_run=False):
+        from .bulk import scan
+
+        return scan(self, root, jobs=jobs, dry_run=dry_run)
+
+    def info(self):
+        r = self.resolution
+
+        if r.current_venv_path:
+            print("Using this virtualenv: {}".format(r.current_venv_path))
+        else:
+            print("Using system environment")
+        if self.current_venv_python_path:
+            p = self.current_venv_python_path
+            print("Using this python: {}".format(p))
+            print("...which is really at: {}".format(os.path.realpath(p)))
+        else:
+            print("Using system python")
+
+        print("Config and data stored in: {}".format(self.data_dir))
+
+        print("Using framework build?: {}".format(r.use_framework_build))
+
+        pypath = self.pythonversion_path
+
+        print("Looking for a python version at: {}".format(pypath))
+        print("Exists?: {}".format(bool(pypath) and os.path.exists(pypath)))
+        print("Current config:")
+        print(self.config)
+
+        print("Suggested command: {}".format(self.suggested_command()))
+
+        from .background import jobs
+
+        for job, status, state in jobs(self.data_dir):
+            print(
+                "Background build of {}: {} (log: {})".format(
+                    status.get("venv"), state, job.log_path
+                )
+            )
+
     @property
     def build_defs_path(self):
-        return resource_filename(__name__, "python-build/share/python-build")
+        return os.path.join(PACKAGE_DIR, "python-build", "share", "python-build")
+
+    @property
+    def build_cache_path(self):
+        return os.path.join(self.data_dir, "build-cache")
 
     def do_command(self, args):
         if args.bash:
-            print(self.suggested_bash_command)
+            print(self.suggested_command(shell="bash", hook=True))
         elif args.fish:
-            print(self.suggested_fish_command)
+            print(self.suggested_command(shell="fish", hook=True))
         elif args.recreate:
+            if args.all:
+                return self.recreate_all(jobs=args.jobs)
             self.recreate()
+        elif args.seed:
+            return self.seed()
+        elif args.create:
+            return self.create(job=args.job)
+        elif args.sync:
+            return self.sync()
+        elif args.dedupe:
+            return self.dedupe(args.venvs)
+        elif args.gc:
+            return self.gc(
+                dry_run=args.dry_run, max_age_days=args.max_age_days, budget=args.budget
+            )
+        elif args.list:
+            self.list_venvs(as_json=args.json, rescan=args.rescan)
+        elif args.check:
+            return self.check(fix=args.fix, jobs=args.jobs)
+        elif args.scan:
+            return self.scan(args.root, jobs=args.jobs, dry_run=args.dry_run)
+        elif args.resolve:
+            self.resolve_paths(args.paths or None)
         elif args.info:
-            if self.current_venv_path:
-                print("Using this virtualenv: {}".format(self.current_venv_path))
-            else:
-                print("Using system environment")
-            if self.current_venv_python_path:
-                p = self.current_venv_python_path
-                print("Using this python: {}".format(p))
-                print("...which is really at: {}".format(os.path.realpath(p)))
-            else:
-                print("Using system python")
-
-            print("Config and data stored in: {}".format(self.data_dir))
-
-            fb = self.should_use_framework_build
-            print("Using framework build?: {}".format(fb))
-
-            pypath = self.pythonversion_path
-
-            print("Looking for a python version at: {}".format(pypath))
-            print("Exists?: {}".format(os.path.exists(pypath)))
-            print("Current config:")
-            print(self.config)
-
-            print("Suggested command: {}".format(self.suggested_command()))
+            self.info()
 
         elif args.builddefspath:
             print(self.build_defs_path)
+        elif args.buildcachepath:
+            print(self.build_cache_path)
         elif args.pyversionspath:
             print(self.pyversionspath)
         elif args.pyversionspath_framework:
@@ -0,0 +1,113 @@
+"""
+A local wheelhouse of pip/setuptools/wheel, so that new venvs can be
+seeded without going anywhere near an index.
+
+One wheelhouse is kept per python build (named "system" for the python
+autovenv itself runs on), since newer pips drop support for older pythons.
+It's only ever refreshed explicitly, via "autovenv seed".
+"""
+
+import os
+import sys
+
+from .util import mkdir_p, shquote
+
+SEED_PACKAGES = ("pip", "setuptools", "wheel")
+
+SYSTEM = "system"
+
+
+def wheelhouse_path(data_dir, build):
+    return os.path.join(data_dir, "wheelhouse", build or SYSTEM)
+
+
+def find_wheels(wheelhouse):
+    """Returns {package name: wheel path} for the seed packages present."""
+    try:
+        filenames = sorted(os.listdir(wheelhouse))
+    except OSError:
+        return {}
+
+    wheels = {}
+    for filename in filenames:
+        if not filename.endswith(".whl"):
+            continue
+        name = filename.split("-", 1)[0].lower()
+        if name in SEED_PACKAGES:
+            wheels[name] = os.path.join(wheelhouse, filename)
+    return wheels
+
+
+def creation_command(python, venv_path, wheelhouse):
+    """The shell command that creates a venv at venv_path.
+
+    With a seeded wheelhouse, the venv is created without pip, and then
+    pip (run straight from its wheel) installs the seed packages from the
+    wheelhouse with no index access. Without one, the stdlib venv's
+    bundled pip is used, which is also offline, just older.
+    """
+    wheels = find_wheels(wheelhouse)
+
+    if "pip" not in wheels:
+        return "{} -m venv {}".format(shquote(python), shquote(venv_path))
+
+    venv_python = os.path.join(venv_path, "bin", "python")
+    packages = [name for name in SEED_PACKAGES if name in wheels]
+
+    return (
+        "{python} -m venv --without-pip {venv} && "
+        "{venv_python} {pip}/pip install --quiet --disable-pip-version-check "
+        "--no-index --find-links {wheelhouse} {packages}"
+    ).format(
+        python=shquote(python),
+        venv=shquote(venv_path),
+        venv_python=shquote(venv_python),
+        pip=shquote(wheels["pip"]),
+        wheelhouse=shquote(wheelhouse),
+        packages=" ".join(packages),
+    )
+
+
+def refresh(python, wheelhouse):
+    """Downloads the latest seed wheels (and their dependencies) for the
+    given python, replacing whatever was in the wheelhouse only once the
+    download succeeds. Returns the subprocess return code.
+    """
+    import shutil
+    import subprocess
+    import tempfile
+
+    mkdir_p(os.path.dirname(wheelhouse))
+    staging = tempfile.mkdtemp(prefix=".seed-", dir=os.path.dirname(wheelhouse))
+
+    try:
+        cmd = [
+            python,
+            "-m",
+            "pip",
+            "download",
+            "--disable-pip-version-check",
+            "--only-binary=:all:",
+            "--dest",
+            staging,
+        ]
+        cmd += SEED_PACKAGES
+
+        print("AUTOVENV: refreshing seed wheels in {}".format(wheelhouse))
+        sys.stdout.flush()
+        status = subprocess.call(cmd)
+
+        if status != 0 or "pip" not in find_wheels(staging):
+            print("AUTOVENV: ERROR (couldn't download seed wheels)")
+            return status or 1
+
+        if os.path.isdir(wheelhouse):
+            shutil.rmtree(wheelhouse)
+        os.rename(staging, wheelhouse)
+    finally:
+        if os.path.isdir(staging):
+            shutil.rmtree(staging)
+
+    for path in sorted(find_wheels(wheelhouse).values()):
+        print("  {}".format(os.path.basename(path)))
+    return 0
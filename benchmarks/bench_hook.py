@@ -0,0 +1,360 @@
+#!/usr/bin/env python
+"""
+Latency and scaling benchmarks for the shell-hook path.
+
+Builds synthetic home directories (varying directory depth, number of
+overrides in the config, and number of existing venvs), then measures:
+
+  - VirtualEnvs(...).suggested_command() in-process, warm and (where the
+    page cache can be dropped, ie. as root on linux) cold
+  - "python -m autovenv bash" end to end
+  - filesystem calls (stat, lstat, open, listdir, scandir) per resolution
+  - import time of "python -m autovenv bash"
+
+and compares against benchmarks/baselines.json. Filesystem call counts are
+deterministic, so any increase is a regression; timings are only flagged
+when they exceed the baseline by more than --tolerance, and are only
+meaningful against baselines recorded on the same machine.
+
+    python benchmarks/bench_hook.py            # quick grid, compare
+    python benchmarks/bench_hook.py --full     # everything
+    python benchmarks/bench_hook.py --save     # record new baselines
+"""
+
+import os
+import io
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import collections
+import subprocess
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, ROOT)
+
+from autovenv.virtualenvs import VirtualEnvs  # noqa: E402
+
+BASELINES = os.path.join(HERE, "baselines.json")
+
+QUICK = dict(depth=[1, 10, 50], overrides=[0, 5000], venvs=[0, 2000])
+FULL = dict(depth=[1, 5, 10, 25, 50], overrides=[0, 500, 5000], venvs=[0, 200, 2000])
+
+COUNTED = ("stat", "lstat", "open", "listdir", "scandir")
+
+
+def scenario_name(depth, overrides, venvs, strategy="outermost"):
+    name = "depth={}/overrides={}/venvs={}".format(depth, overrides, venvs)
+    if strategy != "outermost":
+        name += "/strategy={}".format(strategy)
+    return name
+
+
+def build_tree(base, depth, overrides, venvs, strategy="outermost"):
+    """Creates home/proj/d1/.../d<depth-1> with a requirements.txt at
+    home/proj (and a .git there, for the vcs strategy), so resolution has
+    to walk every level back up to home, or with the nearest or vcs
+    strategies, to home/proj. Returns (home, deepest directory).
+    """
+    home = os.path.join(base, "home")
+    projfolder = os.path.join(home, "proj")
+    deepest = os.path.join(projfolder, *["d{}".format(i) for i in range(1, depth)])
+    os.makedirs(deepest)
+    io.open(os.path.join(projfolder, "requirements.txt"), "w").close()
+    os.mkdir(os.path.join(projfolder, ".git"))
+
+    data_dir = os.path.join(home, ".autovenv")
+    os.makedirs(data_dir)
+
+    if overrides or strategy != "outermost":
+        with io.open(os.path.join(data_dir, "config"), "w") as f:
+            f.write("file_names:\n- requirements.txt\n- pyproject.toml\n")
+            f.write("project_root_strategy: {}\n".format(strategy))
+            f.write("override:\n")
+            for i in range(overrides):
+                f.write(
+                    "  ~/other/group{}/project{}: 3.{}/venv{}\n".format(
+                        i % 50, i, i % 12, i
+                    )
+                )
+
+    venvspath = os.path.join(data_dir, "venvs")
+    for i in range(venvs):
+        venv = os.path.join(venvspath, "venv{}".format(i))
+        os.makedirs(os.path.join(venv, "bin"))
+        io.open(os.path.join(venv, "pyvenv.cfg"), "w").close()
+
+    age_tree(base)
+    return home, deepest
+
+
+def age_tree(base):
+    """Backdates everything under base, as for a project that's been
+    around a while: files changed in the last couple of seconds are
+    never put in the resolution cache.
+    """
+    hour_ago = time.time() - 3600
+    for dirpath, dirnames, filenames in os.walk(base):
+        for name in dirnames + filenames:
+            os.utime(os.path.join(dirpath, name), (hour_ago, hour_ago))
+    os.utime(base, (hour_ago, hour_ago))
+
+
+def drop_caches():
+    try:
+        os.sync()
+        with io.open("/proc/sys/vm/drop_caches", "w") as f:
+            f.write("3\n")
+        return True
+    except (OSError, AttributeError):
+        return False
+
+
+def percentiles(samples):
+    ordered = sorted(samples)
+
+    def pick(p):
+        index = min(len(ordered) - 1, int(round(p / 100.0 * (len(ordered) - 1))))
+        return ordered[index] * 1000.0
+
+    return dict(p50_ms=round(pick(50), 3), p99_ms=round(pick(99), 3))
+
+
+def resolve_once(home, cwd):
+    v = VirtualEnvs(
+        data_dir=os.path.join(home, ".autovenv"), home=home, cwd=cwd, virtual_env=""
+    )
+    return v.suggested_command(shell="bash", hook=True)
+
+
+def time_in_process(home, cwd, iterations, cold=False):
+    samples = []
+    for _ in range(iterations):
+        if cold and not drop_caches():
+            return None
+        start = time.perf_counter()
+        resolve_once(home, cwd)
+        samples.append(time.perf_counter() - start)
+    return percentiles(samples)
+
+
+def count_calls(home, cwd):
+    counts = collections.Counter()
+    originals = {}
+
+    def wrap(module, name):
+        original = getattr(module, name)
+        originals[(module, name)] = original
+
+        def counted(*args, **kwargs):
+            counts[name] += 1
+            return original(*args, **kwargs)
+
+        setattr(module, name, counted)
+
+    for name in COUNTED:
+        if name == "open":
+            wrap(io, name)
+        else:
+            wrap(os, name)
+    try:
+        resolve_once(home, cwd)
+    finally:
+        for (module, name), original in originals.items():
+            setattr(module, name, original)
+
+    counts = {name: counts[name] for name in COUNTED}
+    counts["total"] = sum(counts.values())
+    return counts
+
+
+def hook_env(home):
+    env = dict(os.environ, HOME=home, PYTHONPATH=ROOT)
+    for name in ("VIRTUAL_ENV", "AUTOVENV_TRACE"):
+        env.pop(name, None)
+    return env
+
+
+def time_cli(home, cwd, iterations):
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable, "-m", "autovenv", "bash"],
+            cwd=cwd,
+            env=hook_env(home),
+            stdout=subprocess.DEVNULL,
+            check=True,
+        )
+        samples.append(time.perf_counter() - start)
+    return percentiles(samples)
+
+
+def import_time_us(home, cwd):
+    """Total import time (microseconds) of everything "python -m autovenv
+    bash" imports from the autovenv package onwards.
+    """
+    out = subprocess.run(
+        [sys.executable, "-X", "importtime", "-m", "autovenv", "bash"],
+        cwd=cwd,
+        env=hook_env(home),
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        check=True,
+    )
+
+    total = 0
+    ours = False
+    for line in out.stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        if name.startswith("  "):
+            continue
+        if name.strip() == "autovenv":
+            ours = True
+        if ours:
+            total += int(cumulative)
+    return total
+
+
+def run_scenario(depth, overrides, venvs, args):
+    base = tempfile.mkdtemp(prefix="autovenv-bench-")
+    try:
+        home, deepest = build_tree(base, depth, overrides, venvs, args.strategy)
+
+        # the first run compiles the config cache and caches the
+        # resolution; everything after is warm
+        resolve_once(home, deepest)
+
+        return dict(
+            warm=time_in_process(home, deepest, args.iterations),
+            cold=time_in_process(home, deepest, args.cold_iterations, cold=True),
+            cli=time_cli(home, deepest, args.cli_iterations),
+            calls=count_calls(home, deepest),
+            import_us=import_time_us(home, deepest),
+        )
+    finally:
+        shutil.rmtree(base)
+
+
+def compare(name, result, baseline, tolerance):
+    problems = []
+
+    for kind, count in result["calls"].items():
+        expected = baseline.get("calls", {}).get(kind)
+        if expected is not None and count > expected:
+            problems.append("{} {} calls: {} > {}".format(name, kind, count, expected))
+
+    for section in ("warm", "cli"):
+        got = (result.get(section) or {}).get("p50_ms")
+        expected = (baseline.get(section) or {}).get("p50_ms")
+        if got is not None and expected and got > expected * tolerance:
+            problems.append(
+                "{} {} p50: {}ms > {}ms x {}".format(
+                    name, section, got, expected, tolerance
+                )
+            )
+
+    got, expected = result.get("import_us"), baseline.get("import_us")
+    if got and expected and got > expected * tolerance:
+        problems.append(
+            "{} import time: {}us > {}us x {}".format(name, got, expected, tolerance)
+        )
+    return problems
+
+
+def fmt(timing):
+    if not timing:
+        return "-"
+    return "{p50_ms:.2f}/{p99_ms:.2f}".format(**timing)
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--full", action="store_true", help="run the full grid")
+    parser.add_argument(
+        "--save", action="store_true", help="record results as the new baselines"
+    )
+    parser.add_argument("--json", help="also write results to this file")
+    parser.add_argument(
+        "--strategy",
+        default="outermost",
+        choices=("outermost", "nearest", "vcs"),
+        help="the project_root_strategy setting to benchmark",
+    )
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--cold-iterations", type=int, default=5)
+    parser.add_argument("--cli-iterations", type=int, default=20)
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=2.0,
+        help="how many times slower than baseline counts as a regression",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv if argv is not None else sys.argv[1:])
+    grid = FULL if args.full else QUICK
+
+    try:
+        with io.open(BASELINES) as f:
+            baselines = json.load(f)
+    except IOError:
+        baselines = {}
+
+    results = collections.OrderedDict()
+    problems = []
+
+    print(
+        "{:55} {:>15} {:>15} {:>15} {:>7} {:>9}".format(
+            "scenario", "warm p50/p99", "cold p50/p99", "cli p50/p99", "calls", "import"
+        )
+    )
+
+    for depth in grid["depth"]:
+        for overrides in grid["overrides"]:
+            for venvs in grid["venvs"]:
+                name = scenario_name(depth, overrides, venvs, args.strategy)
+                result = run_scenario(depth, overrides, venvs, args)
+                results[name] = result
+
+                print(
+                    "{:55} {:>15} {:>15} {:>15} {:>7} {:>7}us".format(
+                        name,
+                        fmt(result["warm"]),
+                        fmt(result["cold"]),
+                        fmt(result["cli"]),
+                        result["calls"]["total"],
+                        result["import_us"],
+                    )
+                )
+
+                if name in baselines:
+                    problems += compare(name, result, baselines[name], args.tolerance)
+
+    if args.json:
+        with io.open(args.json, "w") as f:
+            json.dump(results, f, indent=4, sort_keys=True)
+
+    if args.save:
+        baselines.update(results)
+        with io.open(BASELINES, "w") as f:
+            json.dump(baselines, f, indent=4, sort_keys=True)
+            f.write("\n")
+        print("Saved baselines to {}".format(BASELINES))
+        return 0
+
+    for problem in problems:
+        print("REGRESSION: {}".format(problem))
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
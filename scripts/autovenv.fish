@@ -1,7 +1,66 @@
 #!/usr/bin/env fish
 
+# Somewhere only we can create files, since we run whatever the socket
+# answers (see daemon.socket_path, which has to agree).
+if test -n "$AUTOVENV_SOCKET"
+    set -g __autovenv_socket $AUTOVENV_SOCKET
+else if test -n "$XDG_RUNTIME_DIR"
+    set -g __autovenv_socket $XDG_RUNTIME_DIR/autovenv-(id -u).sock
+else
+    set -g __autovenv_socket $HOME/.autovenv/autovenv.sock
+end
+
+# Asks a running "autovenv serve" for the command, printing it on success.
+# Fails (so the caller can fall back to "autovenv fish") if there's no
+# daemon, no client to talk to it with, or it didn't answer properly
+# within a couple of seconds (a wedged daemon mustn't hang every cd).
+function __autovenv_query
+    test -S $__autovenv_socket; and test -O $__autovenv_socket; or return 1
+
+    set -l request (printf 'fish\t%s\t%s' "$PWD" "$VIRTUAL_ENV")
+    set -l reply
+
+    if command -sq socat
+        set reply (printf '%s\n' $request | socat -t 2 -T 2 - UNIX-CONNECT:$__autovenv_socket 2>/dev/null); or return 1
+    else if command -sq nc
+        set reply (printf '%s\n' $request | nc -w 2 -U $__autovenv_socket 2>/dev/null); or return 1
+    else
+        return 1
+    end
+
+    string match -q 'ok:*' -- "$reply"; or return 1
+    string sub -s 4 -- "$reply"
+end
+
+# True while we're still inside the project we last resolved, with its venv
+# active, and nothing the answer came from (.python-version, the config,
+# the builds folder) has changed since, in which case there's no need to
+# ask again. fish's own test has no -nt, hence "command test".
+function __autovenv_in_root
+    test -n "$AUTOVENV_ROOT"; or return 1
+    test "$VIRTUAL_ENV" = "$AUTOVENV_VENV"; or return 1
+    set -l prefix "$AUTOVENV_ROOT/"
+    set -l head (string sub -l (string length -- "$prefix") -- "$PWD/")
+    test "$head" = "$prefix"; or return 1
+    command test "$AUTOVENV_STAMP" -nt "$AUTOVENV_ROOT/.python-version" \
+        -a "$AUTOVENV_STAMP" -nt "$AUTOVENV_CONFIG" \
+        -a "$AUTOVENV_STAMP" -nt "$AUTOVENV_PYVERSIONS"
+end
+
 function do_autovenv
-    eval (autovenv fish)
+    __autovenv_in_root; and return
+    set -e AUTOVENV_ROOT
+    set -e AUTOVENV_VENV
+    set -e AUTOVENV_STAMP
+    set -e AUTOVENV_CONFIG
+    set -e AUTOVENV_PYVERSIONS
+
+    set -l suggested (__autovenv_query)
+    if test $status -eq 0
+        eval $suggested
+    else
+        eval (autovenv fish)
+    end
 end
 
 function cd
@@ -1,7 +1,65 @@
 #!/usr/bin/env bash
 
+# Somewhere only we can create files, since we run whatever the socket
+# answers (see daemon.socket_path, which has to agree).
+if [ -n "${AUTOVENV_SOCKET-}" ]; then
+    _autovenv_socket=$AUTOVENV_SOCKET
+elif [ -n "${XDG_RUNTIME_DIR-}" ]; then
+    _autovenv_socket="$XDG_RUNTIME_DIR/autovenv-${UID}.sock"
+else
+    _autovenv_socket="$HOME/.autovenv/autovenv.sock"
+fi
+
+# Asks a running "autovenv serve" for the command, printing it on success.
+# Fails (so the caller can fall back to "autovenv bash") if there's no
+# daemon, no client to talk to it with, or it didn't answer properly
+# within a couple of seconds (a wedged daemon mustn't hang every cd).
+_autovenv_query() {
+    [ -S "$_autovenv_socket" ] && [ -O "$_autovenv_socket" ] || return 1
+
+    local request reply
+    request=$(printf 'bash\t%s\t%s' "$PWD" "${VIRTUAL_ENV-}")
+
+    if command -v socat >/dev/null 2>&1; then
+        reply=$(printf '%s\n' "$request" | socat -t 2 -T 2 - "UNIX-CONNECT:$_autovenv_socket" 2>/dev/null) || return 1
+    elif command -v nc >/dev/null 2>&1; then
+        reply=$(printf '%s\n' "$request" | nc -w 2 -U "$_autovenv_socket" 2>/dev/null) || return 1
+    else
+        return 1
+    fi
+
+    case "$reply" in
+        ok:*) printf '%s' "${reply#ok:}" ;;
+        *) return 1 ;;
+    esac
+}
+
+# True while we're still inside the project we last resolved, with its venv
+# active, and nothing the answer came from (.python-version, the config,
+# the builds folder) has changed since, in which case there's no need to
+# ask again.
+_autovenv_in_root() {
+    [ -n "${AUTOVENV_ROOT-}" ] || return 1
+    [ "${VIRTUAL_ENV-}" = "${AUTOVENV_VENV-}" ] || return 1
+    case "$PWD/" in
+        "$AUTOVENV_ROOT"/*) ;;
+        *) return 1 ;;
+    esac
+    [ "$AUTOVENV_STAMP" -nt "$AUTOVENV_ROOT/.python-version" ] &&
+        [ "$AUTOVENV_STAMP" -nt "$AUTOVENV_CONFIG" ] &&
+        [ "$AUTOVENV_STAMP" -nt "$AUTOVENV_PYVERSIONS" ]
+}
+
 do_autovenv() {
-    $(autovenv bash)
+    _autovenv_in_root && return
+    unset AUTOVENV_ROOT AUTOVENV_VENV AUTOVENV_STAMP AUTOVENV_CONFIG AUTOVENV_PYVERSIONS
+
+    local suggested
+    if suggested=$(_autovenv_query); then
+        $suggested
+    else
+        $(autovenv bash)
+    fi
 }
 
 cd() {
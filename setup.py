@@ -12,7 +12,7 @@ setup(
     long_description="Virtual environments are great, but they can be a bit annoying to create, manage, and switch between. It gets even worse when multiple different python versions come into play. autovenv takes the annoyance away.\n\nFull documentation is at https://autovenv.readthedocs.org",
     author="Robert Lechte",
     author_email="robertlechte@gmail.com",
-    install_requires=["virtualenv", "appdirs", "pyyaml"],
+    install_requires=["virtualenv", "pyyaml"],
     packages=find_packages(),
     classifiers=["Development Status :: 3 - Alpha"],
     scripts=[
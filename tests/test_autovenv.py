@@ -1,8 +1,12 @@
+import io
 import os
 import sys
+import time
 
 import autovenv
 from autovenv import get_likely_projfolder as pf, file_exists, DEFAULT_CONFIG
+from autovenv.activation import activate_command
+from autovenv.resolution import stamp_path
 
 from pathlib import Path
 
@@ -88,20 +92,1530 @@ def test_autovenv(monkeypatch, tmpdir):
 
     venv_loc = str(VENVS_HOME / v.correct_venv_name)
 
-    C1 = "eval echo 'AUTOVENV: creating virtual environment: c'; "
-    C2 = "virtualenv -p {executable} {venv}; source {venv}/bin/activate"
-    EXPECTED = C1 + C2
+    C0 = (
+        "eval AUTOVENV_ROOT={projfolder}; AUTOVENV_VENV={venv}; "
+        "AUTOVENV_STAMP={stamp}; AUTOVENV_CONFIG={config}; "
+        "AUTOVENV_PYVERSIONS={pyversions}; "
+    )
+    C1 = "echo 'AUTOVENV: creating virtual environment: c'; "
+    C2 = "autovenv create; {activate}"
+    EXPECTED = C0 + C1 + C2
+
+    assert v.suggested_bash_command == EXPECTED.format(
+        venv=venv_loc,
+        executable=sys.executable,
+        projfolder=PROJFOLDER,
+        stamp=stamp_path(v.data_dir, str(PROJFOLDER), venv_loc),
+        config=v.configpath,
+        pyversions=v.pyversionspath,
+        activate=activate_command("bash", venv_loc, switching=False),
+    )
 
+    v.save_config(dict(CONFIG, activation="source"))
     assert v.suggested_bash_command == EXPECTED.format(
-        venv=venv_loc, executable=sys.executable
+        venv=venv_loc,
+        executable=sys.executable,
+        projfolder=PROJFOLDER,
+        stamp=stamp_path(v.data_dir, str(PROJFOLDER), venv_loc),
+        config=v.configpath,
+        pyversions=v.pyversionspath,
+        activate="source {}/bin/activate".format(venv_loc),
     )
+    v.save_config(CONFIG)
 
     # test with python-build functionality
 
     # assert v.pythonbuilds_current == str(PYTHONBUILDS_CURRENT)
-    assert v.virtualenv_creation_prefix == "virtualenv -p {}".format(sys.executable)
+    assert v.virtualenv_creation_prefix == "{} -m venv".format(sys.executable)
 
     assert v.current_pythonbuild_name is None
     os.symlink(str(PYTHONBUILDS_VERSION), str(PYTHONBUILDS_CURRENT))
 
     assert os.path.exists(str(PYTHONBUILDS_CURRENT))
+
+
+def test_daemon(monkeypatch, tmpdir):
+    import socket
+    import threading
+    from autovenv import daemon
+
+    tmpdir = Path(str(tmpdir))
+    HOME = tmpdir / "home"
+
+    monkeypatch.delenv("AUTOVENV_SOCKET", raising=False)
+    monkeypatch.delenv("XDG_RUNTIME_DIR", raising=False)
+    monkeypatch.setenv("HOME", str(HOME))
+    assert daemon.socket_path() == str(HOME / ".autovenv" / "autovenv.sock")
+    monkeypatch.setenv("XDG_RUNTIME_DIR", str(tmpdir))
+    assert daemon.socket_path().startswith(str(tmpdir) + "/autovenv-")
+    PROJFOLDER = HOME / "proj"
+    PROJFOLDER.mkdir(parents=True)
+    (PROJFOLDER / "requirements.txt").touch()
+
+    kwargs = dict(data_dir=str(HOME / "datadir"), home=str(HOME))
+    sock = str(tmpdir / "s.sock")
+
+    monkeypatch.setattr(daemon.HookHandler, "timeout", 0.2)
+    server = daemon.make_server(sock, **kwargs)
+    t = threading.Thread(target=server.serve_forever)
+    t.start()
+
+    try:
+        assert daemon.is_listening(sock)
+
+        # a client that never sends anything doesn't hold up the others
+        stalled = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        stalled.connect(sock)
+
+        direct = autovenv.VirtualEnvs(cwd=str(PROJFOLDER), virtual_env="", **kwargs)
+        answer = daemon.query(sock, "bash", str(PROJFOLDER), "")
+        assert answer == direct.suggested_command(shell="bash")
+        assert answer.startswith("eval ")
+
+        assert daemon.query(sock, "fish", str(HOME), "") == ""
+
+        try:
+            daemon.query(sock, "zsh", str(HOME), "")
+            assert False
+        except RuntimeError as e:
+            assert "unknown shell" in str(e)
+
+        # one warm VirtualEnvs answers for whichever folder is asked about
+        venvs = server.venvs
+        assert daemon.query(sock, "bash", str(PROJFOLDER), "") == answer
+        assert server.venvs is venvs
+        stalled.close()
+    finally:
+        server.shutdown()
+        server.server_close()
+        t.join()
+
+    assert not os.path.exists(sock)
+
+
+# What "python -m autovenv bash" may import beyond the interpreter's own
+# startup: these of our modules, and at most a few small ones from the
+# stdlib. Checked by name rather than by time, which depends too much on
+# the machine (and whatever else it's doing) to gate anything.
+HOOK_MODULES = {
+    "autovenv",
+    "autovenv.tracing",
+    "autovenv.util",
+    "autovenv.command",
+    "autovenv.virtualenvs",
+    "autovenv.overrides",
+    "autovenv.resolution",
+    "autovenv.wheelhouse",
+}
+HOOK_STDLIB_BUDGET = 5
+
+HOOK_FORBIDDEN_IMPORTS = {
+    "pkg_resources",
+    "appdirs",
+    "argparse",
+    "subprocess",
+    "shutil",
+    "pathlib",
+    "shlex",
+    "yaml",
+    "json",
+}
+
+
+# Activating a venv also takes these, to write the activation commands
+# and record the activation in the inventory.
+HOOK_ACTIVATE_MODULES = {"autovenv.activation", "autovenv.inventory"}
+
+
+def hook_imports(home, cwd):
+    import subprocess
+
+    env = dict(os.environ, HOME=str(home), PYTHONPATH=os.getcwd())
+    env.pop("VIRTUAL_ENV", None)
+    env.pop("AUTOVENV_TRACE", None)
+
+    out = subprocess.run(
+        [sys.executable, "-X", "importtime", "-m", "autovenv", "bash"],
+        cwd=str(cwd),
+        env=env,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        check=True,
+    )
+
+    # a module's imports are listed just before it, so ours start after
+    # the top-level import before the autovenv package
+    imported = []
+    for line in out.stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        name = line.rsplit("|", 1)[1]
+        if not name.startswith("  ") and "autovenv" not in imported:
+            if name.strip() != "autovenv":
+                imported = []
+                continue
+        imported.append(name.strip())
+    return imported
+
+
+def check_hook_imports(home, cwd, modules):
+    # the second run is the usual case, with the config cache in place
+    hook_imports(home, cwd)
+    imported = set(hook_imports(home, cwd))
+
+    assert not HOOK_FORBIDDEN_IMPORTS & imported
+    ours = {name for name in imported if name.split(".")[0] == "autovenv"}
+    assert ours == modules
+    assert len(imported - ours) <= HOOK_STDLIB_BUDGET, imported - ours
+
+
+def test_hook_import_budget(tmpdir):
+    tmpdir = Path(str(tmpdir))
+    check_hook_imports(tmpdir, tmpdir, HOOK_MODULES)
+
+    # and inside a project, activating its venv
+    PROJFOLDER = tmpdir / "proj"
+    PROJFOLDER.mkdir()
+    (PROJFOLDER / "requirements.txt").touch()
+    v = autovenv.VirtualEnvs(home=str(tmpdir), cwd=str(PROJFOLDER), virtual_env="")
+    os.makedirs(v.correct_venv_path)
+    assert "deactivate ()" in v.suggested_command("bash")
+
+    check_hook_imports(tmpdir, PROJFOLDER, HOOK_MODULES | HOOK_ACTIVATE_MODULES)
+
+
+def test_config_cache(tmpdir):
+    tmpdir = Path(str(tmpdir))
+    DATA_DIR = tmpdir / "datadir"
+    CONFIGPATH = DATA_DIR / "config"
+
+    v = autovenv.VirtualEnvs(data_dir=str(DATA_DIR), home=str(tmpdir), cwd=str(tmpdir))
+    assert not CONFIGPATH.exists()
+
+    CONFIG = {
+        "file_names": ["setup.py"],
+        "override": {str(tmpdir / "x"): {"pyversion": "3.9", "venvname": None}},
+    }
+    v.save_config(CONFIG)
+    assert v.config == CONFIG
+    assert "~/x: '3.9'" in CONFIGPATH.read_text()
+    assert (DATA_DIR / "config.cache").exists()
+
+    stamp = CONFIGPATH.stat().st_mtime_ns
+
+    def no_yaml(self):
+        raise AssertionError("config should come from the cache")
+
+    original_load_config = autovenv.VirtualEnvs.load_config
+    autovenv.VirtualEnvs.load_config = no_yaml
+    try:
+        v2 = autovenv.VirtualEnvs(
+            data_dir=str(DATA_DIR), home=str(tmpdir), cwd=str(tmpdir)
+        )
+        assert v2.config == CONFIG
+        v2.save_config(v2.config)
+    finally:
+        autovenv.VirtualEnvs.load_config = original_load_config
+
+    assert CONFIGPATH.stat().st_mtime_ns == stamp
+
+    CONFIGPATH.write_text("file_names:\n- tox.ini\n")
+    v3 = autovenv.VirtualEnvs(data_dir=str(DATA_DIR), home=str(tmpdir), cwd=str(tmpdir))
+    assert v3.config == {"file_names": ["tox.ini"]}
+
+
+def test_resolution_reads_each_file_once(monkeypatch, tmpdir):
+    import io
+    import collections
+    from autovenv.resolution import Resolution
+
+    tmpdir = Path(str(tmpdir))
+    HOME = tmpdir / "home"
+    PROJFOLDER = HOME / "proj"
+    DEEPEST = PROJFOLDER / "a" / "b"
+    DEEPEST.mkdir(parents=True)
+    (PROJFOLDER / "requirements.txt").touch()
+    (PROJFOLDER / ".python-version").write_text("10.11.12\n")
+    if sys.platform == "darwin":
+        PYVERSIONS = HOME / ".pyversions"
+    else:
+        PYVERSIONS = HOME / "datadir" / "pyversions"
+    PYTHON = PYVERSIONS / "10.11.12" / "bin" / "python"
+    PYTHON.parent.mkdir(parents=True)
+    PYTHON.touch()
+
+    stats = collections.Counter()
+    opens = collections.Counter()
+    listings = collections.Counter()
+
+    real_stat = os.stat
+    real_open = io.open
+    real_scandir = os.scandir
+
+    def counting_stat(path, *args, **kwargs):
+        stats[str(path)] += 1
+        return real_stat(path, *args, **kwargs)
+
+    def counting_open(path, *args, **kwargs):
+        opens[str(path)] += 1
+        return real_open(path, *args, **kwargs)
+
+    def counting_scandir(path, *args, **kwargs):
+        listings[str(path)] += 1
+        return real_scandir(path, *args, **kwargs)
+
+    monkeypatch.setattr(os, "stat", counting_stat)
+    monkeypatch.setattr(io, "open", counting_open)
+    monkeypatch.setattr(os, "scandir", counting_scandir)
+
+    v = autovenv.VirtualEnvs(
+        data_dir=str(HOME / "datadir"), home=str(HOME), cwd=str(DEEPEST), virtual_env=""
+    )
+    v.suggested_command()
+    v.correct_venv_path
+    v.current_pythonbuild_name
+    v.should_use_framework_build
+    v.pythonversion_file_path
+
+    assert opens[str(PROJFOLDER / ".python-version")] == 1
+    assert max(stats.values()) == 1
+    # one listing per folder from the cwd up to home, rather than a stat
+    # per marker file per folder
+    assert stats[str(PROJFOLDER / "requirements.txt")] == 0
+    assert listings == {str(p): 1 for p in (DEEPEST, DEEPEST.parent, PROJFOLDER, HOME)}
+
+    r = v.resolution
+    assert r is v.resolution
+    assert isinstance(r, Resolution)
+    assert r.projfolder == str(PROJFOLDER)
+    assert r.venv_name == "proj"
+    assert r.pythonbuild == "10.11.12"
+    assert r.venv_path == os.path.join(v.venvspath, "10.11.12", "proj")
+    assert not r.venv_exists
+    assert not r.venv_active
+
+    try:
+        r.venv_name = "other"
+        assert False
+    except AttributeError:
+        pass
+
+    assert v.resolve(str(HOME)).venv_name == ""
+
+
+def test_override_index(tmpdir):
+    from autovenv.overrides import OverrideIndex, parse_override
+
+    index = OverrideIndex.build(
+        {
+            "/src/foo": parse_override("3.9/foovenv"),
+            "/src/foo/deeper": parse_override("3.11"),
+            "/src/foo/deeper/still": parse_override("/stillvenv"),
+        }
+    )
+
+    assert index.longest_match("/src/foobar", "venvname") == (None, None)
+    assert index.longest_match("/src", "venvname") == (None, None)
+    assert index.longest_match("/src/foo", "venvname") == ("/src/foo", "foovenv")
+    assert index.venvname("/src/foo/deeper/x") == "foovenv"
+    assert index.pyversion("/src/foo/deeper/x") == "3.11"
+    assert index.longest_match("/src/foo/deeper/still/x", "venvname") == (
+        "/src/foo/deeper/still",
+        "stillvenv",
+    )
+    assert index.pyversion("/src/foo/deeper/still/x") == "3.11"
+    assert not OverrideIndex.build({})
+
+    tmpdir = Path(str(tmpdir))
+    HOME = tmpdir / "home"
+    MONOREPO = HOME / "mono"
+    SERVICE = MONOREPO / "services" / "api"
+    SERVICE.mkdir(parents=True)
+    (MONOREPO / "requirements.txt").touch()
+
+    v = autovenv.VirtualEnvs(
+        data_dir=str(HOME / "datadir"), home=str(HOME), cwd=str(SERVICE)
+    )
+    assert v.correct_venv_name == "mono"
+
+    config = dict(v.config, override={str(SERVICE): parse_override("/api")})
+    v.save_config(config)
+    assert v.correct_venv_name == "api"
+    assert v.likely_projfolder == str(SERVICE)
+    assert v.resolve(str(MONOREPO / "services")).venv_name == "mono"
+    assert pf(str(SERVICE / "x"), str(HOME), config=v.config) == str(SERVICE)
+
+
+def test_project_boundary(tmpdir):
+    import subprocess
+    from autovenv.overrides import parse_override
+
+    tmpdir = Path(str(tmpdir))
+    HOME = tmpdir / "home"
+    PROJFOLDER = HOME / "proj"
+    SUB = PROJFOLDER / "sub"
+    SUB.mkdir(parents=True)
+    (PROJFOLDER / "requirements.txt").touch()
+
+    kwargs = dict(data_dir=str(HOME / "datadir"), home=str(HOME), cwd=str(SUB))
+
+    v = autovenv.VirtualEnvs(virtual_env="", **kwargs)
+    venv = v.correct_venv_path
+    assert v.resolution.boundary == str(PROJFOLDER)
+
+    stamp = stamp_path(v.data_dir, str(PROJFOLDER), venv)
+    boundary = (
+        "AUTOVENV_ROOT={}; AUTOVENV_VENV={}; AUTOVENV_STAMP={}; "
+        "AUTOVENV_CONFIG={}; AUTOVENV_PYVERSIONS={}".format(
+            PROJFOLDER, venv, stamp, v.configpath, v.pyversionspath
+        )
+    )
+    assert v.suggested_command("bash").startswith("eval " + boundary + "; ")
+    assert v.suggested_command("fish").startswith(
+        "set -g AUTOVENV_ROOT {}; set -g AUTOVENV_VENV {}; ".format(PROJFOLDER, venv)
+    )
+
+    os.makedirs(venv)
+    active = autovenv.VirtualEnvs(virtual_env=venv, **kwargs)
+    assert active.suggested_command("bash") == "eval " + boundary
+
+    # the hook skips asking again within the project, until one of the
+    # inputs changes
+    script = """
+        autovenv() {{ :; }}
+        AUTOVENV_SOCKET=/nonexistent; source {hook}
+        {boundary}; VIRTUAL_ENV={venv}; builtin cd {sub}
+        _autovenv_in_root && echo same
+        touch {projfolder}/.python-version
+        _autovenv_in_root || echo changed
+    """.format(
+        hook=Path(__file__).parent.parent / "scripts" / "autovenv.sh",
+        boundary=boundary,
+        venv=venv,
+        sub=SUB,
+        projfolder=PROJFOLDER,
+    )
+    out = subprocess.check_output(["bash", "-c", script], env=dict(os.environ))
+    assert out.decode().split() == ["same", "changed"]
+
+    config = dict(v.config, override={str(SUB / "inner"): parse_override("/inner")})
+    v.save_config(config)
+    assert v.resolution.boundary == ""
+    assert "AUTOVENV_ROOT" not in v.suggested_command("bash")
+
+
+def test_wheelhouse(tmpdir):
+    from autovenv import wheelhouse
+
+    tmpdir = Path(str(tmpdir))
+    HOME = tmpdir / "home"
+    PROJFOLDER = HOME / "proj"
+    PROJFOLDER.mkdir(parents=True)
+    (PROJFOLDER / "requirements.txt").touch()
+    DATA_DIR = HOME / "datadir"
+
+    v = autovenv.VirtualEnvs(
+        data_dir=str(DATA_DIR), home=str(HOME), cwd=str(PROJFOLDER)
+    )
+    WHEELHOUSE = DATA_DIR / "wheelhouse" / "system"
+    assert v.wheelhouse == str(WHEELHOUSE)
+
+    venv = v.correct_venv_path
+    plain = "{} -m venv {}".format(sys.executable, venv)
+    assert v.venv_creation_command(venv) == plain
+    assert "--upgrade-deps" not in v.suggested_command()
+
+    WHEELHOUSE.mkdir(parents=True)
+    for filename in (
+        "pip-24.0-py3-none-any.whl",
+        "wheel-0.43.0-py3-none-any.whl",
+        "setuptools-69.5.1-py3-none-any.whl",
+        "packaging-24.0-py3-none-any.whl",
+    ):
+        (WHEELHOUSE / filename).touch()
+
+    assert sorted(wheelhouse.find_wheels(str(WHEELHOUSE))) == [
+        "pip",
+        "setuptools",
+        "wheel",
+    ]
+
+    seeded = v.venv_creation_command(venv)
+    assert seeded == (
+        "{python} -m venv --without-pip {venv} && "
+        "{venv}/bin/python {wh}/pip-24.0-py3-none-any.whl/pip install --quiet "
+        "--disable-pip-version-check --no-index --find-links {wh} "
+        "pip setuptools wheel"
+    ).format(python=sys.executable, venv=venv, wh=WHEELHOUSE)
+    assert seeded not in v.suggested_command()
+
+    v.save_config(dict(v.config, clone_template=False))
+    assert seeded in v.suggested_command()
+
+
+def test_clone_template(tmpdir):
+    from autovenv import clone
+
+    tmpdir = Path(str(tmpdir))
+    HOME = tmpdir / "home"
+    PROJFOLDER = HOME / "proj"
+    PROJFOLDER.mkdir(parents=True)
+    (PROJFOLDER / "requirements.txt").touch()
+
+    v = autovenv.VirtualEnvs(
+        data_dir=str(HOME / "datadir"), home=str(HOME), cwd=str(PROJFOLDER)
+    )
+    TEMPLATE = Path(v.template_path)
+    assert TEMPLATE.name == ".template"
+
+    (TEMPLATE / "bin").mkdir(parents=True)
+    (TEMPLATE / "lib" / "site-packages").mkdir(parents=True)
+    (TEMPLATE / "lib64").symlink_to("lib")
+    (TEMPLATE / "bin" / "python").symlink_to(sys.executable)
+    (TEMPLATE / "pyvenv.cfg").write_text(
+        "command = python -m venv {}\n".format(TEMPLATE)
+    )
+    (TEMPLATE / "bin" / "activate").write_text(
+        'VIRTUAL_ENV="{}"\nVIRTUAL_ENV_PROMPT="(.template) "\n'.format(TEMPLATE)
+    )
+    (TEMPLATE / "bin" / "pip").write_text("#!{}/bin/python\n".format(TEMPLATE))
+    (TEMPLATE / "bin" / "pip").chmod(0o755)
+    (TEMPLATE / "lib" / "site-packages" / "mod.py").write_text("x = 1\n")
+
+    try:
+        clone.clone_venv(str(TEMPLATE), v.correct_venv_path)
+        assert False
+    except clone.CloneError:
+        pass
+
+    clone.mark_template_ready(str(TEMPLATE))
+    assert v.clone_virtualenv("proj")
+
+    VENV = Path(v.correct_venv_path)
+    assert not (VENV / clone.READY_MARKER).exists()
+    assert (VENV / "pyvenv.cfg").read_text() == "command = python -m venv {}\n".format(
+        VENV
+    )
+    assert (VENV / "bin" / "activate").read_text() == (
+        'VIRTUAL_ENV="{}"\nVIRTUAL_ENV_PROMPT="(proj) "\n'.format(VENV)
+    )
+    assert (VENV / "bin" / "pip").read_text() == "#!{}/bin/python\n".format(VENV)
+    assert os.access(str(VENV / "bin" / "pip"), os.X_OK)
+    assert os.readlink(str(VENV / "bin" / "python")) == sys.executable
+    assert os.readlink(str(VENV / "lib64")) == "lib"
+    assert (VENV / "lib" / "site-packages" / "mod.py").read_text() == "x = 1\n"
+    assert not list(VENV.parent.glob("*.cloning-*"))
+
+    try:
+        clone.clone_venv(str(TEMPLATE), str(VENV))
+        assert False
+    except clone.CloneError:
+        pass
+
+
+def test_template_built_once(monkeypatch, tmpdir):
+    import threading
+
+    tmpdir = Path(str(tmpdir))
+    HOME = tmpdir / "home"
+    HOME.mkdir()
+
+    builds = []
+
+    def fake_creation(self, path):
+        builds.append(path)
+        time.sleep(0.2)
+        (Path(path) / "bin").mkdir(parents=True)
+        (Path(path) / "bin" / "python").symlink_to(sys.executable)
+        (Path(path) / "pyvenv.cfg").write_text("home = {}\n".format(path))
+        return 0
+
+    monkeypatch.setattr(autovenv.VirtualEnvs, "run_venv_creation", fake_creation)
+
+    def ensure():
+        v = autovenv.VirtualEnvs(
+            data_dir=str(HOME / "datadir"), home=str(HOME), cwd=str(HOME)
+        )
+        results.append(v.ensure_template())
+
+    results = []
+    threads = [threading.Thread(target=ensure) for _ in range(3)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    v = autovenv.VirtualEnvs(
+        data_dir=str(HOME / "datadir"), home=str(HOME), cwd=str(HOME)
+    )
+    TEMPLATE = Path(v.template_path)
+    assert results == [True, True, True]
+    assert len(builds) == 1
+    assert (TEMPLATE / "pyvenv.cfg").read_text() == "home = {}\n".format(TEMPLATE)
+    assert not list(TEMPLATE.parent.glob(".template.building-*"))
+
+    assert v.ensure_template(rebuild=True)
+    assert len(builds) == 2
+    assert (TEMPLATE / "pyvenv.cfg").read_text() == "home = {}\n".format(TEMPLATE)
+    assert not list(TEMPLATE.parent.glob(".template.*-*"))
+
+
+def test_background_create(monkeypatch, tmpdir):
+    from autovenv import background
+
+    tmpdir = Path(str(tmpdir))
+    HOME = tmpdir / "home"
+    PROJFOLDER = HOME / "proj"
+    PROJFOLDER.mkdir(parents=True)
+    (PROJFOLDER / "requirements.txt").touch()
+
+    kwargs = dict(data_dir=str(HOME / "datadir"), home=str(HOME), cwd=str(PROJFOLDER))
+    v = autovenv.VirtualEnvs(virtual_env="", **kwargs)
+    v.save_config(dict(v.config, background_create=True))
+    venv = v.correct_venv_path
+
+    started = []
+
+    def fake_start(v, r):
+        job = background.Job.for_venv(v, r.venv_path)
+        autovenv.mkdir_p(background.builds_path(v.data_dir))
+        job.write_status(state=background.RUNNING, venv=r.venv_path, pid=os.getpid())
+        started.append(r.venv_path)
+        return job
+
+    monkeypatch.setattr(background, "start", fake_start)
+
+    v.info()
+    assert "creating proj in the background" in v.suggested_command()
+    assert started == []
+
+    command = v.suggested_command(hook=True)
+    assert started == [venv]
+    assert "creating proj in the background" in command
+    assert "source" not in command
+
+    fresh = autovenv.VirtualEnvs(virtual_env="", **kwargs)
+    command = fresh.suggested_command(hook=True)
+    assert started == [venv]
+    assert "still creating proj" in command
+
+    job = background.Job.for_venv(v, venv)
+    jobs = list(background.jobs(v.data_dir))
+    assert [(j.key, state) for j, _, state in jobs] == [(job.key, background.RUNNING)]
+
+    os.makedirs(venv)
+    command = autovenv.VirtualEnvs(virtual_env="", **kwargs).suggested_command()
+    assert "source" not in command
+
+    # a second job, started by another shell at the same time as the
+    # first, finds the venv made once it gets the lock
+    job.write_status(state=background.RUNNING, venv=venv, pid=os.getpid())
+    assert background.run(autovenv.VirtualEnvs(virtual_env="", **kwargs)) == 0
+    assert job.read_status() is None
+    job.write_status(state=background.RUNNING, venv=venv, pid=os.getpid())
+
+    job.clear_status()
+    command = autovenv.VirtualEnvs(virtual_env="", **kwargs).suggested_command()
+    assert command.endswith(activate_command("bash", venv, switching=False))
+
+    job.write_status(state=background.RUNNING, venv=venv, pid=None)
+    assert job.state() == background.INTERRUPTED
+
+
+FAKE_PYTHON = """#!{executable}
+import os, sys
+
+venv = sys.argv[-1]
+os.makedirs(os.path.join(venv, "bin"))
+with open(os.path.join(venv, "pyvenv.cfg"), "w") as f:
+    f.write("home = {{}}\\n".format(os.path.dirname(sys.argv[0])))
+with open(os.path.join(venv, "bin", "activate"), "w") as f:
+    f.write("VIRTUAL_ENV={{}}\\n".format(venv))
+os.symlink(sys.argv[0], os.path.join(venv, "bin", "python"))
+"""
+
+
+def test_recreate_all(tmpdir):
+    from autovenv import bulk
+
+    tmpdir = Path(str(tmpdir))
+    HOME = tmpdir / "home"
+    DATA_DIR = HOME / "datadir"
+    PYVERSIONS = (
+        HOME / ".pyversions" if sys.platform == "darwin" else DATA_DIR / "pyversions"
+    )
+
+    fake = PYVERSIONS / "fake" / "bin" / "python"
+    fake.parent.mkdir(parents=True)
+    fake.write_text(FAKE_PYTHON.format(executable=sys.executable))
+    fake.chmod(0o755)
+
+    for name in ("one", "two"):
+        (HOME / name).mkdir(parents=True)
+        (HOME / name / "requirements.txt").touch()
+        (HOME / name / ".python-version").write_text("fake\n")
+        v = autovenv.VirtualEnvs(
+            data_dir=str(DATA_DIR), home=str(HOME), cwd=str(HOME / name)
+        )
+        assert v.create() == 0
+
+    # from before projects were recorded, for a python build since removed
+    LEGACY = Path(v.venvspath) / "gone" / "legacy"
+    (LEGACY / "bin").mkdir(parents=True)
+    (LEGACY / "pyvenv.cfg").write_text("home = /nowhere\n")
+    (Path(v.venvspath) / "fake" / "half.cloning-123").mkdir()
+
+    venvs = sorted(bulk.find_venvs(v))
+    assert [(x.build, x.name, x.project) for x in venvs] == [
+        ("fake", "one", str(HOME / "one")),
+        ("fake", "two", str(HOME / "two")),
+        ("gone", "legacy", None),
+    ]
+
+    marker = Path(venvs[0].path) / "old"
+    marker.touch()
+
+    assert v.recreate_all(jobs=2) == 1
+    assert not marker.exists()
+    assert sorted(bulk.find_venvs(v)) == venvs
+    assert (LEGACY / "pyvenv.cfg").exists()
+
+    logs = Path(bulk.logs_path(v.data_dir, "recreate"))
+    assert "DELETING VIRTUALENV" in (logs / "fake__one.log").read_text()
+    assert "no python at" in (logs / "gone__legacy.log").read_text()
+
+
+def test_create_clears_failed_job(capsys, tmpdir):
+    from autovenv import background
+
+    tmpdir = Path(str(tmpdir))
+    HOME = tmpdir / "home"
+    PROJFOLDER = HOME / "proj"
+    PROJFOLDER.mkdir(parents=True)
+    (PROJFOLDER / "requirements.txt").touch()
+    (PROJFOLDER / ".python-version").write_text("fake\n")
+
+    kwargs = dict(data_dir=str(HOME / "datadir"), home=str(HOME), cwd=str(PROJFOLDER))
+    v = autovenv.VirtualEnvs(virtual_env="", **kwargs)
+    v.save_config(dict(v.config, background_create=True))
+    fake = Path(v.pyversionspath) / "fake" / "bin" / "python"
+    fake.parent.mkdir(parents=True)
+    fake.write_text(FAKE_PYTHON.format(executable=sys.executable))
+    fake.chmod(0o755)
+
+    # a background job that failed, then a create run by hand
+    job = background.Job.for_venv(v, v.correct_venv_path)
+    autovenv.mkdir_p(background.builds_path(v.data_dir))
+    job.write_status(state=background.FAILED, venv=v.correct_venv_path)
+    assert "in the background failed" in v.suggested_command()
+
+    assert autovenv.VirtualEnvs(virtual_env="", **kwargs).create() == 0
+    assert job.read_status() is None
+
+    v = autovenv.VirtualEnvs(virtual_env="", **kwargs)
+    assert "in the background" not in v.suggested_command()
+    capsys.readouterr()
+    v.info()
+    assert "Background build" not in capsys.readouterr().out
+
+
+def test_check(capsys, tmpdir):
+    import shutil
+    from autovenv import health
+    from autovenv.util import read_pyvenv_cfg
+
+    tmpdir = Path(str(tmpdir))
+    HOME = tmpdir / "home"
+    DATA_DIR = HOME / "datadir"
+
+    v = autovenv.VirtualEnvs(data_dir=str(DATA_DIR), home=str(HOME), cwd=str(HOME))
+    for build in ("fake", "other"):
+        fake = Path(v.pyversionspath) / build / "bin" / "python"
+        fake.parent.mkdir(parents=True)
+        fake.write_text(FAKE_PYTHON.format(executable=sys.executable))
+        fake.chmod(0o755)
+
+    venvs = {}
+    for name, build in (("one", "fake"), ("two", "fake"), ("three", "other")):
+        (HOME / name).mkdir(parents=True)
+        (HOME / name / "requirements.txt").touch()
+        (HOME / name / ".python-version").write_text(build + "\n")
+        v = autovenv.VirtualEnvs(
+            data_dir=str(DATA_DIR), home=str(HOME), cwd=str(HOME / name)
+        )
+        assert v.create() == 0
+        venvs[name] = v.resolution.venv_path
+
+    cfg = read_pyvenv_cfg(venvs["one"])
+    assert cfg[health.BASE_KEY] == str(
+        Path(v.pyversionspath) / "fake" / "bin" / "python"
+    )
+    assert all(health.problem(path) is None for path in venvs.values())
+
+    capsys.readouterr()
+    assert v.check() == 0
+    assert "checked 3 venvs, 0 broken" in capsys.readouterr().out
+
+    # the fake build rebuilt in place, the other one removed
+    fake = Path(v.pyversionspath) / "fake" / "bin" / "python"
+    fake.unlink()
+    fake.write_text(FAKE_PYTHON.format(executable=sys.executable))
+    fake.chmod(0o755)
+    shutil.rmtree(str(Path(v.pyversionspath) / "other"))
+
+    assert "has changed" in health.problem(venvs["one"])
+    assert "is gone" in health.problem(venvs["three"])
+
+    v = autovenv.VirtualEnvs(
+        data_dir=str(DATA_DIR), home=str(HOME), cwd=str(HOME / "one")
+    )
+    assert "echo" not in v.suggested_command()
+    v.save_config(dict(v.config, check_on_activate=True))
+    v = autovenv.VirtualEnvs(
+        data_dir=str(DATA_DIR), home=str(HOME), cwd=str(HOME / "one")
+    )
+    command = v.suggested_command()
+    assert "echo 'AUTOVENV: one looks broken, its python has changed" in command
+    assert command.endswith(activate_command("bash", venvs["one"], switching=False))
+
+    capsys.readouterr()
+    assert v.check() == 1
+    out = capsys.readouterr().out
+    assert "checked 3 venvs, 3 broken" in out
+    assert "BROKEN  fake/one (~/one): its python has changed" in out
+
+    assert v.check(fix=True, jobs=2) == 1
+    assert health.problem(venvs["one"]) is None
+    assert health.problem(venvs["two"]) is None
+    assert health.problem(venvs["three"]) is not None
+
+    v = autovenv.VirtualEnvs(
+        data_dir=str(DATA_DIR), home=str(HOME), cwd=str(HOME / "one")
+    )
+    assert "echo" not in v.suggested_command()
+
+
+def test_scan(capsys, tmpdir):
+    import shutil
+    from autovenv import bulk
+
+    tmpdir = Path(str(tmpdir))
+    HOME = tmpdir / "home"
+    DATA_DIR = HOME / "datadir"
+    MONO = HOME / "mono"
+
+    for project in ("a", "b", "b/sub", "c", "node_modules/pkg", "a/.venv/lib"):
+        (MONO / project).mkdir(parents=True)
+        (MONO / project / "requirements.txt").touch()
+    (MONO / ".git").mkdir()
+    (MONO / "a" / ".venv" / "pyvenv.cfg").touch()
+    for project in ("a", "b", "c"):
+        (MONO / project / ".python-version").write_text("fake\n")
+
+    v = autovenv.VirtualEnvs(data_dir=str(DATA_DIR), home=str(HOME), cwd=str(HOME))
+    fake = Path(v.pyversionspath) / "fake" / "bin" / "python"
+    fake.parent.mkdir(parents=True)
+    fake.write_text(FAKE_PYTHON.format(executable=sys.executable))
+    fake.chmod(0o755)
+    os.makedirs(v.resolve(str(MONO / "c")).venv_path)
+
+    projects = list(bulk.find_projects(v, str(MONO)))
+    assert [(x.project, x.build) for x in projects] == [
+        (str(MONO / name), "fake") for name in ("a", "b", "c")
+    ]
+
+    # same folder name, so the same venv name: the second is skipped
+    for project in ("x/api", "y/api", "y/api/sub"):
+        (MONO / "clash" / project).mkdir(parents=True)
+        (MONO / "clash" / project / "requirements.txt").touch()
+    capsys.readouterr()
+    clashing = list(bulk.find_projects(v, str(MONO / "clash")))
+    assert [x.project for x in clashing] == [str(MONO / "clash" / "x" / "api")]
+    assert capsys.readouterr().out == (
+        "AUTOVENV: WARNING ~/mono/clash/y/api would share api with"
+        " ~/mono/clash/x/api, skipping it (give one of them a venvname override)\n"
+    )
+    shutil.rmtree(str(MONO / "clash"))
+
+    capsys.readouterr()
+    assert v.scan(str(MONO), dry_run=True) == 0
+    out = capsys.readouterr().out
+    assert "found 3 projects under {}, 2 without a venv".format(MONO) in out
+    assert "would create fake/a (for ~/mono/a)" in out
+    assert not os.path.exists(projects[0].path)
+
+    assert v.scan(str(MONO), jobs=2) == 0
+    assert all(bulk.is_venv(x.path) for x in projects[:2])
+    out = capsys.readouterr().out
+    assert "ok      fake/a" in out and "ok      fake/b" in out
+
+    assert v.scan(str(MONO)) == 0
+    assert "0 without a venv" in capsys.readouterr().out
+
+
+def test_sync_requirements(tmpdir):
+    from autovenv import sync
+
+    tmpdir = Path(str(tmpdir))
+    HOME = tmpdir / "home"
+    PROJFOLDER = HOME / "proj"
+    PROJFOLDER.mkdir(parents=True)
+    REQS = PROJFOLDER / "requirements.txt"
+    REQS.write_text("requests==2.0\nSix  # for py2\n")
+
+    v = autovenv.VirtualEnvs(
+        data_dir=str(HOME / "datadir"), home=str(HOME), cwd=str(PROJFOLDER)
+    )
+    v.save_config(dict(v.config, sync_requirements=True))
+    VENV = Path(v.correct_venv_path)
+    PIP_LOG = tmpdir / "pip.log"
+
+    (VENV / "bin").mkdir(parents=True)
+    python = VENV / "bin" / "python"
+    python.write_text(
+        "#!{}\nimport sys\nwith open({!r}, 'a') as f:\n"
+        "    f.write(' '.join(sys.argv[4:]) + '\\n')\n".format(
+            sys.executable, str(PIP_LOG)
+        )
+    )
+    python.chmod(0o755)
+
+    def fresh():
+        kwargs = dict(data_dir=v.data_dir, home=v.home, cwd=v.cwd, virtual_env="")
+        return autovenv.VirtualEnvs(**kwargs)
+
+    def suggested():
+        return fresh().suggested_command()
+
+    def pip_calls():
+        calls = PIP_LOG.read_text().splitlines()
+        PIP_LOG.unlink()
+        return calls
+
+    assert "autovenv sync; _OLD_VIRTUAL_PATH=" in suggested()
+    assert fresh().sync() == 0
+    assert pip_calls() == ["install Six requests==2.0"]
+    assert "autovenv sync" not in suggested()
+
+    # same content, new mtime: hashed once, then back to just a stat
+    REQS.write_text(REQS.read_text())
+    assert "autovenv sync" not in suggested()
+    record = sync.read_record(str(VENV))
+    assert record["files"][str(REQS)][0] == sync.file_stamp(str(REQS))
+
+    REQS.write_text("requests==2.1\n")
+    assert "autovenv sync" in suggested()
+    assert fresh().sync() == 0
+    assert pip_calls() == ["uninstall --yes six", "install requests==2.1"]
+
+    assert sync.parse_requirement(
+        'Foo [a, b] >= 1.0 ;python_version >= "3.8" and sys_platform == "linux"'
+    ) == ("foo", 'Foo[a,b]>=1.0; python_version >= "3.8" and sys_platform == "linux"')
+    assert sync.parse_requirement('bar ==1 ; os_name in "posix nt"') == (
+        "bar",
+        'bar==1; os_name in "posix nt"',
+    )
+
+    assert sync.parse_requirement("foo==1.0 --hash=sha256:abc") is None
+    assert sync.parse_requirement("foo==1.0 \\") is None
+
+    REQS.write_text(
+        "requests==2.1 \\\n    --hash=sha256:abc\nsix==1.16 --hash=sha256:def\n"
+    )
+    assert fresh().sync() == 0
+    assert pip_calls() == ["install -r {}".format(REQS)]
+
+    REQS.write_text("requests==2.1\n-e .\n")
+    assert fresh().sync() == 0
+    assert pip_calls() == ["install -r {}".format(REQS)]
+    assert fresh().sync() == 0
+    assert not PIP_LOG.exists()
+
+
+def test_dedupe(tmpdir):
+    from autovenv import store
+
+    tmpdir = Path(str(tmpdir))
+    HOME = tmpdir / "home"
+    HOME.mkdir()
+    v = autovenv.VirtualEnvs(data_dir=str(HOME / "datadir"), home=str(HOME))
+
+    def make_venv(name, content):
+        venv = Path(v.venvspath) / name
+        (venv / "bin").mkdir(parents=True)
+        (venv / "bin" / "pip").write_text("#!{}/bin/python\n".format(venv))
+        (venv / "pyvenv.cfg").write_text("home = /usr/bin\n")
+        package = venv / "lib" / "site-packages" / "pkg"
+        package.mkdir(parents=True)
+        (package / "__init__.py").write_text(content)
+        (package / "empty.py").touch()
+        return venv
+
+    one = make_venv("one", "x = 1\n" * 100)
+    two = make_venv("two", "x = 1\n" * 100)
+    three = make_venv("three", "x = 3\n")
+
+    def inode(venv, relpath="lib/site-packages/pkg/__init__.py"):
+        return (venv / relpath).stat().st_ino
+
+    assert v.dedupe() == 0
+    assert inode(one) == inode(two) != inode(three)
+    assert inode(one, "bin/pip") != inode(two, "bin/pip")
+    assert (one / "lib/site-packages/pkg/__init__.py").read_text() == "x = 1\n" * 100
+
+    stored = list(Path(store.store_path(v.data_dir)).glob("*/*"))
+    assert len(stored) == 2
+
+    stats = store.dedupe_venv(store.store_path(v.data_dir), str(two))
+    assert (stats.files, stats.stored, stats.linked, stats.reclaimed) == (1, 0, 0, 0)
+
+    import shutil
+
+    shutil.rmtree(str(three))
+    stats = store.prune(store.store_path(v.data_dir))
+    assert (stats.pruned, stats.reclaimed) == (1, 6)
+    assert v.dedupe([str(tmpdir)]) == 1
+
+
+def test_inventory(capsys, tmpdir):
+    import json
+    from autovenv import inventory
+
+    tmpdir = Path(str(tmpdir))
+    HOME = tmpdir / "home"
+    PROJFOLDER = HOME / "proj"
+    PROJFOLDER.mkdir(parents=True)
+    (PROJFOLDER / "requirements.txt").touch()
+
+    kwargs = dict(data_dir=str(HOME / "datadir"), home=str(HOME), cwd=str(PROJFOLDER))
+    v = autovenv.VirtualEnvs(virtual_env="", **kwargs)
+    venv = v.correct_venv_path
+
+    event = dict(venv='a "quoted"\\path\n\x01', size=12, time=1.5, project=None)
+    assert json.loads(inventory.encode(event)) == event
+
+    os.makedirs(venv)
+    (Path(venv) / "pyvenv.cfg").write_text("autovenv_project = {}\n".format(PROJFOLDER))
+    v.record_event("create", venv, size=100)
+    v.info()
+    assert inventory.load(v.data_dir)[venv]["last_activated"] is None
+    v.suggested_command(hook=True)
+    entry = inventory.load(v.data_dir)[venv]
+    assert entry["project"] == str(PROJFOLDER)
+    assert entry["size"] == 100
+    assert entry["created"] <= entry["last_activated"]
+
+    capsys.readouterr()
+    v.list_venvs(as_json=True)
+    listed = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert listed == [entry]
+
+    v.delete_virtualenv("proj")
+    assert inventory.load(v.data_dir) == {}
+
+    other = Path(v.venvspath) / "other"
+    other.mkdir()
+    (other / "pyvenv.cfg").write_text("home = /usr/bin\n")
+    inventory.record(v.data_dir, "activate", "/gone")
+    v.rescan_inventory()
+    assert list(inventory.load(v.data_dir)) == [str(other)]
+
+    for _ in range(inventory.COMPACT_SLACK + 1):
+        inventory.record(v.data_dir, "activate", str(other))
+    assert inventory.load(v.data_dir) == inventory.load(v.data_dir)
+    assert len(inventory.read_events(v.data_dir)) == 1
+
+
+def test_gc(capsys, tmpdir):
+    import time
+    from autovenv import garbage, inventory
+
+    tmpdir = Path(str(tmpdir))
+    HOME = tmpdir / "home"
+    PROJFOLDER = HOME / "proj"
+    PROJFOLDER.mkdir(parents=True)
+    (PROJFOLDER / "requirements.txt").touch()
+
+    v = autovenv.VirtualEnvs(
+        data_dir=str(HOME / "datadir"), home=str(HOME), cwd=str(PROJFOLDER)
+    )
+    now = time.time()
+
+    def make_venv(name, project, days_ago, size):
+        path = os.path.join(v.venvspath, name)
+        os.makedirs(path)
+        io.open(os.path.join(path, "pyvenv.cfg"), "w").close()
+        when = now - days_ago * garbage.DAY
+        inventory.record(
+            v.data_dir, "create", path, project=project, size=size, time=when
+        )
+        return path
+
+    current = make_venv("proj", str(PROJFOLDER), 100, 10)
+    orphan = make_venv("orphan", str(HOME / "gone"), 1, 10)
+    old = make_venv("old", str(HOME), 40, 10)
+    recent = make_venv("recent", str(HOME), 2, 30)
+    newest = make_venv("newest", str(HOME), 1, 30)
+
+    assert garbage.parse_size("1.5k") == 1536
+    assert garbage.parse_size("20G") == 20 * 1024**3
+    assert garbage.parse_size(100) == 100
+
+    venvs = inventory.load(v.data_dir).values()
+    protected = garbage.protected_venvs(v)
+    assert current in protected
+
+    evictions = garbage.plan(venvs, protected, max_age_days=30, budget=50)
+    assert [(e.venv, e.reason) for e in evictions] == [
+        (old, "not activated for 40 days"),
+        (orphan, "project gone"),
+        (recent, "over the disk budget"),
+    ]
+
+    # sizes are measured afresh (these were recorded as 30 bytes), and a
+    # dry run doesn't touch the inventory
+    for path in (recent, newest):
+        Path(path, "lib").write_bytes(b"x" * 1000)
+    log = Path(inventory.inventory_path(v.data_dir))
+    logged = log.read_bytes()
+    capsys.readouterr()
+    assert v.gc(dry_run=True, max_age_days=30, budget="1500") == 0
+    out = capsys.readouterr().out
+    assert "would remove {} (over the disk budget, 1000 bytes".format(recent) in out
+    assert log.read_bytes() == logged
+    assert all(os.path.exists(p) for p in (current, orphan, old, recent, newest))
+
+    # only venvs under the venvs folder are ever deleted, whatever the
+    # inventory says
+    elsewhere = HOME / "elsewhere"
+    elsewhere.mkdir()
+    (elsewhere / "pyvenv.cfg").touch()
+    link = Path(v.venvspath) / "link"
+    link.symlink_to(elsewhere)
+    assert garbage.is_collectable(v, old)
+    assert not garbage.is_collectable(v, str(elsewhere))
+    assert not garbage.is_collectable(v, str(link))
+    assert not garbage.is_collectable(v, str(PROJFOLDER))
+    assert not garbage.is_collectable(v, v.venvspath)
+    link.unlink()
+
+    assert v.gc() == 0
+    assert not os.path.exists(orphan)
+    assert sorted(inventory.load(v.data_dir)) == sorted([current, old, recent, newest])
+
+    v.save_config(dict(v.config, gc_max_age_days=30))
+    assert v.gc() == 0
+    assert sorted(inventory.load(v.data_dir)) == sorted([current, recent, newest])
+
+
+def test_trace(tmpdir):
+    import json
+    import subprocess
+
+    tmpdir = Path(str(tmpdir))
+    PROJFOLDER = tmpdir / "proj"
+    PROJFOLDER.mkdir()
+    (PROJFOLDER / "requirements.txt").touch()
+    TRACE = tmpdir / "trace.jsonl"
+
+    env = dict(os.environ, HOME=str(tmpdir), PYTHONPATH=os.getcwd())
+    env.pop("VIRTUAL_ENV", None)
+    env.pop("AUTOVENV_TRACE", None)
+
+    def hook(**extra):
+        subprocess.run(
+            [sys.executable, "-m", "autovenv", "bash"],
+            cwd=str(PROJFOLDER),
+            env=dict(env, **extra),
+            stdout=subprocess.DEVNULL,
+            check=True,
+        )
+
+    hook()
+    assert not TRACE.exists()
+
+    hook(AUTOVENV_TRACE=str(TRACE))
+    hook(AUTOVENV_TRACE=str(TRACE))
+    traces = [json.loads(line) for line in TRACE.read_text().splitlines()]
+    assert len(traces) == 2
+
+    trace = traces[0]
+    assert trace["command"] == "bash"
+    assert trace["cwd"] == str(PROJFOLDER.resolve())
+    assert {"import", "config", "projfolder", "resolve", "suggest"} <= set(
+        trace["phases"]
+    )
+    assert trace["phases"]["resolve"]["calls"] == 1
+    assert trace["counts"]["stat"] > 0
+    assert trace["total_ms"] >= trace["phases"]["suggest"]["ms"]
+
+
+def test_project_root_strategies(tmpdir):
+    tmpdir = Path(str(tmpdir))
+    HOME = tmpdir / "home"
+    OUTER = HOME / "outer"
+    REPO = OUTER / "repo"
+    PKG = REPO / "pkg"
+    DEEP = PKG / "deep"
+    DEEP.mkdir(parents=True)
+    (OUTER / "requirements.txt").touch()
+    (REPO / "requirements.txt").touch()
+    (REPO / ".git").mkdir()
+    (PKG / "pyproject.toml").touch()
+    (DEEP / "requirements.txt").mkdir()  # not a file, so not a marker
+
+    def find(memo=None, **settings):
+        config = dict(DEFAULT_CONFIG, **settings)
+        return pf(str(DEEP), str(HOME), config=config, memo=memo)
+
+    assert find() == str(OUTER)
+    assert find(project_root_strategy="nearest") == str(PKG)
+    assert find(project_root_strategy="vcs") == str(REPO)
+    assert find(project_root_max_depth=3) == str(REPO)
+    assert find(project_root_max_depth=1) is None
+
+    memo = {}
+    assert find(memo=memo) == str(OUTER)
+    assert memo[str(REPO)] == (True, True)
+    assert memo[str(DEEP)] == (False, False)
+    memo[str(HOME)] = (True, False)
+    assert find(memo=memo) == str(HOME)
+
+    try:
+        find(project_root_strategy="innermost")
+        assert False
+    except ValueError:
+        pass
+
+    kwargs = dict(data_dir=str(HOME / "datadir"), home=str(HOME), cwd=str(DEEP))
+    v = autovenv.VirtualEnvs(virtual_env="", **kwargs)
+    assert v.resolution.boundary == str(OUTER)
+    v.save_config(dict(v.config, project_root_strategy="nearest"))
+    assert v.resolution.projfolder == str(PKG)
+    assert v.resolution.boundary == ""
+
+
+def test_partial_python_versions(tmpdir):
+    from autovenv.pyversions import best_build, installed_builds, is_partial
+
+    tmpdir = Path(str(tmpdir))
+    HOME = tmpdir / "home"
+    PROJ = HOME / "proj"
+    PROJ.mkdir(parents=True)
+    (PROJ / "requirements.txt").touch()
+
+    kwargs = dict(data_dir=str(tmpdir / "datadir"), home=str(HOME), cwd=str(PROJ))
+    v = autovenv.VirtualEnvs(virtual_env="", **kwargs)
+    PYVERSIONS = Path(v.pyversionspath)
+    for name in ("3.10.4", "3.11.2", "3.11.9", "3.12.1", "pypy3.10", "3.13.0a1"):
+        (PYVERSIONS / name).mkdir(parents=True)
+
+    names = installed_builds(str(PYVERSIONS), str(tmpdir / "index"))
+    assert "3.11.9" in names
+
+    assert is_partial("3.11") and is_partial("3") and is_partial(">=3.10")
+    assert not is_partial("3.11.9") and not is_partial("pypy3.10")
+
+    assert best_build(names, "3.11") == "3.11.9"
+    assert best_build(names, "3") == "3.12.1"
+    assert best_build(names, ">=3.10,<3.12") == "3.11.9"
+    assert best_build(names, "~=3.10") == "3.12.1"
+    assert best_build(names, "~=3.11.0") == "3.11.9"
+    assert best_build(names, "!=3.12.*") == "3.11.9"
+    assert best_build(names, "2") is None
+    assert best_build(names + ["3.11"], "3.11") == "3.11"
+
+    def resolved(spec):
+        (PROJ / ".python-version").write_text(spec + "\n")
+        return autovenv.VirtualEnvs(virtual_env="", **kwargs).resolution
+
+    r = resolved("3.11")
+    assert r.pythonbuild == "3.11.9"
+    assert r.venv_path == os.path.join(v.venvspath, "3.11.9", "proj")
+    assert resolved(">=3.10,<3.12").pythonbuild == "3.11.9"
+    assert resolved("2.7").pythonbuild == "2.7"
+    assert resolved(">=three").pythonbuild == ">=three"
+    assert resolved("3.10.4").pythonbuild == "3.10.4"
+
+    # the index is reused until a build is added
+    index = Path(v.data_dir) / "pyversions.cache"
+    stamp = index.stat().st_mtime_ns
+    assert resolved("3").pythonbuild == "3.12.1"
+    assert index.stat().st_mtime_ns == stamp
+
+    (PYVERSIONS / "3.12.4").mkdir()
+    os.utime(str(PYVERSIONS), ns=(stamp + 10**9, stamp + 10**9))
+    assert resolved("3").pythonbuild == "3.12.4"
+
+
+def test_resolution_cache(monkeypatch, tmpdir):
+    tmpdir = Path(str(tmpdir))
+    HOME = tmpdir / "home"
+    DATA_DIR = tmpdir / "datadir"
+    PROJ = HOME / "proj"
+    DEEP = PROJ / "a" / "b"
+    DEEP.mkdir(parents=True)
+    (PROJ / "requirements.txt").touch()
+    (PROJ / ".python-version").write_text("3.11.9\n")
+
+    kwargs = dict(data_dir=str(DATA_DIR), home=str(HOME), cwd=str(DEEP))
+    v = autovenv.VirtualEnvs(virtual_env="", **kwargs)
+    PYVERSIONS = Path(v.pyversionspath)
+    for name in ("3.11.9", "3.12.1"):
+        (PYVERSIONS / name).mkdir(parents=True)
+
+    def age():
+        # anything changed in the last couple of seconds isn't cached
+        hour_ago = os.stat(str(tmpdir)).st_mtime - 3600
+        for p in [PYVERSIONS, PYVERSIONS / "3.12.1"] + list(HOME.glob("**/*")):
+            os.utime(str(p), (hour_ago, hour_ago))
+        os.utime(str(HOME), (hour_ago, hour_ago))
+
+    def resolve():
+        listings = []
+        real_scandir = os.scandir
+
+        def counting_scandir(path, *args, **kwargs):
+            listings.append(path)
+            return real_scandir(path, *args, **kwargs)
+
+        monkeypatch.setattr(os, "scandir", counting_scandir)
+        try:
+            return autovenv.VirtualEnvs(virtual_env="", **kwargs).resolution, listings
+        finally:
+            monkeypatch.setattr(os, "scandir", real_scandir)
+
+    first, listings = resolve()
+    assert len(listings) == 4
+    assert not (DATA_DIR / "resolutions").exists()
+
+    age()
+    assert resolve()[0] == first
+    assert len(list((DATA_DIR / "resolutions").iterdir())) == 1
+
+    r, listings = resolve()
+    assert listings == []
+    assert r == first
+    assert r.projfolder == str(PROJ) and r.pythonbuild == "3.11.9"
+
+    # whether the venv exists is always checked afresh
+    Path(r.venv_path).mkdir(parents=True)
+    r, listings = resolve()
+    assert listings == [] and r.venv_exists
+
+    # any input changing means working it out again
+    (PROJ / ".python-version").write_text("3.12\n")
+    r, listings = resolve()
+    assert len(listings) == 4
+    assert r.pythonbuild == "3.12.1"
+
+    age()
+    resolve()
+    assert resolve()[1] == []
+    (PYVERSIONS / "3.12.4").mkdir()
+    assert resolve()[0].pythonbuild == "3.12.4"
+
+    age()
+    resolve()
+    (DEEP / "pyproject.toml").touch()
+    r, listings = resolve()
+    assert len(listings) == 4
+    assert r.projfolder == str(PROJ)
+
+    (PROJ / ".python-version").unlink()
+    age()
+    resolve()
+    assert resolve()[0].pythonbuild is None
+    CURRENT = PYVERSIONS / "current"
+    autovenv.util.create_symlink(str(PYVERSIONS / "3.11.9"), str(CURRENT))
+    assert resolve()[0].pythonbuild == "3.11.9"
+
+    v.save_config(dict(v.config, file_names=["pyproject.toml"]))
+    assert resolve()[0].projfolder == str(DEEP)
+
+    age()
+    v.save_config(dict(v.config, resolution_cache=False))
+    age()
+    resolve()
+    assert len(resolve()[1]) == 4
+
+
+def test_direct_activation(tmpdir):
+    import subprocess
+
+    tmpdir = Path(str(tmpdir))
+    HOME = tmpdir / "home"
+    for name in ("one", "two two"):
+        (HOME / name).mkdir(parents=True)
+        (HOME / name / "requirements.txt").touch()
+
+    kwargs = dict(data_dir=str(HOME / "datadir"), home=str(HOME))
+    v = autovenv.VirtualEnvs(cwd=str(HOME / "one"), virtual_env="", **kwargs)
+    ONE = v.resolution.venv_path
+    TWO = v.resolve(str(HOME / "two two")).venv_path
+    for venv in (ONE, TWO):
+        os.makedirs(venv)
+
+    def suggested(cwd, active):
+        v = autovenv.VirtualEnvs(cwd=str(cwd), virtual_env=active, **kwargs)
+        return v.suggested_command()
+
+    # runs them the way the bash hook does: $(autovenv bash)
+    script = """
+        emit() { printf '%s' "$1"; }
+        show() {
+            echo "$VIRTUAL_ENV|$PATH|$PS1|${PYTHONHOME-unset}|$(type -t deactivate)"
+        }
+        PATH=/usr/bin:/bin; PS1='$ '; export PYTHONHOME=/ph
+        $(emit "$1"); show
+        $(emit "$2"); show
+        $(emit "$3"); show
+        $(emit "$1"); deactivate; show
+    """
+    commands = [
+        suggested(HOME / "one", ""),
+        suggested(HOME / "two two", ONE),
+        suggested(HOME, TWO),
+    ]
+    assert "deactivate" not in commands[1]
+
+    out = subprocess.run(
+        ["bash", "-c", script, "bash"] + commands,
+        stdout=subprocess.PIPE,
+        universal_newlines=True,
+        check=True,
+    ).stdout.splitlines()
+
+    assert out == [
+        "{}|{}/bin:/usr/bin:/bin|(one) $ |unset|function".format(ONE, ONE),
+        "{}|{}/bin:/usr/bin:/bin|(two two) $ |unset|function".format(TWO, TWO),
+        "AUTOVENV: deactivating...",
+        "|/usr/bin:/bin|$ |/ph|",
+        "|/usr/bin:/bin|$ |/ph|",
+    ]
+
+
+def test_resolve_paths(monkeypatch, capsys, tmpdir):
+    import json
+    import collections
+
+    tmpdir = Path(str(tmpdir))
+    HOME = tmpdir / "home"
+    for name in ("one", "two"):
+        for sub in ("a", "b", "c/d"):
+            (HOME / name / sub).mkdir(parents=True)
+        (HOME / name / "requirements.txt").touch()
+    (HOME / "two" / ".python-version").write_text("3.9.1\n")
+    (HOME / "elsewhere").mkdir()
+
+    v = autovenv.VirtualEnvs(
+        data_dir=str(HOME / "datadir"), home=str(HOME), cwd=str(HOME), virtual_env=""
+    )
+    os.makedirs(v.resolve(str(HOME / "one")).venv_path)
+
+    paths = [
+        str(HOME / name / sub) for name in ("one", "two") for sub in ("a", "b", "c/d")
+    ]
+    paths += [str(HOME / "elsewhere"), str(HOME / "one" / "setup.py")]
+
+    listings = collections.Counter()
+    real_scandir = os.scandir
+
+    def counting_scandir(path, *args, **kwargs):
+        listings[str(path)] += 1
+        return real_scandir(path, *args, **kwargs)
+
+    monkeypatch.setattr(os, "scandir", counting_scandir)
+    v.resolve_paths(paths)
+    monkeypatch.setattr(os, "scandir", real_scandir)
+
+    # each folder listed once, however many paths share it
+    assert max(listings.values()) == 1
+    assert not (HOME / "datadir" / "resolutions").exists()
+
+    lines = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert [line["path"] for line in lines] == paths
+    assert lines[0] == dict(
+        path=paths[0],
+        project=str(HOME / "one"),
+        venv_name="one",
+        venv_path=os.path.join(v.venvspath, "one"),
+        python_build=None,
+        exists=True,
+    )
+    assert lines[3]["python_build"] == "3.9.1"
+    assert lines[3]["venv_path"] == os.path.join(v.venvspath, "3.9.1", "two")
+    assert not lines[3]["exists"]
+    assert lines[6] == dict(
+        path=paths[6],
+        project=None,
+        venv_name=None,
+        venv_path=None,
+        python_build=None,
+        exists=False,
+    )
+    assert lines[7]["project"] == str(HOME / "one")
+
+    monkeypatch.setattr(sys, "stdin", io.StringIO(paths[3] + "\n\n" + paths[0] + "\n"))
+    v.resolve_paths()
+    lines = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert [line["venv_name"] for line in lines] == ["two", "one"]
+
+
+def test_api(tmpdir):
+    import asyncio
+    from autovenv import Resolver, Result, AutovenvError
+
+    tmpdir = Path(str(tmpdir))
+    HOME = tmpdir / "home"
+    for name in ("one", "two", "broken"):
+        (HOME / name / "sub").mkdir(parents=True)
+        (HOME / name / "requirements.txt").touch()
+        (HOME / name / ".python-version").write_text("fake\n")
+    (HOME / "broken" / ".python-version").write_text("missing\n")
+    (HOME / "elsewhere").mkdir()
+
+    resolver = Resolver(data_dir=str(HOME / "datadir"), home=str(HOME))
+    fake = Path(resolver._v.pyversionspath) / "fake" / "bin" / "python"
+    fake.parent.mkdir(parents=True)
+    fake.write_text(FAKE_PYTHON.format(executable=sys.executable))
+    fake.chmod(0o755)
+
+    venvspath = resolver._v.venvspath
+    one = os.path.join(venvspath, "fake", "one")
+
+    result = resolver.resolve(str(HOME / "one" / "sub"))
+    assert result == Result(
+        path=str(HOME / "one" / "sub"),
+        project=str(HOME / "one"),
+        venv_name="one",
+        venv_path=one,
+        python_build="fake",
+        exists=False,
+    )
+    assert resolver.resolve(str(HOME / "elsewhere")) == Result(
+        str(HOME / "elsewhere"), None, None, None, None, False
+    )
+    many = resolver.resolve_many([str(HOME / "two"), str(HOME / "one" / "sub")])
+    assert [r.venv_name for r in many] == ["two", "one"]
+
+    assert resolver.ensure(str(HOME / "one" / "sub")).exists
+    assert os.path.isfile(os.path.join(one, "pyvenv.cfg"))
+    assert resolver.resolve(str(HOME / "one")).exists
+    assert resolver.ensure(str(HOME / "one")).exists
+
+    result = asyncio.run(resolver.aensure(str(HOME / "two")))
+    assert result.exists and result.venv_name == "two"
+    assert asyncio.run(resolver.aresolve(str(HOME / "two"))) == result
+
+    for path in (HOME / "elsewhere", HOME / "broken"):
+        try:
+            resolver.ensure(str(path))
+            assert False
+        except AutovenvError as e:
+            message = str(e)
+    assert "failed" in message and "logs" in message
+
+    # a long-lived resolver picks up config changes
+    (HOME / "datadir" / "config").write_text("file_names:\n- setup.py\n")
+    assert resolver.resolve(str(HOME / "one")).venv_path is None